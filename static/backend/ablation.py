@@ -1,15 +1,216 @@
+import random
+
 import torch
+import torch.nn as nn
+
+import metrics
+
+
+def get_layer_name(net, container, layer_number):
+    """
+    Returns the name of a layer in its container, e.g. "conv2d0" for layer_0 of the features.
+
+    :Parameters:
+        net: (Sequential_Net) Network the layer belongs to.
+        container: (string) Name of the container.
+        layer_number: (Integer) Number of the layer in the container.
+    """
+    return net.layer_settings[container]["layer_" + str(layer_number)]["type"] + str(layer_number)
+
+def get_num_units(net, container, layer_number):
+    """
+    Returns the number of units (output channels or neurons) of a layer.
+
+    :Parameters:
+        net: (Sequential_Net) Network the layer belongs to.
+        container: (string) Name of the container.
+        layer_number: (Integer) Number of the layer in the container.
+    """
+    return net.layer_settings[container]["layer_" + str(layer_number)]["outChannel"]
+
+def expand_mask_specs(net, specs):
+    """
+    Returns a list of ablations, each a list of nodes like the ablateNetwork request uses them.
+    A spec is either such a list of nodes or a generator dictionary:
+        {"type": "singleUnits", "containerName": "classifier", "layerNumber": 0} ablates every unit of the layer on its own.
+        {"type": "random", "containerName": "classifier", "layerNumber": 0, "count": 100, "size": 5, "seed": 0}
+        ablates count random subsets of size units.
 
+    :Parameters:
+        net: (Sequential_Net) Network the ablations are for.
+        specs: ([list/Dictionary]) List of specs.
+    """
+    ablations = []
+    for spec in specs:
+        if isinstance(spec, list):
+            ablations.append(spec)
+            continue
 
-def ablate_unit(net, layer, i_unit):
-    if "linear" in layer:
-        net.state_dict()[layer + ".weight"][i_unit]\
-            .copy_(torch.zeros(net.state_dict()[layer + ".weight"].shape[1]))
-        net.state_dict()[layer + ".bias"][i_unit].copy_(torch.tensor(0))
+        container = spec["containerName"]
+        layer_number = spec["layerNumber"]
+        num_units = get_num_units(net, container, layer_number)
+        if spec["type"] == "singleUnits":
+            units_list = [[unit] for unit in range(num_units)]
+        elif spec["type"] == "random":
+            rng = random.Random(spec.get("seed"))
+            size = min(spec.get("size", 1), num_units)
+            units_list = [sorted(rng.sample(range(num_units), size)) for _ in range(spec.get("count", 1))]
+        else:
+            raise ValueError("Unknown ablation type: " + str(spec["type"]))
+
+        for units in units_list:
+            ablations.append([{"containerName": container, "layerNumber": layer_number, "ablatedWeights": units}])
+    return ablations
+
+def build_masks(net, ablations):
+    """
+    Returns a dictionary (container, layer name) -> float tensor with the shape (number of ablations, number of units).
+    A unit is 0 in the row of every ablation that ablates it, otherwise 1. Only ablated layers get a mask.
+
+    :Parameters:
+        net: (Sequential_Net) Network the ablations are for.
+        ablations: ([[Dictionary]]) List of ablations, each a list of nodes.
+    """
+    masks = {}
+    for i_ablation, nodes in enumerate(ablations):
+        for node in nodes:
+            container = node["containerName"]
+            layer_name = get_layer_name(net, container, node["layerNumber"])
+            if (container, layer_name) not in masks:
+                num_units = get_num_units(net, container, node["layerNumber"])
+                masks[(container, layer_name)] = torch.ones(len(ablations), num_units)
+            masks[(container, layer_name)][i_ablation, list(node["ablatedWeights"])] = 0
+    return masks
+
+def apply_mask(x, mask, batch_size, expanded):
+    """
+    Multiplies the units of a layer output with the masks and returns it with the shape (number of masks * batch_size, ...).
+
+    :Parameters:
+        x: (torch.Tensor) Output of a layer, (batch_size, units, ...) or (number of masks * batch_size, units, ...) if expanded.
+        mask: (torch.Tensor) Masks with the shape (number of masks, units).
+        batch_size: (Integer) Number of input samples.
+        expanded: (boolean) Flag if x already holds the output of every mask.
+    """
+    num_masks = mask.shape[0]
+    mask = mask.view(num_masks, 1, mask.shape[1], *([1] * (x.dim() - 2)))
+    if expanded:
+        x = x.view(num_masks, batch_size, *x.shape[1:])
     else:
-        dim = net.state_dict()[layer + ".weight"][i_unit].size()
-        net.state_dict()[layer + ".weight"][i_unit, :, :, :].copy_(torch.zeros((dim[1], dim[2])))
-        net.state_dict()[layer + ".bias"][i_unit].copy_(torch.tensor(0))
+        x = x.unsqueeze(0)
+    return (x * mask).reshape(num_masks * batch_size, *x.shape[2:])
+
+def masked_forward(net, x, masks):
+    """
+    Returns the output of the network for every mask at once with the shape (number of masks * batch_size, outputs),
+    or (batch_size, outputs) if there are no masks. The layers before the first masked layer are computed only once for all masks.
+
+    :Parameters:
+        net: (Sequential_Net) Network that is evaluated, it is not changed.
+        x: (torch.Tensor) Input batch.
+        masks: (Dictionary) (container, layer name) -> mask tensor like build_masks returns it.
+    """
+    batch_size = x.shape[0]
+    expanded = False
+    for container in net.layer_settings:
+        if net.layer_settings[container]["layer_0"]["type"] == "linear":
+            x = x.reshape(x.shape[0], -1)
+        for name, module in net.__getattr__(container).named_children():
+            x = module(x)
+            mask = masks.get((container, name))
+            if mask is not None:
+                x = apply_mask(x, mask, batch_size, expanded)
+                expanded = True
+    return x
+
+@metrics.timed_stage("ablation")
+def sweep(net, ablations, dataset, batch_size = 1000, max_samples = 20000):
+    """
+    Evaluates every ablation on a dataset and returns the accuracy of every ablation and its accuracy per class.
+    Several ablations are batched through the network together, at most max_samples inputs per forward pass.
+
+    :Parameters:
+        net: (Sequential_Net) Network that is evaluated, it is not changed.
+        ablations: ([[Dictionary]]) List of ablations, each a list of nodes.
+        dataset: (dataset_loader.InMemoryDataset) Dataset with data and targets tensors.
+        batch_size: (Integer) Number of samples of the dataset in a forward pass. Default is 1000.
+        max_samples: (Integer) Maximal number of samples times ablations in a forward pass. Default is 20000.
+    """
+    num_classes = max(len(dataset.classes), int(dataset.targets.max()) + 1)
+    class_count = torch.bincount(dataset.targets, minlength=num_classes).double()
+    correct = torch.zeros(len(ablations), num_classes, dtype=torch.float64)
+    chunk_size = max(1, max_samples // batch_size)
+
+    with torch.no_grad():
+        for chunk_start in range(0, len(ablations), chunk_size):
+            chunk = ablations[chunk_start:chunk_start + chunk_size]
+            masks = build_masks(net, chunk)
+            for start in range(0, len(dataset), batch_size):
+                data = dataset.data[start:start + batch_size]
+                target = dataset.targets[start:start + batch_size]
+                # without any mask in the chunk the output is computed once and shared by all ablations
+                pred = masked_forward(net, data, masks).argmax(1).view(-1, len(target)).expand(len(chunk), len(target))
+                hits = pred.eq(target.unsqueeze(0)).double()
+                correct[chunk_start:chunk_start + len(chunk)].index_add_(1, target, hits)
+
+    accuracy = 100. * correct.sum(1) / len(dataset)
+    accuracy_class = torch.where(class_count > 0, correct / class_count.clamp(min=1), torch.zeros_like(correct))
+    return accuracy.numpy(), accuracy_class.numpy()
+
+
+class MaskedNet(nn.Module):
+    """
+    Ablated view of a network. The unit masks are multiplied onto the layer outputs, the weights of the network stay untouched,
+    so the same cached network can be shared by every ablation.
+
+    :Parameters:
+        net: (Sequential_Net) Network that is ablated.
+        nodes: ([Dictionary]) Ablated nodes like {"containerName": "features", "layerNumber": 0, "ablatedWeights": [0, 2]}
+
+    :Attributes:
+        net: (Sequential_Net) network that is ablated.
+        nodes: ([Dictionary]) ablated nodes.
+        masks: (Dictionary) (container, layer name) -> mask tensor with the shape (1, number of units).
+        layer_settings: (collections.OrderedDict) layer settings of the network.
+    """
+    def __init__(self, net, nodes):
+        super(MaskedNet, self).__init__()
+        self.net = net
+        self.nodes = nodes
+        self.masks = build_masks(net, [nodes])
+        self.layer_settings = net.layer_settings
+
+    def forward(self, x):
+        return masked_forward(self.net, x, self.masks)
+
+    def test_start(self, loss, testloader, device = "cpu"):
+        """
+        Tests the ablated model like Sequential_Net.test_start does it for the network.
+
+        :Parameters:
+            loss: (string) Loss Function for the test loss.
+            testloader: (testloader) Test data.
+            device: (String) Divice that will be used for the test. Default is cpu.
+        """
+        return type(self.net).test_start(self, loss, testloader, device)
+
+    def predict(self, _input):
+        """
+        Returns the prediction of the ablated model
+
+        :Parameters:
+            _input: Input that should give a predictions.
+        """
+        return self(_input).tolist()
+
+    def visualize_input(self, x):
+        """
+        Returns a Dictionary of input visualization of the ablated model.
+
+        :Parameters:
+            x: Input that should be vizualize.
+        """
+        return self.net.visualize_input(x, self.masks)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+import base64
+import collections
+
+import torch.nn.functional as F
+
+import neural_network_module as neural_network
+
+import ablation
+
+import responses
+
+
+# outputs that can be captured: of the layer module itself or after its activation
+TAPS = ["layer", "activation"]
+
+# "json" returns nested lists, the binary encodings return base64 payloads of responses.encode_array
+ENCODINGS = ["json"] + responses.ENCODINGS
+
+
+def capture(model, x, layers = None, channels = None, tap = "layer"):
+    """
+    Runs one forward pass and returns the output of the model and the captured layer outputs as
+    collections.OrderedDict container -> {layer: torch.Tensor}.
+
+    :Parameters:
+        model: (Sequential_Net/ablation.MaskedNet) Model that is evaluated, an ablated model captures the masked outputs.
+        x: (torch.Tensor) Input batch.
+        layers: ([string]) Layers that should be captured, e.g. ["features.layer_0", "classifier.layer_1"]. Default every layer.
+        channels: (Dictionary) Layer like "features.layer_0" -> list of channels (units) that should be captured. Default every channel.
+        tap: (string) "layer" for the output of the layer module, "activation" for the output after its activation. Default is layer.
+    """
+    if tap not in TAPS:
+        raise ValueError("Unknown tap: " + str(tap))
+    net, masks = model, {}
+    if isinstance(model, ablation.MaskedNet):
+        net, masks = model.net, model.masks
+    selected = None if layers is None else set(layers)
+    channels = channels or {}
+    captured = collections.OrderedDict()
+
+    def on_output(container, layer, layer_tap, output):
+        key = container + "." + layer
+        if selected is not None and key not in selected:
+            return
+        # the layer output is always taken first, so layers without activation are captured for both taps
+        if layer_tap == "activation" and tap == "layer":
+            return
+        if key in channels:
+            output = output[:, list(channels[key])]
+        captured.setdefault(container, collections.OrderedDict())[layer] = output
+
+    with neural_network.inference_mode():
+        output = net.forward_layers(x, on_output, masks)
+    return output, captured
+
+def downsample(output, factor):
+    """
+    Returns a feature map averaged over factor x factor pixels, outputs of linear layers stay unchanged.
+
+    :Parameters:
+        output: (torch.Tensor) Captured output of a layer.
+        factor: (Integer) Downsampling factor of width and height.
+    """
+    if factor <= 1 or output.dim() != 4:
+        return output
+    return F.avg_pool2d(output, factor, ceil_mode=True)
+
+def encode(captured, encoding = "json", factor = 1):
+    """
+    Returns the captured outputs as collections.OrderedDict container -> {layer: payload} for responses.serialize.
+    With the json encoding the payload is a numpy array, otherwise a dictionary with "shape", "dtype", the base64 encoded
+    little-endian "data" and for quantized encodings "scale" and "offset" (value = quantized * scale + offset).
+
+    :Parameters:
+        captured: (collections.OrderedDict) Captured outputs like capture returns them.
+        encoding: (string) "json", "float32", "int16" or "uint8". Default is json.
+        factor: (Integer) Downsampling factor of the feature maps. Default is 1.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown encoding: " + str(encoding))
+    encoded = collections.OrderedDict()
+    for container in captured:
+        encoded[container] = collections.OrderedDict()
+        for layer, output in captured[container].items():
+            output = downsample(output, factor).float().cpu()
+            if encoding == "json":
+                encoded[container][layer] = output.numpy()
+                continue
+            data, headers = responses.encode_array(output.numpy(), encoding)
+            payload = {"shape": list(output.shape), "dtype": encoding, "data": base64.b64encode(data).decode("ascii")}
+            if "X-Scale" in headers:
+                payload.update({"scale": float(headers["X-Scale"]), "offset": float(headers["X-Offset"])})
+            encoded[container][layer] = payload
+    return encoded
+
+
+if __name__ == "__main__":
+    pass
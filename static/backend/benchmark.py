@@ -0,0 +1,323 @@
+import argparse
+import collections
+import datetime
+import json
+import os
+import pickle
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def conv(in_channel, out_channel):
+    """Returns the settings of a 3x3 convolution layer with relu."""
+    return {"type": "conv2d", "inChannel": {"value": in_channel}, "outChannel": {"value": out_channel},
+            "kernelSize": 3, "stride": 1, "padding": 1, "activation": "relu"}
+
+def pool():
+    """Returns the settings of a 2x2 max pooling layer."""
+    return {"type": "maxPool2d", "kernelSize": 2, "stride": 2, "activation": "none"}
+
+def dense(size, activation = "relu"):
+    """Returns the settings of a linear layer."""
+    return {"type": "linear", "size": size, "activation": activation}
+
+# layer settings of the benchmarked networks like the frontend sends them to /createNetwork
+NETWORK_SIZES = collections.OrderedDict([
+    ("small", ([conv(1, 8), pool()], [dense(10, "none")])),
+    ("medium", ([conv(1, 16), pool(), conv(16, 32), pool()], [dense(128), dense(10, "none")])),
+    ("large", ([conv(1, 32), conv(32, 64), pool(), conv(64, 128), pool()], [dense(256), dense(10, "none")]))
+])
+
+# settings of a /trainNetwork request, every request trains one epoch
+TRAIN_SETUP = {"epochs": 1, "loss": "crossEntropy", "optimizer": "sgd", "dataset": "mnist", "batchSize": 64, "learningrate": 0.01}
+
+# the ablated units of the ablation benchmark
+ABLATION_NODES = [{"containerName": "features", "layerNumber": 0, "ablatedWeights": [0, 1, 2]}]
+
+SESSION_ID = "benchmark"
+
+
+def get_network_request(name, size):
+    """
+    Returns the /createNetwork body of a benchmarked network.
+
+    :Parameters:
+        name: (string) Name of the network.
+        size: (string) Key of NETWORK_SIZES.
+    """
+    conv_layers, dense_layers = NETWORK_SIZES[size]
+    return {
+        "name": name,
+        "inputSize": {"x": 28, "y": 28, "z": {"value": 1}},
+        "convLayers": conv_layers,
+        "denseLayers": dense_layers
+    }
+
+def prepare_workdir(workdir, storage_backend, seed):
+    """
+    Creates the data directory the backend reads from in workdir: the input t-SNE coordinates, a drawn digit and the storage.
+    Returns the directory the backend has to run in, the backend reads ../data relative to it.
+
+    :Parameters:
+        workdir: (string) Empty directory of the benchmark run.
+        storage_backend: (string) "local" for the SQLite and .npy storage, "mongomock" for an in-memory MongoDB.
+        seed: (Integer) Seed of the random content.
+    """
+    import cv2
+
+    random = np.random.RandomState(seed)
+    run_dir = os.path.join(workdir, "backend")
+    for directory in [run_dir, os.path.join(workdir, "data", "tSNE"), os.path.join(workdir, "data", "digit")]:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(workdir, "data", "tSNE", "X_tSNE_10000.p"), "wb") as f:
+        pickle.dump(random.uniform(-50, 50, (10000, 2)).astype(np.float32), f)
+
+    # a stroke on an empty canvas like the free drawing of the frontend
+    digit = np.zeros((280, 280), dtype=np.uint8)
+    cv2.line(digit, (140, 40), (140, 240), 255, 20)
+    cv2.imwrite(os.path.join(workdir, "data", "digit", "digit.png"), digit)
+
+    if storage_backend == "mongomock":
+        os.environ["STORAGE"] = "mongo"
+        os.environ["MONGO_URI"] = "mongomock://"
+    else:
+        os.environ["STORAGE"] = "local"
+        os.environ["STORAGE_DIR"] = os.path.join(workdir, "data", "storage")
+    # the warm-up would run next to the timed requests
+    os.environ["WARM_UP"] = "0"
+    return run_dir
+
+def register_synthetic_datasets(dataset_loader, train_samples, test_samples, seed):
+    """
+    Registers random MNIST shaped train and test datasets as "mnist", so the benchmark neither downloads nor decodes MNIST.
+
+    :Parameters:
+        dataset_loader: (module) The dataset_loader module of the backend.
+        train_samples: (Integer) Number of training samples.
+        test_samples: (Integer) Number of test samples.
+        seed: (Integer) Seed of the random samples.
+    """
+    import torch
+
+    generator = torch.Generator().manual_seed(seed)
+    classes = list(dataset_loader.get_dataset_class("mnist").classes)
+    for is_training, samples in [(True, train_samples), (False, test_samples)]:
+        data = torch.rand(samples, 1, 28, 28, generator=generator) * 2 - 1
+        targets = torch.randint(0, len(classes), (samples,), generator=generator)
+        with dataset_loader.REGISTRY_LOCK:
+            dataset_loader.REGISTRY[("mnist", is_training)] = dataset_loader.InMemoryDataset(data, targets, classes)
+
+def send(client, method, path, body = None):
+    """
+    Sends a request through the flask test client and returns the response. Raises a RuntimeError if it failed.
+
+    :Parameters:
+        client: (flask.testing.FlaskClient) Test client of the app.
+        method: (string) HTTP method.
+        path: (string) Path of the endpoint with the query string.
+        body: (Dictionary) Json body of the request. Default None sends no body.
+    """
+    response = client.open(path, method=method, json=body, headers={"X-Session-ID": SESSION_ID})
+    if response.status_code != 200:
+        raise RuntimeError("{} {} failed with {}: {}".format(method, path, response.status_code, response.get_data(as_text=True)[:200]))
+    return response
+
+def time_calls(call, repeat, warmup = 0):
+    """
+    Returns the durations in seconds and the response sizes of repeat calls, after warmup calls that are not timed.
+
+    :Parameters:
+        call: (function) Sends the requests of one sample and returns the last response.
+        repeat: (Integer) Number of timed calls.
+        warmup: (Integer) Number of calls before the timed ones. Default is 0.
+    """
+    for _ in range(warmup):
+        call()
+    seconds, sizes = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = call()
+        seconds.append(time.perf_counter() - start)
+        sizes.append(len(response.get_data()))
+    return seconds, sizes
+
+def summarize(case, size, epochs, seconds, sizes):
+    """
+    Returns the latency percentiles in milliseconds, the throughput in requests per second and the mean response size of a case.
+
+    :Parameters:
+        case: (string) Name of the benchmark case.
+        size: (string) Network size or None.
+        epochs: (Integer) Number of trained epochs of the network or None.
+        seconds: ([float]) Durations of the calls.
+        sizes: ([Integer]) Response sizes of the calls in bytes.
+    """
+    milliseconds = np.asarray(seconds) * 1000
+    return collections.OrderedDict([
+        ("case", case),
+        ("size", size),
+        ("epochs", epochs),
+        ("count", len(seconds)),
+        ("mean_ms", float(milliseconds.mean())),
+        ("min_ms", float(milliseconds.min())),
+        ("p50_ms", float(np.percentile(milliseconds, 50))),
+        ("p90_ms", float(np.percentile(milliseconds, 90))),
+        ("p99_ms", float(np.percentile(milliseconds, 99))),
+        ("max_ms", float(milliseconds.max())),
+        ("throughput", len(seconds) / max(sum(seconds), 1e-9)),
+        ("bytes", int(np.mean(sizes)))
+    ])
+
+def run(client, sizes, epoch_counts, repeat, warmup, report):
+    """
+    Runs every benchmark case and calls report with the summary of each case as soon as it is finished.
+    Per network size one network is created and trained one epoch per request, the load, test, ablation and digit cases
+    run whenever it reaches one of the epoch counts.
+
+    :Parameters:
+        client: (flask.testing.FlaskClient) Test client of the app.
+        sizes: ([string]) Keys of NETWORK_SIZES.
+        epoch_counts: ([Integer]) Numbers of trained epochs the cases run at.
+        repeat: (Integer) Number of timed calls of a case.
+        warmup: (Integer) Number of untimed calls before a case.
+        report: (function) Called with the summary of every case.
+    """
+    report(summarize("getTSNECoordinate", None, None, *time_calls(lambda: send(client, "GET", "/getTSNECoordinate"), repeat, warmup)))
+
+    for size in sizes:
+        network = get_network_request("benchmark-" + size, size)
+        report(summarize("createNetwork", size, 0, *time_calls(lambda: send(client, "POST", "/createNetwork", network), repeat)))
+        # the last created network is trained and tested
+        uuid = json.loads(send(client, "POST", "/createNetwork", network).get_data(as_text=True))["_id"]
+
+        train_seconds, train_sizes = [], []
+        trained = 0
+        for epochs in sorted(epoch_counts):
+            seconds, response_sizes = time_calls(lambda: send(client, "POST", "/trainNetwork", {"id": uuid, "setup": TRAIN_SETUP}), epochs - trained)
+            train_seconds += seconds
+            train_sizes += response_sizes
+            trained = epochs
+
+            test = {"networkID": uuid}
+            report(summarize("loadNetwork", size, epochs, *time_calls(lambda: send(client, "POST", "/loadNetwork", {"uuid": uuid}), repeat, warmup)))
+            report(summarize("testNetwork", size, epochs, *time_calls(lambda: send(client, "POST", "/testNetwork", test), repeat, warmup)))
+
+            def ablate():
+                send(client, "POST", "/ablateNetwork", {"networkID": uuid, "nodes": ABLATION_NODES})
+                return send(client, "POST", "/testNetwork", test)
+            report(summarize("ablateNetwork+test", size, epochs, *time_calls(ablate, repeat, warmup)))
+            send(client, "POST", "/resetAblation")
+
+            report(summarize("testDigit", size, epochs, *time_calls(lambda: send(client, "POST", "/testDigit"), repeat, warmup)))
+
+        if train_seconds:
+            report(summarize("trainNetwork(1 epoch)", size, trained, train_seconds, train_sizes))
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the median latency of every case against a baseline and returns the cases that are slower than the tolerance allows.
+
+    :Parameters:
+        results: ([Dictionary]) Summaries of this run.
+        baseline: ([Dictionary]) Summaries of the baseline run.
+        tolerance: (float) Allowed relative increase of the median latency, e.g. 0.1 for 10%.
+    """
+    baseline = {(item["case"], item["size"], item["epochs"]): item for item in baseline}
+    regressions = []
+    print("\n{:<22} {:<7} {:>6} {:>12} {:>12} {:>8}".format("case", "size", "epochs", "base p50 ms", "p50 ms", "ratio"))
+    for item in results:
+        key = (item["case"], item["size"], item["epochs"])
+        if key not in baseline:
+            continue
+        ratio = item["p50_ms"] / max(baseline[key]["p50_ms"], 1e-9)
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+        print("{:<22} {:<7} {:>6} {:>12.2f} {:>12.2f} {:>7.2f}x{}".format(
+            item["case"], str(item["size"]), str(item["epochs"]), baseline[key]["p50_ms"], item["p50_ms"], ratio,
+            " slower" if ratio > 1 + tolerance else ""))
+    return regressions
+
+def print_summary(item):
+    """
+    Prints one line of a case summary.
+
+    :Parameters:
+        item: (Dictionary) Summary of a case.
+    """
+    print("{:<22} {:<7} {:>6} {:>5} {:>10.2f} {:>10.2f} {:>10.2f} {:>9.1f}/s {:>10}".format(
+        item["case"], str(item["size"]), str(item["epochs"]), item["count"],
+        item["p50_ms"], item["p90_ms"], item["p99_ms"], item["throughput"], item["bytes"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the backend endpoints through the flask test client on a synthetic MNIST shaped dataset.")
+    parser.add_argument("--sizes", nargs="+", default=list(NETWORK_SIZES), choices=list(NETWORK_SIZES), help="Network sizes.")
+    parser.add_argument("--epochs", nargs="+", default=[1, 5], type=int, help="Numbers of trained epochs the cases run at.")
+    parser.add_argument("--repeat", default=20, type=int, help="Number of timed requests of a case.")
+    parser.add_argument("--warmup", default=2, type=int, help="Number of untimed requests before a case.")
+    parser.add_argument("--train-samples", default=6000, type=int, help="Number of synthetic training samples.")
+    parser.add_argument("--test-samples", default=1000, type=int, help="Number of synthetic test samples.")
+    parser.add_argument("--storage", default="local", choices=["local", "mongomock"], help="Storage the backend runs on.")
+    parser.add_argument("--seed", default=0, type=int, help="Seed of the synthetic data.")
+    parser.add_argument("--output", default="../data/benchmarks/benchmark_{}.json".format(datetime.datetime.now().strftime("%Y%m%d_%H%M%S")),
+                        help="Json file the results are saved to, use it as --baseline of a later run.")
+    parser.add_argument("--baseline", help="Json file of an earlier run to compare the median latencies with.")
+    parser.add_argument("--tolerance", default=0.1, type=float, help="Allowed relative slowdown against the baseline.")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    # the backend runs in a temporary directory, so its data and storage are not touched
+    workdir = tempfile.mkdtemp(prefix="backend_benchmark_")
+    os.chdir(prepare_workdir(workdir, args.storage, args.seed))
+    sys.path.insert(0, BACKEND_DIR)
+
+    import torch
+
+    import dataset_loader
+
+    import main
+
+    torch.manual_seed(args.seed)
+    register_synthetic_datasets(dataset_loader, args.train_samples, args.test_samples, args.seed)
+
+    print("Working directory: " + workdir)
+    print("{:<22} {:<7} {:>6} {:>5} {:>10} {:>10} {:>10} {:>11} {:>10}".format(
+        "case", "size", "epochs", "count", "p50 ms", "p90 ms", "p99 ms", "throughput", "bytes"))
+    results = []
+    def report(item):
+        results.append(item)
+        print_summary(item)
+    run(main.create_app().test_client(), args.sizes, args.epochs, args.repeat, args.warmup, report)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "created": datetime.datetime.utcnow().strftime("%Y/%m/%d, %H:%M:%S"),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "torch": torch.__version__,
+                "numpy": np.__version__,
+                "threads": torch.get_num_threads(),
+                "cpus": os.cpu_count()
+            },
+            "settings": vars(args),
+            "results": results
+        }, f, indent=2)
+    print("Saved the results to " + output)
+    main.EVALUATOR.close()
+
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        if regressions:
+            print("{} cases are more than {:.0%} slower than the baseline.".format(len(regressions), args.tolerance))
+            sys.exit(1)
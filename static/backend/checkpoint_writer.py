@@ -0,0 +1,76 @@
+import queue
+import threading
+import traceback
+
+
+class CheckpointWriter:
+    """
+    Saves the epochs of a training run in a background thread, so the training does not wait for the database.
+    The queue is bounded: if the writer falls behind, the training waits instead of piling up weight snapshots in memory.
+
+    :Parameters:
+        save: (function) Called in the writer thread with (epoch, weights, metrics) for every submitted epoch.
+        max_pending: (Integer) Number of epochs that may wait for the writer. Default is 1.
+
+    :Attributes:
+        __save: (function) saves an epoch.
+        __queue: (queue.Queue) epochs waiting for the writer, None marks the end of the run.
+        __thread: (threading.Thread) writer thread.
+        error: (Exception) first error of the writer, the following epochs are dropped after it.
+        saved: (Integer) number of saved epochs.
+        closed: (boolean) flag if the run ended and the writer thread stopped.
+    """
+    def __init__(self, save, max_pending=1):
+        self.__save = save
+        self.__queue = queue.Queue(maxsize=max_pending)
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.error = None
+        self.saved = 0
+        self.closed = False
+        self.__thread.start()
+
+    def submit(self, epoch, weights, metrics):
+        """
+        Queues an epoch for saving, blocks while the queue is full. Raises the error of the writer if saving failed.
+
+        :Parameters:
+            epoch: (Integer) Index of the epoch in this run.
+            weights: (collections.OrderedDict) Weights of the epoch with tensors.
+            metrics: (Dictionary) Loss and accuracy of the epoch.
+        """
+        if self.error is not None:
+            raise self.error
+        self.__queue.put((epoch, weights, metrics))
+
+    def close(self, raise_error=True):
+        """
+        Waits until every queued epoch is saved and stops the writer thread.
+
+        :Parameters:
+            raise_error: (boolean) Flag for raising the error of the writer if saving failed. True by default.
+        """
+        if not self.closed:
+            self.__queue.put(None)
+            self.__thread.join()
+            self.closed = True
+        if raise_error and self.error is not None:
+            raise self.error
+
+    def __run(self):
+        """Private Method: Saves the queued epochs in order until the end of the run."""
+        while True:
+            entry = self.__queue.get()
+            if entry is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.__save(*entry)
+                self.saved += 1
+            except Exception as e:
+                traceback.print_exc()
+                self.error = e
+
+
+if __name__ == "__main__":
+    pass
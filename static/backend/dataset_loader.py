@@ -1,13 +1,108 @@
-import torchvision
-import torchvision.transforms as transforms
+import gzip
+import os
+import tempfile
+import threading
+import warnings
 
+import numpy as np
+import torch
+
+import execution
+
+import metrics
+
+# torchvision dataset class of every dataset, also the name of its directory in DATA_ROOT.
+# torchvision is imported on first use, it is only needed to download a dataset and for the class names.
 DATA = {
-    "mnist": torchvision.datasets.MNIST,
-    "kmnist": torchvision.datasets.KMNIST,
-    "fashion-mnist": torchvision.datasets.FashionMNIST
+    "mnist": "MNIST",
+    "kmnist": "KMNIST",
+    "fashion-mnist": "FashionMNIST"
 }
 
-TRANSFORM = transforms.Compose([transforms.ToTensor(), transforms.Normalize((0.5,), (0.5,))])
+DATA_ROOT = "../data"
+
+# mean and std of the torchvision transform, applied once to the whole decoded dataset
+NORMALIZE_MEAN = 0.5
+NORMALIZE_STD = 0.5
+
+# raw idx files of the train and test split
+RAW_FILES = {
+    True: ("train-images-idx3-ubyte", "train-labels-idx1-ubyte"),
+    False: ("t10k-images-idx3-ubyte", "t10k-labels-idx1-ubyte")
+}
+
+# decoded datasets of this process: (data_name, is_training) -> InMemoryDataset
+REGISTRY = {}
+# guards the registry and the loading locks, it is not held while a dataset is loaded
+REGISTRY_LOCK = threading.Lock()
+# (data_name, is_training) -> threading.Lock, so a dataset is loaded once without blocking the loading of the others
+LOADING_LOCKS = {}
+
+
+class InMemoryDataset(torch.utils.data.Dataset):
+    """
+    Dataset whose normalized images and labels are held in two contiguous tensors.
+
+    :Parameters:
+        data: (torch.Tensor) Normalized images with the shape (N, 1, height, width).
+        targets: (torch.Tensor) Labels with the shape (N).
+        classes: ([string]) Names of the classes.
+    """
+    def __init__(self, data, targets, classes):
+        self.data = data
+        self.targets = targets
+        self.classes = classes
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        return self.data[index], self.targets[index]
+
+
+class BatchLoader:
+    """
+    Iterates over an InMemoryDataset in batches by slicing its tensors, without per sample work or worker processes.
+
+    :Parameters:
+        dataset: (InMemoryDataset) Dataset to iterate over.
+        batch_size: (Integer) Number of samples in a batch.
+        shuffle: (boolean) Flag for a new random order in every iteration. False by default.
+        pin_memory: (boolean) Flag for pinning the batches in page-locked memory, only used if cuda is available. False by default.
+    """
+    def __init__(self, dataset, batch_size, shuffle=False, pin_memory=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        data = self.dataset.data
+        targets = self.dataset.targets
+        order = torch.randperm(len(self.dataset)) if self.shuffle else None
+        for start in range(0, len(self.dataset), self.batch_size):
+            if order is None:
+                batch = data[start:start + self.batch_size], targets[start:start + self.batch_size]
+            else:
+                indices = order[start:start + self.batch_size]
+                batch = data.index_select(0, indices), targets.index_select(0, indices)
+            if self.pin_memory:
+                batch = batch[0].pin_memory(), batch[1].pin_memory()
+            yield batch
+
+
+def get_dataset_class(data_name):
+    """
+    Returns the torchvision dataset class of a dataset.
+
+    :Parameters:
+        data_name: (string) Name of the dataset.
+    """
+    import torchvision
+    return getattr(torchvision.datasets, DATA[data_name])
 
 def get_dataset_from_torch(data_name, is_training = True):
     """
@@ -17,7 +112,9 @@ def get_dataset_from_torch(data_name, is_training = True):
         data_name: (string) Name of the dataset to load.
         is_training: (boolean) Flag for loading traindataset or testdataset. True by default.
     """
-    return DATA[data_name](root='../data', train=is_training, download=True, transform=TRANSFORM)
+    import torchvision.transforms as transforms
+    transform = transforms.Compose([transforms.ToTensor(), transforms.Normalize((NORMALIZE_MEAN,), (NORMALIZE_STD,))])
+    return get_dataset_class(data_name)(root=DATA_ROOT, train=is_training, download=True, transform=transform)
 
 def get_dataset_classes(dataset):
     """
@@ -28,5 +125,148 @@ def get_dataset_classes(dataset):
     """
     return dataset.classes
 
+def read_idx(path):
+    """
+    Returns the content of an idx file (plain or gzipped) as numpy array.
+
+    :Parameters:
+        path: (string) Path of the idx file.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        content = f.read()
+    # header: two zero bytes, the type code (0x08 = unsigned byte) and the number of dimensions
+    if content[2] != 0x08:
+        raise ValueError("Unsupported idx type in " + path)
+    num_dims = content[3]
+    shape = tuple(np.frombuffer(content, dtype=">i4", count=num_dims, offset=4))
+    return np.frombuffer(content, dtype=np.uint8, offset=4 + 4 * num_dims).reshape(shape)
+
+def get_raw_path(data_name, filename):
+    """
+    Returns the path of a raw idx file of a dataset, the gzipped one if only that exists, or None.
+
+    :Parameters:
+        data_name: (string) Name of the dataset.
+        filename: (string) Name of the idx file.
+    """
+    path = os.path.join(DATA_ROOT, DATA[data_name], "raw", filename)
+    for candidate in (path, path + ".gz"):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def decode_dataset(data_name, is_training):
+    """
+    Returns the normalized images as float32 array with the shape (N, 1, height, width) and the labels as int64 array.
+    Downloads the dataset through torchvision if the raw files are missing.
+
+    :Parameters:
+        data_name: (string) Name of the dataset.
+        is_training: (boolean) Flag for the train or the test split.
+    """
+    image_file, label_file = RAW_FILES[is_training]
+    if get_raw_path(data_name, image_file) is None or get_raw_path(data_name, label_file) is None:
+        get_dataset_from_torch(data_name, is_training)
+
+    images = read_idx(get_raw_path(data_name, image_file)).astype(np.float32)
+    images = (images / 255.0 - NORMALIZE_MEAN) / NORMALIZE_STD
+    labels = read_idx(get_raw_path(data_name, label_file)).astype(np.int64)
+    return images[:, np.newaxis, :, :], labels
+
+def save_array(path, array):
+    """
+    Writes an array to a .npy file through a temporary file in the same directory, so other processes
+    never read a partly written file.
+
+    :Parameters:
+        path: (string) Path of the .npy file.
+        array: (np.array) Array that should be saved.
+    """
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npy.tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            np.save(f, array)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def load_cached_arrays(data_name, is_training, mmap):
+    """
+    Returns the decoded images and labels from the .npy cache of the dataset and writes the cache if it does not exist.
+    The images are memory-mapped if mmap is set.
+
+    :Parameters:
+        data_name: (string) Name of the dataset.
+        is_training: (boolean) Flag for the train or the test split.
+        mmap: (boolean) Flag for memory-mapping the cached images.
+    """
+    cache_dir = os.path.join(DATA_ROOT, DATA[data_name], "cache")
+    split = "train" if is_training else "test"
+    image_path = os.path.join(cache_dir, split + "_images.npy")
+    label_path = os.path.join(cache_dir, split + "_labels.npy")
+
+    if not (os.path.exists(image_path) and os.path.exists(label_path)):
+        images, labels = decode_dataset(data_name, is_training)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # the labels are written last, the cache counts as complete once they exist
+            save_array(image_path, np.ascontiguousarray(images))
+            save_array(label_path, labels)
+        except OSError:
+            # read-only data directory, keep the decoded arrays in memory
+            return images, labels
+        if not mmap:
+            return images, labels
+
+    return np.load(image_path, mmap_mode="r" if mmap else None), np.load(label_path)
+
+@metrics.timed_stage("dataset")
+def get_tensor_dataset(data_name, is_training = True, mmap = True):
+    """
+    Returns the InMemoryDataset of a dataset. It is decoded once per process and shared by every request.
+
+    :Parameters:
+        data_name: (string) Name of the dataset to load.
+        is_training: (boolean) Flag for loading traindataset or testdataset. True by default.
+        mmap: (boolean) Flag for memory-mapping the images from the .npy cache. True by default.
+    """
+    key = (data_name, is_training)
+    with REGISTRY_LOCK:
+        if key in REGISTRY:
+            return REGISTRY[key]
+        key_lock = LOADING_LOCKS.setdefault(key, threading.Lock())
+
+    with key_lock:
+        with REGISTRY_LOCK:
+            if key in REGISTRY:
+                return REGISTRY[key]
+        images, labels = load_cached_arrays(data_name, is_training, mmap)
+        with warnings.catch_warnings():
+            # the memory-mapped images are read-only, batches are only read by the models
+            warnings.simplefilter("ignore", UserWarning)
+            data = torch.from_numpy(images)
+        dataset = InMemoryDataset(data, torch.from_numpy(labels), list(get_dataset_class(data_name).classes))
+        with REGISTRY_LOCK:
+            REGISTRY[key] = dataset
+    return dataset
+
+def get_loader(dataset, batch_size, shuffle = False, config = None):
+    """
+    Returns a BatchLoader for an InMemoryDataset, otherwise a torch DataLoader.
+
+    :Parameters:
+        dataset: Dataset that should be iterated.
+        batch_size: (Integer) Number of samples in a batch.
+        shuffle: (boolean) Flag for shuffling the samples. False by default.
+        config: (Dictionary) Execution settings with the loader workers and pinned memory. Default execution.CONFIG.
+    """
+    config = config or execution.CONFIG
+    if isinstance(dataset, InMemoryDataset):
+        return BatchLoader(dataset, batch_size, shuffle, config["pin_memory"])
+    return torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=shuffle,
+                                       num_workers=config["loader_workers"], pin_memory=config["pin_memory"])
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    pass
@@ -0,0 +1,195 @@
+import collections
+import hashlib
+import json
+import pickle
+import threading
+
+import numpy as np
+import torch
+
+import neural_network_module as neural_network
+
+import training_jobs
+
+import weight_store
+
+
+TSNE_PATH = "../data/tSNE/X_tSNE_10000.p"
+
+# the precomputed t-SNE coordinates of the inputs, loaded on first use
+INPUT_TSNE = None
+INPUT_TSNE_LOCK = threading.Lock()
+
+
+def get_input_tsne():
+    """
+    Returns a dictionary with the precomputed t-SNE coordinates of the test inputs ("coordinates"),
+    their json encoding ("json") and an ETag of the content ("etag"). The file is only read on the first call.
+    """
+    global INPUT_TSNE
+    with INPUT_TSNE_LOCK:
+        if INPUT_TSNE is None:
+            with open(TSNE_PATH, "rb") as f:
+                coordinates = np.asarray(pickle.load(f))
+            INPUT_TSNE = {
+                "coordinates": coordinates,
+                "json": json.dumps(coordinates.tolist()),
+                "etag": hashlib.sha1(np.ascontiguousarray(coordinates).tobytes()).hexdigest()
+            }
+        return INPUT_TSNE
+
+def get_activations(net, data, container, layer, batch_size = 1000, job = None):
+    """
+    Returns the flattened outputs of a layer for every sample as float32 array with the shape (samples, features).
+
+    :Parameters:
+        net: (Sequential_Net) Network that is evaluated.
+        data: (torch.Tensor) Input samples.
+        container: (string) Name of the container, e.g. "features".
+        layer: (string) Name of the layer in the container, e.g. "layer_1".
+        batch_size: (Integer) Number of samples in a forward pass. Default is 1000.
+        job: (training_jobs.Job) Job that is checked for cancellation between batches. Default None.
+    """
+    outputs = []
+    with neural_network.inference_mode():
+        for start in range(0, len(data), batch_size):
+            if job is not None and job.is_cancelled():
+                raise training_jobs.JobCancelled()
+            output = net.get_layer_output(data[start:start + batch_size], container, layer)
+            outputs.append(output.reshape(output.shape[0], -1).float().cpu().numpy())
+    return np.concatenate(outputs)
+
+def pca(features, num_components):
+    """
+    Returns the projection of the features on their first principal components.
+
+    :Parameters:
+        features: (np.array) Features with the shape (samples, features).
+        num_components: (Integer) Number of principal components.
+    """
+    tensor = torch.from_numpy(np.ascontiguousarray(features, dtype=np.float32))
+    tensor = tensor - tensor.mean(0)
+    q = min(num_components, *tensor.shape)
+    _, _, v = torch.pca_lowrank(tensor, q=q, center=False)
+    projection = (tensor @ v[:, :q]).numpy()
+    if q < num_components:
+        projection = np.pad(projection, ((0, 0), (0, num_components - q)), "constant")
+    return projection
+
+def embed(features, method = "tsne", seed = 0):
+    """
+    Returns a 2-D embedding of the features as float32 array with the shape (samples, 2).
+    "pca" projects on the first two principal components, "tsne" runs a Barnes-Hut t-SNE initialized with PCA
+    on the first 50 principal components.
+
+    :Parameters:
+        features: (np.array) Features with the shape (samples, features).
+        method: (string) "tsne" or "pca". Default is tsne.
+        seed: (Integer) Random seed of the t-SNE. Default is 0.
+    """
+    if method == "pca":
+        return pca(features, 2).astype(np.float32)
+    if method != "tsne":
+        raise ValueError("Unknown embedding method: " + str(method))
+
+    # scikit-learn is only needed for the t-SNE
+    from sklearn.manifold import TSNE
+    reduced = pca(features, 50) if features.shape[1] > 50 else features
+    tsne = TSNE(n_components=2, init="pca", method="barnes_hut", random_state=seed)
+    return tsne.fit_transform(reduced).astype(np.float32)
+
+def get_embedding_key(network_id, epoch, container, layer, method, samples):
+    """
+    Returns the condition that identifies a stored embedding.
+
+    :Parameters:
+        network_id: (string) uuid of the network.
+        epoch: (Integer) Number of the epoch.
+        container: (string) Name of the container.
+        layer: (string) Name of the layer in the container.
+        method: (string) Embedding method.
+        samples: (Integer) Number of test samples that were embedded.
+    """
+    return {
+        "network_id": network_id,
+        "epoch": epoch,
+        "container": container,
+        "layer": layer,
+        "method": method,
+        "samples": samples
+    }
+
+
+class EmbeddingStore:
+    """
+    Stores computed embeddings in their own collection and keeps the latest ones in memory.
+
+    :Parameters:
+        connection: (mongo_module.Mongo) Connection to the collection the embeddings are stored in.
+        max_entries: (Integer) Number of embeddings that are kept in memory. Default is 32.
+
+    :Attributes:
+        __connection: (mongo_module.Mongo) holds the connection to the embeddings collection.
+        __memory: (collections.OrderedDict) key -> coordinates, least recently used first.
+        __lock: (threading.Lock) guards the memory.
+        max_entries: (Integer) number of embeddings that are kept in memory.
+    """
+    def __init__(self, connection, max_entries = 32):
+        self.__connection = connection
+        self.__memory = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.max_entries = max_entries
+        self.__connection.create_index([
+            ("network_id", 1), ("epoch", 1), ("container", 1), ("layer", 1), ("method", 1), ("samples", 1)
+        ], unique=True)
+
+    def get(self, key):
+        """
+        Returns the coordinates of an embedding as float32 array or None if it was not computed yet.
+
+        :Parameters:
+            key: (Dictionary) Key like get_embedding_key returns it.
+        """
+        memory_key = tuple(sorted(key.items()))
+        with self.__lock:
+            if memory_key in self.__memory:
+                self.__memory.move_to_end(memory_key)
+                return self.__memory[memory_key]
+
+        item = self.__connection.get_item_by_condition(key)
+        if item is None:
+            return None
+        coordinates = weight_store.decode_tensor(item["coordinates"]).numpy()
+        self.__remember(memory_key, coordinates)
+        return coordinates
+
+    def save(self, key, coordinates):
+        """
+        Saves the coordinates of an embedding.
+
+        :Parameters:
+            key: (Dictionary) Key like get_embedding_key returns it.
+            coordinates: (np.array) Coordinates with the shape (samples, 2).
+        """
+        item = dict(key)
+        item["coordinates"] = weight_store.encode_tensor(torch.from_numpy(coordinates))
+        self.__connection.replace_item_by_condition(key, item)
+        self.__remember(tuple(sorted(key.items())), coordinates)
+
+    def __remember(self, memory_key, coordinates):
+        """
+        Private Method: Keeps coordinates in memory and forgets the least recently used ones.
+
+        :Parameters:
+            memory_key: (tuple) Hashable version of the key.
+            coordinates: (np.array) Coordinates of the embedding.
+        """
+        with self.__lock:
+            self.__memory[memory_key] = coordinates
+            self.__memory.move_to_end(memory_key)
+            while len(self.__memory) > self.max_entries:
+                self.__memory.popitem(last=False)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+import torch
+
+import neural_network_module as neural_network
+
+import dataset_loader
+
+import ablation
+
+
+def init_worker(num_threads):
+    """
+    Initializes a worker process, the cores are split between the workers instead of every worker using all of them.
+
+    :Parameters:
+        num_threads: (Integer) Number of torch threads of the worker.
+    """
+    torch.set_num_threads(num_threads)
+
+def test_shard(model, loss, data_name, start, end, batch_size):
+    """
+    Tests the model on the samples start to end of a test dataset and returns their correct flags and labels.
+    Runs in a worker process, the dataset is loaded there from the .npy cache.
+
+    :Parameters:
+        model: (nn.Module) Model that is tested.
+        loss: (string) Loss Function for the test loss.
+        data_name: (string) Name of the dataset.
+        start: (Integer) Index of the first sample.
+        end: (Integer) Index after the last sample.
+        batch_size: (Integer) Number of samples in a forward pass.
+    """
+    testset = dataset_loader.get_tensor_dataset(data_name, False)
+    shard = dataset_loader.InMemoryDataset(testset.data[start:end], testset.targets[start:end], testset.classes)
+    results = neural_network.test_model(model, loss, shard, batch_size)
+    return results[1], results[3]
+
+def sweep_shard(model, ablations, data_name, batch_size, max_samples):
+    """
+    Evaluates a part of the ablations of a sweep in a worker process, like ablation.sweep.
+
+    :Parameters:
+        model: (Sequential_Net) Network that is evaluated.
+        ablations: ([[Dictionary]]) List of ablations, each a list of nodes.
+        data_name: (string) Name of the dataset.
+        batch_size: (Integer) Number of samples of the dataset in a forward pass.
+        max_samples: (Integer) Maximal number of samples times ablations in a forward pass.
+    """
+    testset = dataset_loader.get_tensor_dataset(data_name, False)
+    return ablation.sweep(model, ablations, testset, batch_size, max_samples)
+
+
+class ProcessEvaluator:
+    """
+    Shards tests and ablation sweeps across a pool of worker processes and merges their results.
+    The pool is started on first use, the models are sent to the workers and the workers load the dataset themselves.
+
+    :Parameters:
+        processes: (Integer) Number of worker processes. Default is the number of cores.
+
+    :Attributes:
+        processes: (Integer) number of worker processes.
+        __pool: (multiprocessing.Pool) pool of worker processes, None until it is used.
+        __lock: (threading.Lock) guards the creation of the pool.
+    """
+    def __init__(self, processes = None):
+        self.processes = processes or os.cpu_count() or 1
+        self.__pool = None
+        self.__lock = threading.Lock()
+
+    def test(self, model, loss, data_name, batch_size = 1000, shards = None):
+        """
+        Tests a model on a test dataset and returns the results like Sequential_Net.test_start.
+
+        :Parameters:
+            model: (nn.Module) Model that is tested.
+            loss: (string) Loss Function for the test loss.
+            data_name: (string) Name of the dataset.
+            batch_size: (Integer) Number of samples in a forward pass. Default is 1000.
+            shards: (Integer) Number of parts the dataset is split in. Default is the number of processes.
+        """
+        testset = dataset_loader.get_tensor_dataset(data_name, False)
+        bounds = np.linspace(0, len(testset), (shards or self.processes) + 1).astype(int)
+        tasks = [(model, loss, data_name, start, end, batch_size) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+        results = self.__get_pool().starmap(test_shard, tasks)
+
+        correct_labels = np.concatenate([result[0] for result in results])
+        class_labels = np.concatenate([result[1] for result in results])
+        acc = 100. * int(correct_labels.sum()) / len(correct_labels)
+        acc_class = neural_network.get_class_accuracy(correct_labels, class_labels, len(testset.classes))
+        return acc, correct_labels, acc_class, class_labels
+
+    def sweep(self, model, ablations, data_name, batch_size = 1000, max_samples = 20000, shards = None):
+        """
+        Evaluates every ablation on a test dataset and returns the results like ablation.sweep.
+
+        :Parameters:
+            model: (Sequential_Net) Network that is evaluated.
+            ablations: ([[Dictionary]]) List of ablations, each a list of nodes.
+            data_name: (string) Name of the dataset.
+            batch_size: (Integer) Number of samples of the dataset in a forward pass. Default is 1000.
+            max_samples: (Integer) Maximal number of samples times ablations in a forward pass. Default is 20000.
+            shards: (Integer) Number of parts the ablations are split in. Default is the number of processes.
+        """
+        bounds = np.linspace(0, len(ablations), min(shards or self.processes, len(ablations)) + 1).astype(int)
+        tasks = [(model, ablations[start:end], data_name, batch_size, max_samples) for start, end in zip(bounds[:-1], bounds[1:])]
+        results = self.__get_pool().starmap(sweep_shard, tasks)
+        return np.concatenate([result[0] for result in results]), np.concatenate([result[1] for result in results])
+
+    def close(self):
+        """Stops the worker processes."""
+        with self.__lock:
+            if self.__pool is not None:
+                self.__pool.close()
+                self.__pool.join()
+                self.__pool = None
+
+    def __get_pool(self):
+        """
+        Private Method: Returns the pool and starts it on first use. The workers are spawned, not forked,
+        because forking a process with running threads can deadlock the children.
+        """
+        with self.__lock:
+            if self.__pool is None:
+                num_threads = max(1, (os.cpu_count() or 1) // self.processes)
+                context = multiprocessing.get_context("spawn")
+                self.__pool = context.Pool(self.processes, initializer=init_worker, initargs=(num_threads,))
+            return self.__pool
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,105 @@
+import contextlib
+import logging
+import os
+import threading
+
+import torch
+
+
+# request keys of the execution settings -> keys of the config
+REQUEST_KEYS = {
+    "threads": "threads",
+    "interopThreads": "interop_threads",
+    "loaderWorkers": "loader_workers",
+    "pinMemory": "pin_memory",
+    "processes": "processes"
+}
+
+# serializes requests that change the number of torch threads, the setting is global for the process
+THREADS_LOCK = threading.Lock()
+
+
+def load_config(environ = os.environ):
+    """
+    Returns the execution settings from the environment:
+        TORCH_THREADS: intra-op threads of torch, 0 keeps the torch default.
+        TORCH_INTEROP_THREADS: inter-op threads of torch, 0 keeps the torch default.
+        LOADER_WORKERS: worker processes of a torch DataLoader. Default is 2.
+        PIN_MEMORY: "1" pins the batches in page-locked memory for faster copies to the gpu. Default is 0.
+        EVAL_PROCESSES: processes that share a test or an ablation sweep, 0 or 1 evaluates in the request thread. Default is 0.
+
+    :Parameters:
+        environ: (Dictionary) Environment variables. Default os.environ.
+    """
+    return {
+        "threads": int(environ.get("TORCH_THREADS", 0)),
+        "interop_threads": int(environ.get("TORCH_INTEROP_THREADS", 0)),
+        "loader_workers": int(environ.get("LOADER_WORKERS", 2)),
+        "pin_memory": environ.get("PIN_MEMORY", "0").lower() in ("1", "true", "yes"),
+        "processes": int(environ.get("EVAL_PROCESSES", 0))
+    }
+
+# execution settings of the process
+CONFIG = load_config()
+
+def configure_torch(config = CONFIG):
+    """
+    Sets the number of torch threads of the process. The inter-op threads can only be set before torch ran parallel work.
+
+    :Parameters:
+        config: (Dictionary) Execution settings like load_config returns them. Default CONFIG.
+    """
+    if config["threads"] > 0:
+        torch.set_num_threads(config["threads"])
+    if config["interop_threads"] > 0:
+        try:
+            torch.set_num_interop_threads(config["interop_threads"])
+        except RuntimeError:
+            logging.getLogger(__name__).warning("Inter-op threads of torch are already set.")
+
+def get_config(overrides = None):
+    """
+    Returns the execution settings of a request, the process settings updated with the "execution" settings of the request,
+    e.g. {"threads": 4, "loaderWorkers": 0, "pinMemory": false, "processes": 8}.
+    Raises a ValueError for unknown settings and for values that are not a boolean pinMemory or a non-negative integer.
+
+    :Parameters:
+        overrides: (Dictionary) Execution settings of the request. Default None.
+    """
+    config = dict(CONFIG)
+    for key, value in (overrides or {}).items():
+        if key not in REQUEST_KEYS:
+            raise ValueError("Unknown execution setting: " + str(key))
+        if key == "pinMemory":
+            valid = isinstance(value, bool)
+        else:
+            valid = isinstance(value, int) and not isinstance(value, bool) and value >= 0
+        if not valid:
+            raise ValueError("Invalid value of the execution setting {}: {}".format(key, value))
+        config[REQUEST_KEYS[key]] = value
+    return config
+
+@contextlib.contextmanager
+def torch_threads(config):
+    """
+    Context that runs with the number of torch threads of the config and restores the previous number afterwards.
+    Contexts that change the number are serialized, because the setting is global for the process.
+
+    :Parameters:
+        config: (Dictionary) Execution settings like get_config returns them.
+    """
+    num_threads = config["threads"]
+    if num_threads <= 0 or num_threads == CONFIG["threads"]:
+        yield
+        return
+    with THREADS_LOCK:
+        previous = torch.get_num_threads()
+        torch.set_num_threads(num_threads)
+        try:
+            yield
+        finally:
+            torch.set_num_threads(previous)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,66 @@
+import numpy as np
+import torch
+
+
+def decode_image(data):
+    """
+    Returns an encoded image (png, jpg, ...) as grayscale uint8 array, decoded in memory.
+
+    :Parameters:
+        data: (bytes) Content of the image file.
+    """
+    # cv2 takes long to import and only the images of drawings and predictions need it
+    import cv2
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Image could not be decoded.")
+    return image
+
+def read_image(path):
+    """
+    Returns an image file as grayscale uint8 array.
+
+    :Parameters:
+        path: (string) Path of the image file.
+    """
+    import cv2
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Image could not be read: " + path)
+    return image
+
+def decode_uint8_tensor(data, shape):
+    """
+    Returns raw uint8 pixels as array with the shape (N, height, width).
+
+    :Parameters:
+        data: (bytes) Raw pixels, row-major.
+        shape: ([Integer]) Shape of the pixels, (N, height, width) or (height, width) for a single image.
+    """
+    images = np.frombuffer(data, dtype=np.uint8).reshape(shape)
+    if images.ndim == 2:
+        images = images[np.newaxis]
+    return images
+
+def to_input_batch(images, width = 28, height = 28):
+    """
+    Returns grayscale uint8 images as a float batch with the shape (N, 1, height, width), prepared like the free drawings:
+    resized, scaled to [0, 1] and the empty background set to -1.
+
+    :Parameters:
+        images: ([np.array]) Grayscale uint8 images, they can have different sizes.
+        width: (Integer) Input width of the network. Default is 28.
+        height: (Integer) Input height of the network. Default is 28.
+    """
+    batch = np.empty((len(images), 1, height, width), dtype=np.float32)
+    for i, image in enumerate(images):
+        if image.shape != (height, width):
+            import cv2
+            image = cv2.resize(image, (width, height))
+        batch[i, 0] = image / 255.0
+    batch[batch == 0] = -1
+    return torch.from_numpy(batch)
+
+
+if __name__ == "__main__":
+    pass
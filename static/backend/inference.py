@@ -0,0 +1,97 @@
+import copy
+import time
+
+import torch
+import torch.nn as nn
+
+import neural_network_module as neural_network
+
+
+# inference modes a request can choose, float32 is the plain model
+MODES = ["float32", "int8", "bfloat16", "channels_last"]
+
+
+class Autocast(nn.Module):
+    """
+    Runs a layer under bfloat16 autocast on the cpu and returns float32 outputs, so the layers around it stay unchanged.
+
+    :Parameters:
+        module: (nn.Module) Layer that should run in bfloat16.
+
+    :Attributes:
+        module: (nn.Module) wrapped layer.
+    """
+    def __init__(self, module):
+        super(Autocast, self).__init__()
+        self.module = module
+
+    def forward(self, x):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            return self.module(x).float()
+
+
+def optimize(net, mode):
+    """
+    Returns an optimized copy of a network for inference. The copy keeps the containers and layer names of the network,
+    so it can be tested, ablated and visualized like the network itself.
+        "int8": the linear layers are quantized dynamically to int8.
+        "bfloat16": the conv and linear layers run under bfloat16 autocast.
+        "channels_last": the conv weights use the channels-last memory layout.
+
+    :Parameters:
+        net: (Sequential_Net) Network that should be optimized, it is not changed.
+        mode: (string) One of MODES.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown inference mode: " + str(mode))
+    if mode == "int8":
+        return torch.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+
+    optimized = copy.deepcopy(net).eval()
+    if mode == "bfloat16":
+        if not hasattr(torch, "autocast"):
+            raise ValueError("bfloat16 inference needs a newer torch version.")
+        for container in optimized.layer_settings:
+            modules = optimized.__getattr__(container)
+            for name, module in list(modules.named_children()):
+                if isinstance(module, (nn.Conv2d, nn.Linear)):
+                    modules._modules[name] = Autocast(module)
+    elif mode == "channels_last":
+        optimized = optimized.to(memory_format=torch.channels_last)
+    return optimized
+
+def compare(reference, model, loss, testset, batch_size = 1000, device = "cpu"):
+    """
+    Tests the reference model and an optimized version of it on the same data and returns the results of the optimized model
+    (like Sequential_Net.test_start) and a json serializable report of the accuracy delta and the speedup.
+
+    :Parameters:
+        reference: (Sequential_Net) Float32 model.
+        model: (nn.Module) Optimized model.
+        loss: (string) Loss Function for the test loss.
+        testset: (dataset) Test data.
+        batch_size: (Integer) Batch size of the test. Default is 1000.
+        device: (String) Divice that will be used for the test. Default is cpu.
+    """
+    start = time.perf_counter()
+    reference_results = neural_network.test_model(reference, loss, testset, batch_size, device)
+    reference_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = neural_network.test_model(model, loss, testset, batch_size, device)
+    seconds = time.perf_counter() - start
+
+    report = {
+        "accuracy": results[0],
+        "referenceAccuracy": reference_results[0],
+        "accuracyDelta": results[0] - reference_results[0],
+        "changedSamples": int((results[1] != reference_results[1]).sum()),
+        "seconds": seconds,
+        "referenceSeconds": reference_seconds,
+        "speedup": reference_seconds / seconds if seconds > 0 else None
+    }
+    return results, report
+
+
+if __name__ == "__main__":
+    pass
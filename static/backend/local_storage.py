@@ -0,0 +1,542 @@
+import collections
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import uuid
+import warnings
+
+import numpy as np
+import torch
+
+import mongo_module as mongo
+
+import weight_store
+
+
+def get_value(document, path):
+    """
+    Returns the value of a dotted path like "weights.features" in a document, or None if it does not exist.
+
+    :Parameters:
+        document: (Dictionary) Document.
+        path: (string) Dotted path of the attribute.
+    """
+    value = document
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+# query operators of the conditions: name -> (function of the value and the operand, flag for matching a missing value)
+OPERATORS = {
+    "$gt": (lambda value, operand: value > operand, False),
+    "$gte": (lambda value, operand: value >= operand, False),
+    "$lt": (lambda value, operand: value < operand, False),
+    "$lte": (lambda value, operand: value <= operand, False),
+    "$in": (lambda value, operand: value in operand, False),
+    "$nin": (lambda value, operand: value not in operand, True),
+    "$ne": (lambda value, operand: value != operand, True),
+    "$mod": (lambda value, operand: value % operand[0] == operand[1], False)
+}
+
+def matches(document, condition):
+    """
+    Returns True if a document fullfils a condition. Supports equality and the operators in OPERATORS, which are the ones
+    the backend uses. Any other operator raises a ValueError instead of matching every document.
+
+    :Parameters:
+        document: (Dictionary) Document.
+        condition: (Dictionary) Condition like MongoDB takes it.
+    """
+    for path, expected in condition.items():
+        if path.startswith("$"):
+            raise ValueError("Unsupported query operator: " + path)
+        value = get_value(document, path)
+        if not isinstance(expected, dict):
+            if value != expected:
+                return False
+            continue
+        for operator, operand in expected.items():
+            if operator not in OPERATORS:
+                raise ValueError("Unsupported query operator: " + operator)
+            function, matches_missing = OPERATORS[operator]
+            if value is None:
+                if not matches_missing:
+                    return False
+            elif not function(value, operand):
+                return False
+    return True
+
+def project(document, a_list):
+    """
+    Returns a document with only the uuid and the attributes of a projection.
+
+    :Parameters:
+        document: (Dictionary) Document.
+        a_list: ([string]) List of (dotted) attributes. None returns the whole document.
+    """
+    if a_list is None:
+        return document
+    result = {"_id": document["_id"]}
+    for path in a_list:
+        value = get_value(document, path)
+        if value is None:
+            continue
+        target = result
+        keys = path.split(".")
+        for key in keys[:-1]:
+            target = target.setdefault(key, collections.OrderedDict())
+        target[keys[-1]] = value
+    return result
+
+
+class SQLiteCollection:
+    """
+    Collection of documents in a local SQLite file with the same methods as mongo_module.Mongo, so it can replace it
+    without a database server. The documents are pickled, conditions are evaluated in Python, which is fine for the
+    small metadata collections of the backend.
+
+    :Parameters:
+        path: (string) Path of the SQLite file, shared by every collection of a storage.
+        collection: (string) Name of the collection, a table in the file.
+
+    :Attributes:
+        __connection: (sqlite3.Connection) connection to the file.
+        __lock: (threading.Lock) serializes the access to the connection.
+        name: (string) name of the collection, used in the statistics.
+    """
+    def __init__(self, path, collection):
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__lock = threading.Lock()
+        self.name = collection
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS "{}" (rowid INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE, doc BLOB)'.format(collection))
+
+    @mongo.timed
+    def get_item_by_id(self, item_id, a_list=None):
+        """
+        Returns an Item by uuid
+
+        :Parameters:
+            item_id: (string) The uuid from the item you want to retrieve.
+            a_list: ([string]) List of attributes that should be returned. Default None returns all attributes.
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT doc FROM "{}" WHERE id = ?'.format(self.name), (item_id,)).fetchone()
+        return project(pickle.loads(row[0]), a_list) if row is not None else None
+
+    @mongo.timed
+    def get_all_attributes(self, a_list):
+        """
+        Returns only the uuid and the wanted attributes from the collection.
+
+        :Parameters:
+            a_list: ([string]) List of attributes from which we want to have the information.
+        """
+        return [project(document, a_list) for document in self.__iterate()]
+
+    @mongo.timed
+    def post_item(self, item):
+        """
+        Posts an item and returns its uuid and the acknowledge.
+
+        :Parameters:
+            item: (Dictionary/JSON) Item you want to post.
+        """
+        item_id = item.get("_id") or uuid.uuid4().hex
+        item["_id"] = item_id
+        self.__write(item_id, item)
+        return [item_id, True]
+
+    @mongo.timed
+    def update_item(self, item_id, content):
+        """
+        Updates the attributes of an item with given uuid. It Returns the number of the updated element.
+
+        :Parameters:
+            item_id: (string) The uuid from the item you want to update.
+            content: (Dictionary/JSON) Content you want to update for the given item. Beware same attribute replace the old one.
+        """
+        with self.__lock, self.__connection:
+            row = self.__connection.execute('SELECT doc FROM "{}" WHERE id = ?'.format(self.name), (item_id,)).fetchone()
+            if row is None:
+                return 0
+            document = pickle.loads(row[0])
+            document.update(content)
+            self.__connection.execute('UPDATE "{}" SET doc = ? WHERE id = ?'.format(self.name), (pickle.dumps(document), item_id))
+        return 1
+
+    @mongo.timed
+    def unset_attributes(self, item_id, a_list):
+        """
+        Removes the given attributes from an item with given uuid. It Returns the number of the updated element.
+
+        :Parameters:
+            item_id: (string) The uuid from the item you want to update.
+            a_list: ([string]) List of attributes that should be removed.
+        """
+        with self.__lock, self.__connection:
+            row = self.__connection.execute('SELECT doc FROM "{}" WHERE id = ?'.format(self.name), (item_id,)).fetchone()
+            if row is None:
+                return 0
+            document = pickle.loads(row[0])
+            for a in a_list:
+                document.pop(a, None)
+            self.__connection.execute('UPDATE "{}" SET doc = ? WHERE id = ?'.format(self.name), (pickle.dumps(document), item_id))
+        return 1
+
+    @mongo.timed
+    def get_item_by_condition(self, condition, a_list=None):
+        """
+        Returns the first item with a given condition or None if there is no such item.
+
+        :Parameters:
+            condition: (Dictionary/JSON) Conditions that have to be fullfiled for the item.
+            a_list: ([string]) List of attributes that should be returned. Default None returns all attributes.
+        """
+        for document in self.__iterate():
+            if matches(document, condition):
+                return project(document, a_list)
+        return None
+
+    @mongo.timed
+    def get_items_by_condition(self, condition, a_list=None, sort=None):
+        """
+        Returns a list of all items with a given condition.
+
+        :Parameters:
+            condition: (Dictionary/JSON) Conditions that have to be fullfiled for an item.
+            a_list: ([string]) List of attributes that should be returned. Default None returns all attributes.
+            sort: ([(string, int)]) List of (attribute, direction) pairs the items are sorted by.
+        """
+        documents = [document for document in self.__iterate() if matches(document, condition)]
+        for key, direction in reversed(sort or []):
+            documents.sort(key=lambda document: get_value(document, key), reverse=direction < 0)
+        return [project(document, a_list) for document in documents]
+
+    def iterate_items_by_condition(self, condition, a_list=None, sort=None):
+        """
+        Returns a generator over the items with a given condition.
+
+        :Parameters:
+            condition: (Dictionary/JSON) Conditions that have to be fullfiled for an item.
+            a_list: ([string]) List of attributes that should be returned. Default None returns all attributes.
+            sort: ([(string, int)]) List of (attribute, direction) pairs the items are sorted by.
+        """
+        for item in self.get_items_by_condition(condition, a_list, sort):
+            yield item
+
+    @mongo.timed
+    def replace_item_by_condition(self, condition, item):
+        """
+        Replaces the item with a given condition or inserts it if there is none. Returns the acknowledge.
+
+        :Parameters:
+            condition: (Dictionary/JSON) Conditions that identify the item.
+            item: (Dictionary/JSON) Item that should be stored.
+        """
+        existing = self.get_item_by_condition(condition, [])
+        item = dict(item)
+        item["_id"] = existing["_id"] if existing is not None else uuid.uuid4().hex
+        self.__write(item["_id"], item)
+        return True
+
+    @mongo.timed
+    def replace_items_by_conditions(self, pairs):
+        """
+        Replaces or inserts several items. Returns the acknowledge.
+
+        :Parameters:
+            pairs: ([(Dictionary, Dictionary)]) List of (condition, item) pairs like replace_item_by_condition takes them.
+        """
+        for condition, item in pairs:
+            self.replace_item_by_condition(condition, item)
+        return True
+
+    @mongo.timed
+    def get_page(self, a_list, condition=None, after=None, limit=50):
+        """
+        Returns a page of items in insertion order and the uuid to continue after, or None if it was the last page.
+
+        :Parameters:
+            a_list: ([string]) List of attributes that should be returned.
+            condition: (Dictionary/JSON) Conditions that have to be fullfiled for an item. Default None returns all items.
+            after: (string) uuid of the last item of the previous page. Default None starts with the first item.
+            limit: (Integer) Maximal number of items of the page. Default is 50.
+        """
+        with self.__lock:
+            start = 0
+            if after is not None:
+                row = self.__connection.execute('SELECT rowid FROM "{}" WHERE id = ?'.format(self.name), (after,)).fetchone()
+                start = row[0] if row is not None else 0
+            rows = self.__connection.execute(
+                'SELECT doc FROM "{}" WHERE rowid > ? ORDER BY rowid'.format(self.name), (start,)).fetchall()
+        items = []
+        for row in rows:
+            document = pickle.loads(row[0])
+            if matches(document, condition or {}):
+                items.append(project(document, a_list))
+                if len(items) == limit:
+                    break
+        return items, (items[-1]["_id"] if len(items) == limit else None)
+
+    @mongo.timed
+    def delete_items_by_condition(self, condition):
+        """
+        Deletes all items with a given condition. Returns the number of deleted items.
+
+        :Parameters:
+            condition: (Dictionary/JSON) Conditions that have to be fullfiled for an item.
+        """
+        ids = [(document["_id"],) for document in self.__iterate() if matches(document, condition)]
+        with self.__lock, self.__connection:
+            self.__connection.executemany('DELETE FROM "{}" WHERE id = ?'.format(self.name), ids)
+        return len(ids)
+
+    def create_index(self, keys, unique=False):
+        """
+        Does nothing, the conditions are evaluated in Python. Exists for the interface of mongo_module.Mongo.
+
+        :Parameters:
+            keys: ([(string, int)]) List of (attribute, direction) pairs of the index.
+            unique: (boolean) Flag if the index should be unique. False by default.
+        """
+        return None
+
+    def __iterate(self):
+        """Private Method: Returns every document of the collection in insertion order."""
+        with self.__lock:
+            rows = self.__connection.execute('SELECT doc FROM "{}" ORDER BY rowid'.format(self.name)).fetchall()
+        return [pickle.loads(row[0]) for row in rows]
+
+    def __write(self, item_id, item):
+        """
+        Private Method: Inserts or replaces a document.
+
+        :Parameters:
+            item_id: (string) uuid of the document.
+            item: (Dictionary) Document.
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                'INSERT INTO "{0}" (id, doc) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET doc = excluded.doc'.format(self.name),
+                (item_id, pickle.dumps(item)))
+
+
+class FileWeightStore:
+    """
+    Stores the weights of every epoch as .npy files, one directory per network and epoch with one file per weights and bias
+    and the layer settings as json. The files are memory-mapped when they are loaded, so the weights are not read or copied
+    before the model is built. Has the same methods as weight_store.WeightStore.
+
+    :Parameters:
+        directory: (string) Directory the networks are stored in.
+        dtype: (string) Type the weights are stored with. "float32" or "float16", default is float32.
+
+    :Attributes:
+        directory: (string) directory the networks are stored in.
+        dtype: (string) type the weights are stored with.
+    """
+    def __init__(self, directory, dtype="float32"):
+        self.directory = directory
+        self.dtype = dtype
+        os.makedirs(directory, exist_ok=True)
+
+    def save_epoch(self, network_id, epoch, weights):
+        """
+        Saves the weights of one epoch of a network. An existing epoch gets replaced.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            epoch: (Integer) Number of the epoch.
+            weights: (collections.OrderedDict) Weights of the epoch with tensors or lists.
+        """
+        path = self.__get_path(network_id, epoch)
+        # the epoch is written next to its place and renamed, so readers never see half an epoch
+        temporary = path + ".tmp"
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        settings = collections.OrderedDict()
+        for container, layers in weights.items():
+            settings[container] = collections.OrderedDict()
+            for layer, content in layers.items():
+                settings[container][layer] = content["settings"]
+                for key in ("weights", "bias"):
+                    if key in content:
+                        array = torch.as_tensor(content[key], dtype=torch.float32).detach().cpu().numpy()
+                        np.save(os.path.join(temporary, "{}.{}.{}.npy".format(container, layer, key)),
+                                array.astype(weight_store.DTYPES[self.dtype][1]))
+        with open(os.path.join(temporary, "settings.json"), "w") as f:
+            json.dump(settings, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(temporary, path)
+        return True
+
+    def save_epochs(self, network_id, epochs):
+        """
+        Saves several epochs of a network. Existing epochs get replaced.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            epochs: (Dictionary) Epoch number -> weights of the epoch with tensors or lists.
+        """
+        for epoch in sorted(epochs):
+            self.save_epoch(network_id, epoch, epochs[epoch])
+        return True
+
+    def load_epoch(self, network_id, epoch, container=None, layer=None):
+        """
+        Returns the weights of one epoch of a network with memory-mapped tensors or None if the epoch is not stored.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            epoch: (Integer) Number of the epoch.
+            container: (string) Only loads the layers of this container. Default None loads all containers.
+            layer: (string) Only loads this layer of the container. Default None loads all layers.
+        """
+        path = self.__get_path(network_id, epoch)
+        if not os.path.isdir(path):
+            return None
+        with open(os.path.join(path, "settings.json")) as f:
+            settings = json.load(f, object_pairs_hook=collections.OrderedDict)
+
+        weights = collections.OrderedDict()
+        for container_name, layers in settings.items():
+            if container is not None and container_name != container:
+                continue
+            weights[container_name] = collections.OrderedDict()
+            for layer_name, layer_settings in layers.items():
+                if layer is not None and layer_name != layer:
+                    continue
+                content = {"settings": layer_settings}
+                for key in ("weights", "bias"):
+                    file_path = os.path.join(path, "{}.{}.{}.npy".format(container_name, layer_name, key))
+                    if os.path.exists(file_path):
+                        content[key] = self.__load_array(file_path)
+                weights[container_name][layer_name] = content
+        return weights
+
+    def load_epochs(self, network_id, start=0, limit=None, container=None, layer=None):
+        """
+        Returns an OrderedDict of the stored epochs of a network with the epoch number as key.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            start: (Integer) First epoch that is loaded. Default is 0.
+            limit: (Integer) Maximal number of epochs that are loaded. Default None loads all epochs.
+            container: (string) Only loads the layers of this container. Default None loads all containers.
+            layer: (string) Only loads this layer of the container. Default None loads all layers.
+        """
+        end = None if limit is None else start + limit
+        return collections.OrderedDict(self.iter_epochs(network_id, start, end, 1, container, layer))
+
+    def iter_epochs(self, network_id, start=0, end=None, step=1, container=None, layer=None):
+        """
+        Returns a generator of (epoch number, weights) tuples in epoch order.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            start: (Integer) First epoch that is loaded. Default is 0.
+            end: (Integer) Epoch after the last one that is loaded. Default None loads to the last epoch.
+            step: (Integer) Only every step-th epoch from start on is loaded. Default is 1.
+            container: (string) Only loads the layers of this container. Default None loads all containers.
+            layer: (string) Only loads this layer of the container. Default None loads all layers.
+        """
+        for epoch in self.__get_epochs(network_id):
+            if epoch < start or (end is not None and epoch >= end) or (epoch - start) % step != 0:
+                continue
+            yield epoch, self.load_epoch(network_id, epoch, container, layer)
+
+    def get_storage_stats(self, network_id):
+        """
+        Returns the number of stored epochs and the stored bytes, the files are not compressed.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+        """
+        stats = {"epochs": 0, "keyframes": 0, "storedBytes": 0, "rawBytes": 0}
+        for epoch in self.__get_epochs(network_id):
+            path = self.__get_path(network_id, epoch)
+            stats["epochs"] += 1
+            stats["keyframes"] += 1
+            for name in os.listdir(path):
+                if name.endswith(".npy"):
+                    array = np.load(os.path.join(path, name), mmap_mode="r")
+                    stats["storedBytes"] += array.nbytes
+                    stats["rawBytes"] += array.size * 4
+        stats["compressionRatio"] = stats["rawBytes"] / stats["storedBytes"] if stats["storedBytes"] else None
+        return stats
+
+    def load_settings(self, network_id):
+        """
+        Returns the layer settings of a network as a dictionary of containers with lists of layer settings.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+        """
+        path = os.path.join(self.__get_path(network_id, 0), "settings.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            settings = json.load(f, object_pairs_hook=collections.OrderedDict)
+        return collections.OrderedDict((container, list(layers.values())) for container, layers in settings.items())
+
+    def __get_path(self, network_id, epoch):
+        """
+        Private Method: Returns the directory of an epoch.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            epoch: (Integer) Number of the epoch.
+        """
+        return os.path.join(self.__get_network_path(network_id), "epoch_" + str(int(epoch)))
+
+    def __get_network_path(self, network_id):
+        """
+        Private Method: Returns the directory of a network. The id comes from the requests, so anything that is not
+        a single path component raises a ValueError instead of leading out of the weights directory.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+        """
+        network_id = str(network_id)
+        if network_id in ("", ".", "..") or os.sep in network_id or (os.altsep and os.altsep in network_id):
+            raise ValueError("Invalid network id: " + network_id)
+        return os.path.join(self.directory, network_id)
+
+    def __get_epochs(self, network_id):
+        """
+        Private Method: Returns the sorted numbers of the stored epochs of a network.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+        """
+        path = self.__get_network_path(network_id)
+        if not os.path.isdir(path):
+            return []
+        return sorted(int(name[len("epoch_"):]) for name in os.listdir(path) if name.startswith("epoch_") and name[len("epoch_"):].isdigit())
+
+    def __load_array(self, file_path):
+        """
+        Private Method: Returns a float32 tensor of a memory-mapped .npy file. Float32 files are not copied.
+
+        :Parameters:
+            file_path: (string) Path of the file.
+        """
+        array = np.load(file_path, mmap_mode="r")
+        with warnings.catch_warnings():
+            # the mapped file is read-only, the tensor is only read when loading the state dict
+            warnings.simplefilter("ignore", UserWarning)
+            tensor = torch.from_numpy(array)
+        if tensor.dtype != torch.float32:
+            tensor = tensor.float()
+        return tensor
+
+
+if __name__ == "__main__":
+    pass
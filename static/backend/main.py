@@ -1,14 +1,15 @@
-from flask import Flask, request
+from flask import Flask, request, Response
 from flask_cors import CORS, cross_origin
 from werkzeug.utils import secure_filename
 
 import json
 import uuid
 import os
-import pickle
 import datetime
+import copy
+import time
+import contextlib
 
-import cv2
 import torch
 import collections
 
@@ -20,62 +21,439 @@ import ablation
 
 import dataset_loader
 
+import weight_store
 
-# creates a communication channel with mongoDB
-DB_CONNECTION = mongo.Mongo("mongodb://localhost:27017/", "networkDB", "networks")
+import model_cache
+
+import sessions
+
+import training_jobs
+
+import embeddings
+
+import responses
+
+import image_input
+
+import activations
+
+import inference
+
+import execution
+
+import evaluator
+
+import weight_history
+
+import checkpoint_writer
+
+import storage
+
+import metrics
+
+import warm_up
+
+import stacked_training
+
+
+# storage backend of the networks, weights and embeddings: MongoDB or a local directory (STORAGE=local), set by create_app
+STORAGE = None
+# communication channel with the networks collection
+DB_CONNECTION = None
+# stores the weights of every epoch, binary blobs in MongoDB or memory-mapped files in the local storage
+WEIGHT_STORE = None
+# computed embeddings of layer activations
+EMBEDDING_STORE = None
+# preloads datasets and the latest networks after the start, the readiness probe waits for it
+WARM_UP = None
 # if gpu with cuda is available set it to it.
 DEVICE = neural_network.get_device()
 
-# Model and information about it for not loading everytime the weights from db
-################################################################################
-MODEL = neural_network.Sequential_Net()
-MODEL_DICT = {}
-ABLATED_MODEL = neural_network.Sequential_Net()
-TEST_ABLATED_MODEL = False
-################################################################################
+# shards tests and ablation sweeps across processes if a request asks for more than one, the processes start on first use
+EVALUATOR = evaluator.ProcessEvaluator(execution.CONFIG["processes"] or None)
+
+# loaded models of several networks, epochs and ablations, bounded by MODEL_CACHE_SIZE megabytes
+MODEL_CACHE = model_cache.ModelCache(int(os.environ.get("MODEL_CACHE_SIZE", 512)) * 1024 * 1024)
+
+# model and ablation state of every user session, identified by the X-Session-ID header
+SESSIONS = sessions.SessionStore(int(os.environ.get("SESSION_TIMEOUT", 3600)))
+# serializes the training of the same network
+TRAINING_LOCKS = sessions.KeyedLocks()
+# runs the training jobs in the background
+TRAINING_JOBS = training_jobs.JobManager(int(os.environ.get("TRAINING_WORKERS", 2)))
+# computes the embeddings of layer activations
+EMBEDDING_JOBS = training_jobs.JobManager(int(os.environ.get("EMBEDDING_WORKERS", 1)))
 
 DIGIT_DIR = "../data/digit/"
 
-def change_model(uuid):
+# attributes of a network document without any weights
+NETWORK_ATTRIBUTES = ["name", "epochs", "input_dim", "settings", "loss_function", "dataset", "last_modified", "training"]
+
+def load_epoch_weights(network, epoch):
     '''
-    Changes the Model if the id isn't the same.
+    Returns the weights of an epoch from the weight store. Falls back to not yet migrated list encoded epochs in the network document.
+
+    :Parameters:
+        network: (Dictionary) Network document from the database.
+        epoch: (Integer) Number of the epoch.
+    '''
+    weights = WEIGHT_STORE.load_epoch(network["_id"], epoch)
+    if weights is None:
+        epoch_key = "epoch_" + str(epoch)
+        weights = DB_CONNECTION.get_item_by_id(network["_id"], [epoch_key])[epoch_key]
+    return weights
+
+def get_network_info(uuid):
+    '''
+    Returns the network document without any weights. Networks created before the layer settings were saved get them from epoch 0.
 
     :Parameters:
         uuid: (String) id of the network.
     '''
-    global MODEL
-    global MODEL_DICT
-    if len(MODEL_DICT) > 0:
-        if uuid != MODEL_DICT["_id"]:
-            MODEL_DICT = DB_CONNECTION.get_item_by_id(uuid)
-            MODEL = neural_network.load_model_from_weights(MODEL_DICT, MODEL_DICT["input_dim"])
-    else:
-        MODEL_DICT = DB_CONNECTION.get_item_by_id(uuid)
-        MODEL = neural_network.load_model_from_weights(MODEL_DICT, MODEL_DICT["input_dim"])
+    network = DB_CONNECTION.get_item_by_id(uuid, NETWORK_ATTRIBUTES)
+    if "settings" not in network:
+        network["settings"] = WEIGHT_STORE.load_settings(uuid)
+    return network
 
-# Updates the mongoDB communication channel if production.
-def create_db_connection():
-    global DB_CONNECTION
+def get_network(uuid):
+    '''
+    Returns the network document with every epoch's weights as lists like the frontend expects it.
 
-    if "env" in os.environ and os.environ["env"] == "prod":
-        DB_CONNECTION = mongo.Mongo("mongodb://database:27017/", "networkDB", "networks")
+    :Parameters:
+        uuid: (String) id of the network.
+    '''
+    network = DB_CONNECTION.get_item_by_id(uuid)
+    for epoch, weights in WEIGHT_STORE.load_epochs(uuid).items():
+        network["epoch_" + str(epoch)] = weight_store.to_lists(weights)
+    return network
+
+def load_network(uuid, epoch=-1):
+    '''
+    Returns the network document without weights and the model of an epoch loaded from the database.
+
+    :Parameters:
+        uuid: (String) id of the network.
+        epoch: (Integer) Number of the epoch. Default -1 loads the latest epoch.
+    '''
+    network = get_network_info(uuid)
+    weights = load_epoch_weights(network, network["epochs"] if epoch == -1 else epoch)
+    with metrics.stage("load_model"):
+        return network, neural_network.load_model_from_epoch(weights, network["input_dim"])
+
+def get_model(uuid, epoch=-1, mode="float32"):
+    '''
+    Returns the network document without weights and the model of an epoch from the model cache.
+    Optimized inference modes are cached as variants of the plain model.
+
+    :Parameters:
+        uuid: (String) id of the network.
+        epoch: (Integer) Number of the epoch. Default -1 loads the latest epoch.
+        mode: (String) Inference mode, one of inference.MODES. Default float32 is the plain model.
+    '''
+    if mode == "float32":
+        return MODEL_CACHE.get_or_load((uuid, epoch, None), lambda: load_network(uuid, epoch))
+
+    def load_optimized():
+        model_dict, model = get_model(uuid, epoch)
+        return model_dict, inference.optimize(model, mode)
+    return MODEL_CACHE.get_or_load((uuid, epoch, mode), load_optimized)
+
+def get_session():
+    '''
+    Returns the session of the actual request.
+    '''
+    return SESSIONS.get(request.headers.get(sessions.SESSION_HEADER, sessions.DEFAULT_SESSION))
+
+def change_model(session, uuid):
+    '''
+    Changes the Model of the session to the latest epoch of the network, from the model cache if it is cached.
+
+    :Parameters:
+        session: (sessions.Session) Session of the request.
+        uuid: (String) id of the network.
+    '''
+    model_dict, model = get_model(uuid)
+    with session.lock:
+        if session.model_dict.get("_id") != uuid:
+            # an ablation belongs to the network it was made for
+            session.ablation_nodes = []
+        session.model_dict, session.model = model_dict, model
+
+def get_epoch_saver(uuid, model_dict, start_epoch, trainSettings, job=None):
+    '''
+    Returns the function that saves an epoch of a training run for a CheckpointWriter: it stores the weights and
+    updates the network document, the network dict and the model cache, then publishes the epoch to the job.
+
+    :Parameters:
+        uuid: (String) id of the network.
+        model_dict: (Dictionary) Network dict of the run, updated with every saved epoch.
+        start_epoch: (Integer) Number of the epoch the run started from.
+        trainSettings: (Dictionary) Training settings of the network.
+        job: (training_jobs.TrainingJob) Job that gets the progress events. Default None.
+    '''
+    def save_epoch(epoch, weights, epoch_metrics):
+        # runs in the writer thread, the network document only counts an epoch once its weights are stored
+        epoch_number = start_epoch + epoch + 1
+        WEIGHT_STORE.save_epoch(uuid, epoch_number, weights)
+        epoch_dict = {
+            "epochs": epoch_number,
+            "loss_function": trainSettings["loss"],
+            "dataset": trainSettings["dataset"],
+            "last_modified": datetime.datetime.utcnow().strftime("%Y/%m/%d, %H:%M:%S")
+        }
+        DB_CONNECTION.update_item(uuid, epoch_dict)
+        model_dict.update(epoch_dict)
+        MODEL_CACHE.invalidate(uuid)
+        if job is not None:
+            epoch_metrics.update({"networkID": uuid, "epoch": epoch_number, "run_epoch": epoch + 1, "run_epochs": trainSettings["epochs"]})
+            job.publish("epoch", epoch_metrics)
+    return save_epoch
+
+def close_writers(writers, raise_error=True):
+    '''
+    Waits for every CheckpointWriter of a run and raises the first error of them.
+
+    :Parameters:
+        writers: ([checkpoint_writer.CheckpointWriter]) Writers of the run.
+        raise_error: (boolean) Flag for raising the error of a writer if saving failed. True by default.
+    '''
+    for writer in writers:
+        writer.close(raise_error=False)
+    errors = [writer.error for writer in writers if writer.error is not None]
+    if raise_error and errors:
+        raise errors[0]
+
+def train_network(uuid, trainSettings, job=None, resume=False):
+    '''
+    Trains the latest epoch of a network and returns the new network dict and model.
+    Every epoch is saved by a background writer as soon as it is finished, so a cancelled or crashed run keeps its finished epochs.
+    Until the run is finished the network document holds its settings and target epoch as "training", so it can be resumed.
+
+    :Parameters:
+        uuid: (String) id of the network.
+        trainSettings: (Dictionary) Training settings from the request.
+        job: (training_jobs.TrainingJob) Job that gets the progress events and can cancel the training. Default None.
+        resume: (boolean) Flag for training the remaining epochs of the stored "training" instead, with its settings. False by default.
+    '''
+    trainset = dataset_loader.get_tensor_dataset(trainSettings["dataset"])
+
+    with TRAINING_LOCKS.get(uuid):
+        model_dict, model = get_model(uuid)
+        if resume:
+            # read under the lock, so the epochs a run before stored are not trained again
+            training = DB_CONNECTION.get_item_by_id(uuid, ["training"]).get("training")
+            remaining = training["target_epochs"] - model_dict["epochs"] if training is not None else 0
+            if remaining <= 0:
+                if training is not None:
+                    DB_CONNECTION.unset_attributes(uuid, ["training"])
+                return model_dict, model
+            trainSettings = dict(training["settings"], epochs=remaining)
+        # the cached model stays untouched while the copy is trained
+        model = copy.deepcopy(model)
+        model_dict = dict(model_dict)
+        start_epoch = model_dict["epochs"]
+        training = {"settings": trainSettings, "target_epochs": start_epoch + trainSettings["epochs"]}
+        DB_CONNECTION.update_item(uuid, {"training": training})
+
+        writer = checkpoint_writer.CheckpointWriter(get_epoch_saver(uuid, model_dict, start_epoch, trainSettings, job))
+        try:
+            neural_network.train_model(
+                model,
+                trainSettings["epochs"],
+                trainSettings["loss"],
+                trainSettings["optimizer"],
+                trainset,
+                trainSettings["batchSize"],
+                trainSettings["learningrate"],
+                DEVICE,
+                job.on_batch if job is not None else None,
+                writer.submit,
+                execution.get_config(trainSettings.get("execution"))
+            )
+            writer.close()
+        except training_jobs.JobCancelled:
+            # a cancelled run is not resumed, its finished epochs are kept
+            writer.close(raise_error=False)
+            DB_CONNECTION.unset_attributes(uuid, ["training"])
+            raise
+        except BaseException:
+            writer.close(raise_error=False)
+            raise
+        finally:
+            MODEL_CACHE.invalidate(uuid)
+
+        DB_CONNECTION.unset_attributes(uuid, ["training"])
+        model_dict.pop("training", None)
+        model.eval()
+        MODEL_CACHE.put((uuid, -1, None), model_dict, model)
+    return model_dict, model
+
+def train_networks(uuids, trainSettings, networkSettings, job=None):
+    '''
+    Trains the latest epochs of networks with the same architecture together, in one pass over the data per epoch
+    (stacked_training), and returns their new network dicts. Every network's epochs are saved and can be resumed
+    like a run of train_network with the shared settings and its own loss, optimizer and learningrate.
+
+    :Parameters:
+        uuids: ([String]) ids of the networks.
+        trainSettings: (Dictionary) Training settings of the request shared by the networks.
+        networkSettings: ([Dictionary]) Settings of every network that differ from the shared ones, see stacked_training.NETWORK_SETTINGS.
+        job: (training_jobs.TrainingJob) Job that gets the progress events and can cancel the training. Default None.
+    '''
+    trainset = dataset_loader.get_tensor_dataset(trainSettings["dataset"])
+    settings = [dict(trainSettings, **own) for own in networkSettings]
+
+    with contextlib.ExitStack() as locks:
+        # the networks are locked in a fixed order, so two runs with common networks cannot deadlock
+        for uuid in sorted(uuids):
+            locks.enter_context(TRAINING_LOCKS.get(uuid))
+
+        model_dicts, models = [], []
+        for uuid in uuids:
+            model_dict, model = get_model(uuid)
+            # the cached models stay untouched while the copies are trained
+            model_dicts.append(dict(model_dict))
+            models.append(copy.deepcopy(model))
+        stacked_training.check_architecture(models)
+
+        writers = []
+        for uuid, model_dict, setting in zip(uuids, model_dicts, settings):
+            start_epoch = model_dict["epochs"]
+            DB_CONNECTION.update_item(uuid, {"training": {"settings": setting, "target_epochs": start_epoch + setting["epochs"]}})
+            writers.append(checkpoint_writer.CheckpointWriter(get_epoch_saver(uuid, model_dict, start_epoch, setting, job)))
+
+        def save_epoch(index, epoch, weights, epoch_metrics):
+            writers[index].submit(epoch, weights, epoch_metrics)
+
+        try:
+            stacked_training.train_models(
+                models,
+                trainSettings["epochs"],
+                settings,
+                trainset,
+                trainSettings["batchSize"],
+                DEVICE,
+                job.on_batch if job is not None else None,
+                save_epoch,
+                execution.get_config(trainSettings.get("execution"))
+            )
+            close_writers(writers)
+        except training_jobs.JobCancelled:
+            # a cancelled run is not resumed, its finished epochs are kept
+            close_writers(writers, raise_error=False)
+            for uuid in uuids:
+                DB_CONNECTION.unset_attributes(uuid, ["training"])
+            raise
+        except BaseException:
+            close_writers(writers, raise_error=False)
+            raise
+        finally:
+            for uuid in uuids:
+                MODEL_CACHE.invalidate(uuid)
+
+        for uuid, model_dict, model in zip(uuids, model_dicts, models):
+            DB_CONNECTION.unset_attributes(uuid, ["training"])
+            model_dict.pop("training", None)
+            model.eval()
+            MODEL_CACHE.put((uuid, -1, None), model_dict, model)
+    return model_dicts
+
+def warm_up_networks(count):
+    '''
+    Loads the most recently modified networks into the model cache and runs a forward pass through each.
+
+    :Parameters:
+        count: (Integer) Number of networks.
+    '''
+    networks = DB_CONNECTION.get_all_attributes(["last_modified"])
+    networks.sort(key=lambda network: network.get("last_modified", ""), reverse=True)
+    for network in networks[:count]:
+        model_dict, model = get_model(network["_id"])
+        input_dim = model_dict.get("input_dim", [28, 28, 1])
+        if len(input_dim) == 3:
+            with neural_network.inference_mode():
+                model(torch.zeros(1, input_dim[2], input_dim[1], input_dim[0]))
+
+def get_warm_up_steps(environ):
+    '''
+    Returns the warm-up steps from the environment: WARM_UP=0 disables the warm-up, WARM_UP_DATASETS are the comma
+    separated datasets that are loaded (default mnist), WARM_UP_NETWORKS the number of latest networks that are loaded (default 3).
+
+    :Parameters:
+        environ: (Dictionary) Environment variables.
+    '''
+    if environ.get("WARM_UP", "1") == "0":
+        return []
+    steps = []
+    for data_name in filter(None, environ.get("WARM_UP_DATASETS", "mnist").split(",")):
+        steps.append(("dataset " + data_name, lambda data_name=data_name: [
+            dataset_loader.get_tensor_dataset(data_name, is_training) for is_training in (True, False)]))
+    steps.append(("tsne", embeddings.get_input_tsne))
+    num_networks = int(environ.get("WARM_UP_NETWORKS", 3))
+    if num_networks > 0:
+        steps.append(("networks", lambda: warm_up_networks(num_networks)))
+    return steps
+
+def create_app(environ = os.environ):
+    '''
+    Initializes the backend and returns the app: connects the storage of the environment (storage.get_storage, MONGO_URI
+    or the database container with env=prod), applies the torch settings and starts the warm-up in the background.
+    Importing this module has no side effects, the WSGI server calls this once through wsgi.py. Calling it again returns the app.
+
+    :Parameters:
+        environ: (Dictionary) Environment variables. Default os.environ.
+    '''
+    global STORAGE, DB_CONNECTION, WEIGHT_STORE, EMBEDDING_STORE, WARM_UP
+    if STORAGE is not None:
+        return app
+
+    STORAGE = storage.get_storage(environ)
+    DB_CONNECTION = STORAGE.get_collection("networks")
+    for index in ["name", "last_modified", "dataset"]:
+        DB_CONNECTION.create_index([(index, 1)])
+    # every WEIGHT_KEYFRAME_INTERVAL-th epoch is stored in full, the epochs in between as compressed difference to it
+    WEIGHT_STORE = STORAGE.get_weight_store(
+        keyframe_interval=int(environ.get("WEIGHT_KEYFRAME_INTERVAL", 10)),
+        compress=environ.get("WEIGHT_COMPRESSION", "1") == "1")
+    EMBEDDING_STORE = embeddings.EmbeddingStore(STORAGE.get_collection("embeddings"))
+
+    # torch threads, loader workers and evaluation processes from the environment
+    execution.configure_torch()
+
+    WARM_UP = warm_up.WarmUp(get_warm_up_steps(environ))
+    WARM_UP.start()
+    return app
 
 
 app = Flask(__name__)
 CORS(app)
+# times every request and its stages, the after_request handlers run in reverse order, so the compression is timed as well
+app.before_request(metrics.start_request)
+app.after_request(metrics.finish_request)
+# the after_request handlers are skipped if a view raises, the teardown still stops its profiler and records it
+app.teardown_request(metrics.teardown_request)
+# large responses are sent compressed if the browser accepts it
+app.after_request(responses.compress)
 
 @app.route("/", methods=["GET"])
 @cross_origin()
 def test():
-    create_db_connection()
     return json.dumps("OK")
 
+# Readiness probe: 200 once the warm-up finished, 503 before and while the app is not created. The body holds the state of every warm-up step.
+@app.route("/ready", methods=["GET"])
+@cross_origin()
+def ready():
+    if WARM_UP is None:
+        return json.dumps({"ready": False, "steps": {}}), 503
+    state = WARM_UP.get_state()
+    return json.dumps(state), 200 if state["ready"] else 503
+
 # Create a new network.
 @app.route("/createNetwork", methods=["POST", "OPTIONS"])
 @cross_origin()
 def createNetwork():
-    global MODEL
-    global MODEL_DICT
+    session = get_session()
     nnSettings = request.get_json()
 
     network_name = nnSettings['name']
@@ -115,129 +493,303 @@ def createNetwork():
             "activation": denseLayer["activation"]
         })
     
-    MODEL = neural_network.create_model(input_size, layers)
-    init_weights = neural_network.get_weights(MODEL)
+    model = neural_network.create_model(input_size, layers)
+    init_weights = neural_network.get_weights(model, as_tensors=True)
 
     model_dict = {
         "name": network_name,
         "epochs": 0,
         "input_dim": input_size,
-        "epoch_0": init_weights,
+        "settings": layers,
         "last_modified": datetime.datetime.utcnow().strftime("%Y/%m/%d, %H:%M:%S")
     }
 
-    item_id = DB_CONNECTION.post_item(model_dict)[0]
-    MODEL_DICT = DB_CONNECTION.get_item_by_id(str(item_id))
-    return json.dumps(MODEL_DICT)
+    item_id = str(DB_CONNECTION.post_item(model_dict)[0])
+    WEIGHT_STORE.save_epoch(item_id, 0, init_weights)
+    # insert_one adds the ObjectId to the dict, so the posted dict can be used as the actual model dict
+    model_dict["_id"] = item_id
+    MODEL_CACHE.put((item_id, -1, None), model_dict, model)
+    with session.lock:
+        session.model_dict, session.model = model_dict, model
+    return responses.serialize(model_dict)
 
 @app.route("/trainNetwork", methods=["POST", "OPTIONS"])
 @cross_origin()
 def trainNetwork():
-    global MODEL
-    global MODEL_DICT
+    session = get_session()
 
     req = request.get_json()
     trainSettings = req["setup"]
     uuid = req["id"]
-    
-    trainset = dataset_loader.get_dataset_from_torch(trainSettings["dataset"])
-    
-    #load model with id if its necessary
-    change_model(uuid)
-
-    train_history = neural_network.train_model(
-        MODEL,
-        trainSettings["epochs"],
-        trainSettings["loss"],
-        trainSettings["optimizer"],
-        trainset,
-        trainSettings["batchSize"],
-        trainSettings["learningrate"],
-        DEVICE
-    )
-
-    epoch_counter = MODEL_DICT["epochs"]
-    epoch_dict = {}
-    for ep in train_history:
-        epoch_counter += 1
-        epoch_dict["epoch_" + str(epoch_counter)] = ep
-        
-    
-    epoch_dict.update({
-        "epochs": epoch_counter,
-        "loss_function": trainSettings["loss"],
-        "dataset": trainSettings["dataset"],
-        "last_modified": datetime.datetime.utcnow().strftime("%Y/%m/%d, %H:%M:%S")
-    })
-    
-    DB_CONNECTION.update_item(uuid, epoch_dict)
-    MODEL_DICT = DB_CONNECTION.get_item_by_id(uuid)
-    return json.dumps(MODEL_DICT)
+    try:
+        execution.get_config(trainSettings.get("execution"))
+    except ValueError as e:
+        return json.dumps(str(e)), 400
+
+    model_dict, model = train_network(uuid, trainSettings)
+
+    with session.lock:
+        session.model_dict, session.model = model_dict, model
+    return responses.serialize(model_dict)
+
+# Start the training of a network in the background and return the job id.
+@app.route("/submitTraining", methods=["POST", "OPTIONS"])
+@cross_origin()
+def submitTraining():
+    req = request.get_json()
+    try:
+        execution.get_config(req["setup"].get("execution"))
+    except ValueError as e:
+        return json.dumps(str(e)), 400
+    job = training_jobs.TrainingJob(req["id"], req["setup"])
+
+    def run(job):
+        return train_network(job.network_id, job.settings, job)[0]
+
+    TRAINING_JOBS.submit(job, run)
+    return json.dumps(job.get_state())
+
+# Train networks with the same architecture together in the background, in one pass over the data per epoch.
+# The json body holds the network "ids", the shared "setup" like /submitTraining and optional "setups", one per network
+# with its own "loss", "optimizer" or "learningrate". Every network's epochs are saved like a training of its own.
+@app.route("/submitStackedTraining", methods=["POST", "OPTIONS"])
+@cross_origin()
+def submitStackedTraining():
+    req = request.get_json()
+    uuids = req["ids"]
+    networkSettings = req.get("setups") or [{} for _ in uuids]
+    if not uuids or len(set(uuids)) != len(uuids) or len(networkSettings) != len(uuids):
+        return json.dumps("Every network has to be given once and with at most one setup."), 400
+    if any(set(own) - set(stacked_training.NETWORK_SETTINGS) for own in networkSettings):
+        return json.dumps("Only " + ", ".join(stacked_training.NETWORK_SETTINGS) + " can differ between the networks."), 400
+    try:
+        execution.get_config(req["setup"].get("execution"))
+    except ValueError as e:
+        return json.dumps(str(e)), 400
+    networks = [get_network_info(uuid) for uuid in uuids]
+    if any(network["settings"] != networks[0]["settings"] or network["input_dim"] != networks[0]["input_dim"] for network in networks):
+        return json.dumps("The networks do not share an architecture."), 400
+
+    job = training_jobs.TrainingJob(uuids, req["setup"])
+
+    def run(job):
+        return train_networks(job.network_id, job.settings, networkSettings, job)
+
+    TRAINING_JOBS.submit(job, run)
+    return json.dumps(job.get_state())
+
+# Resume the unfinished training of a network in the background, e.g. after a crash, from its last stored epoch.
+@app.route("/resumeTraining", methods=["POST", "OPTIONS"])
+@cross_origin()
+def resumeTraining():
+    uuid = request.get_json()["id"]
+    training = get_network_info(uuid).get("training")
+    if training is None:
+        return json.dumps("The network has no unfinished training."), 404
+
+    # the remaining epochs are computed when the job holds the lock of the network
+    job = training_jobs.TrainingJob(uuid, training["settings"])
+
+    def run(job):
+        return train_network(job.network_id, job.settings, job, resume=True)[0]
+
+    if TRAINING_JOBS.submit(job, run, exclusive=True) is None:
+        return json.dumps("The network is still being trained."), 409
+    return json.dumps(job.get_state())
+
+# Get the state of a training job, with the network dict when it is finished.
+@app.route("/getTrainingJob", methods=["POST", "OPTIONS"])
+@cross_origin()
+def getTrainingJob():
+    job = TRAINING_JOBS.get(request.get_json()["jobId"])
+    if job is None:
+        return json.dumps("Unknown job."), 404
+
+    state = job.get_state()
+    state["network"] = job.result
+    return json.dumps(state)
+
+# Get the states of all kept training jobs.
+@app.route("/getTrainingJobs", methods=["GET"])
+@cross_origin()
+def getTrainingJobs():
+    return json.dumps(TRAINING_JOBS.get_jobs())
+
+# Stream the batch losses and epoch metrics of a training job as server-sent events.
+@app.route("/trainingEvents/<job_id>", methods=["GET"])
+@cross_origin()
+def trainingEvents(job_id):
+    job = TRAINING_JOBS.get(job_id)
+    if job is None:
+        return json.dumps("Unknown job."), 404
+
+    # X-Accel-Buffering stops nginx from buffering the stream
+    return Response(job.stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Cancel a training job after its actual batch, finished epochs stay saved.
+@app.route("/cancelTraining", methods=["POST", "OPTIONS"])
+@cross_origin()
+def cancelTraining():
+    job = TRAINING_JOBS.get(request.get_json()["jobId"])
+    if job is None:
+        return json.dumps("Unknown job."), 404
+
+    job.cancel()
+    return json.dumps(job.get_state())
 
 
 # # Load network's settings
 @app.route("/loadNetwork", methods=["POST"])
 @cross_origin()
 def loadNetwork():
-    global MODEL
-    global MODEL_DICT
     req = request.get_json()
     uuid = req["uuid"]
 
     #load model with id if its necessary
-    change_model(uuid)
+    change_model(get_session(), uuid)
+
+    return responses.serialize(get_network(uuid))
+
+# Get the network's settings without any weights.
+@app.route("/getNetworkInfo", methods=["POST", "OPTIONS"])
+@cross_origin()
+def getNetworkInfo():
+    req = request.get_json()
+
+    return json.dumps(get_network_info(req["uuid"]))
+
+# Get the weights of a single epoch or a page of epochs, optionally of a single container or layer.
+@app.route("/getEpochWeights", methods=["POST", "OPTIONS"])
+@cross_origin()
+def getEpochWeights():
+    req = request.get_json()
+    uuid = req["uuid"]
+    container = req.get("container")
+    layer = req.get("layer")
+
+    if "epoch" in req:
+        epochs = {req["epoch"]: WEIGHT_STORE.load_epoch(uuid, req["epoch"], container, layer)}
+    else:
+        epochs = WEIGHT_STORE.load_epochs(uuid, req.get("start", 0), req.get("limit", 1), container, layer)
 
-    return json.dumps(MODEL_DICT)
+    result = {}
+    for epoch, weights in epochs.items():
+        if weights is not None:
+            result["epoch_" + str(epoch)] = weight_store.to_lists(weights)
+    return responses.serialize(result)
+
+# Stream the weight history of one layer over a range of epochs as binary frames (weight_history.encode_frame).
+# The json body holds uuid, container, layer and optional tensor ("weights" or "bias"), start, end, step,
+# mode (weight_history.MODES), encoding (responses.ENCODINGS), units and bins. Only one epoch is in memory at a time.
+@app.route("/getWeightHistory", methods=["POST", "OPTIONS"])
+@cross_origin()
+def getWeightHistory():
+    req = request.get_json()
+    mode = req.get("mode", "values")
+    encoding = req.get("encoding", "float32")
+    if mode not in weight_history.MODES or encoding not in responses.ENCODINGS:
+        return json.dumps("Unknown mode or encoding."), 400
 
-# Get list of saved networks.
+    epochs = WEIGHT_STORE.iter_epochs(
+        req["uuid"],
+        req.get("start", 0),
+        req.get("end"),
+        max(1, int(req.get("step", 1))),
+        req["container"],
+        req["layer"])
+    frames = weight_history.stream_frames(
+        epochs,
+        req["container"],
+        req["layer"],
+        req.get("tensor", "weights"),
+        mode,
+        encoding,
+        req.get("units"),
+        req.get("bins", 32))
+    return Response(frames, mimetype="application/octet-stream", headers={"X-Accel-Buffering": "no"})
+
+# Get the number of stored epochs and keyframes of a network and the compression ratio of its weights.
+@app.route("/getStorageStats", methods=["POST", "OPTIONS"])
+@cross_origin()
+def getStorageStats():
+    req = request.get_json()
+    return json.dumps(WEIGHT_STORE.get_storage_stats(req["uuid"]))
+
+# Get list of saved networks. With ?limit= only a page is returned as {"networks": [...], "next": uuid or null},
+# the next page is requested with ?after=<next>.
 @app.route("/getSavedNetworks", methods=["GET", "OPTIONS"])
 @cross_origin()
 def getSavedNetworks():
-    item = DB_CONNECTION.get_all_attributes(["id", "name"])
-    
-    return json.dumps(item)
+    if "limit" not in request.args:
+        item = DB_CONNECTION.get_all_attributes(["id", "name"])
+        return json.dumps(item)
+
+    networks, next_id = DB_CONNECTION.get_page(["name"], after=request.args.get("after"), limit=int(request.args["limit"]))
+    return json.dumps({"networks": networks, "next": next_id})
 
-# Test trained network.
+# Get the number of calls and the time spent in every database operation.
+@app.route("/getDatabaseStats", methods=["GET"])
+@cross_origin()
+def getDatabaseStats():
+    return json.dumps(mongo.get_stats())
+
+# Test trained network. An optional "inference" mode (inference.MODES) is reported against the float32 model,
+# optional "execution" settings (execution.get_config) choose the torch threads or the number of evaluation processes.
 @app.route("/testNetwork", methods=["POST", "OPTIONS"])
 @cross_origin()
 def testNetwork():
-    global MODEL
-    global MODEL_DICT
-    global ABLATED_MODEL 
-    global TEST_ABLATED_MODEL 
+    session = get_session()
     
     req = request.get_json()
     uuid = req["networkID"]
+    # an optimized inference mode is tested against the float32 model
+    mode = req.get("inference", "float32")
+    if mode not in inference.MODES:
+        return json.dumps("Unknown inference mode: " + str(mode)), 400
+    try:
+        config = execution.get_config(req.get("execution"))
+    except ValueError as e:
+        return json.dumps(str(e)), 400
 
     #load model with id if its necessary
-    change_model(uuid)
+    change_model(session, uuid)
 
-    nn_model = MODEL
-
-    if TEST_ABLATED_MODEL:
-        nn_model = ABLATED_MODEL
+    with session.lock:
+        nn_model = session.get_test_model()
+        model_dict = session.model_dict
     
-    testset = dataset_loader.get_dataset_from_torch(MODEL_DICT["dataset"], False) #False because we want to use the testdataset
+    testset = dataset_loader.get_tensor_dataset(model_dict["dataset"], False) #False because we want to use the testdataset
     labels = dataset_loader.get_dataset_classes(testset)
-    test_results = neural_network.test_model(nn_model, MODEL_DICT["loss_function"], testset, 64, DEVICE) 
+
+    report = None
+    if mode == "float32" and config["processes"] > 1:
+        with metrics.stage("test"):
+            test_results = EVALUATOR.test(nn_model, model_dict["loss_function"], model_dict["dataset"], 1000, config["processes"])
+    elif mode == "float32":
+        with execution.torch_threads(config):
+            test_results = neural_network.test_model(nn_model, model_dict["loss_function"], testset, 64, DEVICE, config)
+    else:
+        _, optimized = get_model(uuid, mode=mode)
+        with session.lock:
+            optimized = session.get_test_model(optimized)
+        test_results, report = inference.compare(nn_model, optimized, model_dict["loss_function"], testset, 1000, DEVICE)
+        report["mode"] = mode
 
     results = {
         "labels": ["all"] + labels,
         "accuracy": test_results[0],
-        "correct_labels": test_results[1].tolist(),
-        "accuracy_class": test_results[2].tolist(),
-        "class_labels": test_results[3].tolist() }
+        "correct_labels": test_results[1],
+        "accuracy_class": test_results[2],
+        "class_labels": test_results[3],
+        "inference": report }
 
-    return json.dumps(results)
+    return responses.serialize(results)
 
 # Ablates layers from a network
 @app.route("/ablateNetwork", methods=["POST", "OPTIONS"])
 @cross_origin()
 def ablateNetwork():
-    global MODEL
-    global MODEL_DICT
-    global ABLATED_MODEL 
-    global TEST_ABLATED_MODEL 
+    session = get_session()
     
     req = request.get_json()
 
@@ -246,36 +798,182 @@ def ablateNetwork():
     
     print(nodes)
     #load model with id if its necessary
-    change_model(uuid)
-    ABLATED_MODEL = neural_network.load_model_from_weights(MODEL_DICT, MODEL_DICT["input_dim"])
-
-    for node in nodes:
-        layer_number = "layer_" + str(node['layerNumber'])
-        container = node["containerName"]
-        layer_name = MODEL_DICT["epoch_0"][container][layer_number]["settings"]["type"] + str(node['layerNumber'])
-        layer_key = container + "." + layer_name
-        # the key in the model.state_dict ist container.layer.weight/bias
-        for unit in node['ablatedWeights']:
-            ablation.ablate_unit(ABLATED_MODEL, layer_key, unit)
-    
-    TEST_ABLATED_MODEL = True
+    change_model(session, uuid)
+
+    with session.lock:
+        # validates the nodes, the masks are applied to the cached model when it is used
+        ablation.build_masks(session.model, [nodes])
+        session.ablation_nodes = nodes
 
     return json.dumps("OK")
 
+# Evaluates a list of ablations on the test set in one request and returns their accuracies.
+# Optional "execution" settings (execution.get_config) choose the torch threads or the number of evaluation processes.
+@app.route("/ablationSweep", methods=["POST", "OPTIONS"])
+@cross_origin()
+def ablationSweep():
+    req = request.get_json()
+    uuid = req["networkID"]
+
+    mode = req.get("inference", "float32")
+    if mode not in inference.MODES:
+        return json.dumps("Unknown inference mode: " + str(mode)), 400
+    try:
+        config = execution.get_config(req.get("execution"))
+    except ValueError as e:
+        return json.dumps(str(e)), 400
+    model_dict, model = get_model(uuid, mode=mode)
+    testset = dataset_loader.get_tensor_dataset(model_dict["dataset"], False)
+
+    ablations = ablation.expand_mask_specs(model, req["masks"])
+    # the first row is the network without ablation
+    start = time.perf_counter()
+    if config["processes"] > 1:
+        with metrics.stage("ablation"):
+            accuracy, accuracy_class = EVALUATOR.sweep(
+                model,
+                [[]] + ablations,
+                model_dict["dataset"],
+                req.get("batchSize", 1000),
+                req.get("maxSamples", 20000),
+                config["processes"])
+    else:
+        with execution.torch_threads(config):
+            accuracy, accuracy_class = ablation.sweep(
+                model,
+                [[]] + ablations,
+                testset,
+                req.get("batchSize", 1000),
+                req.get("maxSamples", 20000))
+    seconds = time.perf_counter() - start
+
+    # an optimized inference mode reports its baseline against the float32 model
+    report = None
+    if mode != "float32":
+        _, reference = get_model(uuid)
+        reference_accuracy, _ = ablation.sweep(reference, [[]], testset, req.get("batchSize", 1000))
+        report = {
+            "mode": mode,
+            "referenceBaselineAccuracy": float(reference_accuracy[0]),
+            "baselineAccuracyDelta": float(accuracy[0] - reference_accuracy[0]),
+            "seconds": seconds
+        }
+
+    results = {
+        "labels": testset.classes,
+        "ablations": ablations,
+        "baseline_accuracy": float(accuracy[0]),
+        "baseline_accuracy_class": accuracy_class[0],
+        "accuracy": accuracy[1:],
+        "accuracy_class": accuracy_class[1:],
+        "inference": report }
+
+    return responses.serialize(results)
+
 # Ablates layers from a network
 @app.route("/resetAblation", methods=["POST", "OPTIONS"])
 @cross_origin()
 def resetAblation():
-    global TEST_ABLATED_MODEL
-    TEST_ABLATED_MODEL = False
+    session = get_session()
+    with session.lock:
+        session.ablation_nodes = []
     return json.dumps("OK")
 
-# Get TSNE Coordinate
-@app.route("/getTSNECoordinate", methods=["GET"])
+def get_embedding_request_key(req, model_dict):
+    '''
+    Returns the key of the embedding a request asks for. The epoch defaults to the latest one.
+
+    :Parameters:
+        req: (Dictionary) Request with networkID, container, layer and optional epoch, method and samples.
+        model_dict: (Dictionary) Network document without weights.
+    '''
+    epoch = req.get("epoch", -1)
+    return embeddings.get_embedding_key(
+        req["networkID"],
+        model_dict["epochs"] if epoch == -1 else epoch,
+        req["container"],
+        req["layer"],
+        req.get("method", "tsne"),
+        req.get("samples", 10000))
+
+# Compute the 2-D embedding of a layer's activations on the test set in the background.
+# A request for an embedding that is already being computed gets the state of the running job.
+@app.route("/computeEmbedding", methods=["POST", "OPTIONS"])
+@cross_origin()
+def computeEmbedding():
+    req = request.get_json()
+    key = get_embedding_request_key(req, get_network_info(req["networkID"]))
+
+    if EMBEDDING_STORE.get(key) is not None:
+        return json.dumps({"status": "finished", "key": key})
+
+    def run(job):
+        model_dict, model = get_model(key["network_id"], key["epoch"])
+        testset = dataset_loader.get_tensor_dataset(model_dict["dataset"], False)
+        features = embeddings.get_activations(model, testset.data[:key["samples"]], key["container"], key["layer"], job=job)
+        job.publish("activations", {"shape": list(features.shape)})
+        EMBEDDING_STORE.save(key, embeddings.embed(features, key["method"]))
+        return key
+
+    job = EMBEDDING_JOBS.submit(training_jobs.Job(key["network_id"], key), run, deduplicate=True)
+    state = job.get_state()
+    state["key"] = key
+    return json.dumps(state)
+
+# Get the state of an embedding job.
+@app.route("/getEmbeddingJob", methods=["POST", "OPTIONS"])
 @cross_origin()
+def getEmbeddingJob():
+    job = EMBEDDING_JOBS.get(request.get_json()["jobId"])
+    if job is None:
+        return json.dumps("Unknown job."), 404
+
+    state = job.get_state()
+    state["key"] = job.settings
+    return json.dumps(state)
+
+# Get a computed embedding as json or with ?format=float32/int16 as binary array.
+@app.route("/getEmbedding", methods=["POST", "OPTIONS"])
+@cross_origin(expose_headers=responses.ARRAY_HEADERS + ["ETag"])
+def getEmbedding():
+    req = request.get_json()
+    key = get_embedding_request_key(req, get_network_info(req["networkID"]))
+    coordinates = EMBEDDING_STORE.get(key)
+    if coordinates is None:
+        return json.dumps("Embedding is not computed yet."), 404
+
+    encoding = responses.get_requested_encoding()
+    if encoding is None:
+        response = responses.serialize(coordinates)
+    else:
+        response = responses.array_response(coordinates, encoding)
+    etag = "-".join(str(key[k]) for k in sorted(key)) + "-" + (encoding or "json")
+    return responses.cacheable(response, etag)
+
+# Get the counters of the model cache.
+@app.route("/getModelCacheStats", methods=["GET"])
+@cross_origin()
+def getModelCacheStats():
+    return json.dumps(MODEL_CACHE.get_stats())
+
+# Metrics of the process in the Prometheus text format: request and stage durations, training throughput,
+# model cache and database counters.
+@app.route("/metrics", methods=["GET"])
+def getMetrics():
+    return Response(metrics.render(MODEL_CACHE.get_stats(), mongo.get_stats()), mimetype="text/plain; version=0.0.4")
+
+# Get TSNE Coordinate, as json or with ?format=float32/int16 as binary array.
+@app.route("/getTSNECoordinate", methods=["GET"])
+@cross_origin(expose_headers=responses.ARRAY_HEADERS + ["ETag"])
 def getTSNECoordinate():
-    result = pickle.load(open("../data/tSNE/X_tSNE_10000.p", "rb"))
-    return json.dumps(result.tolist())
+    tsne = embeddings.get_input_tsne()
+    encoding = responses.get_requested_encoding()
+
+    if encoding is None:
+        response = Response(tsne["json"], mimetype="application/json")
+    else:
+        response = responses.array_response(tsne["coordinates"], encoding)
+    return responses.cacheable(response, tsne["etag"] + "-" + (encoding or "json"))
 
 # Save the free-drawing drawing.
 @app.route("/saveDigit", methods=["POST", "OPTIONS"])
@@ -293,29 +991,83 @@ def saveDigit():
     return json.dumps("Digit saved.")
 
 # Save the free-drawing drawing.
+# Test the saved digit. The optional json body selects the captured activations:
+# {"layers": ["features.layer_0"], "channels": {"features.layer_0": [0, 2]}, "tap": "layer" or "activation",
+#  "downsample": 2, "encoding": "json", "float32", "int16" or "uint8", "inference": one of inference.MODES}. Without a body every layer output is returned as lists.
 @app.route("/testDigit", methods=["POST", "OPTIONS"])
 @cross_origin()
 def testDigit():
-    digit = cv2.imread("../data/digit/digit.png", cv2.IMREAD_GRAYSCALE)
-    digit = cv2.resize(digit, (28, 28))
+    options = request.get_json(silent=True) or {}
+    digit = image_input.read_image(os.path.join(DIGIT_DIR, "digit.png"))
+    digit = image_input.to_input_batch([digit])
 
-    digit = digit / 255.0
-    digit[digit == 0] = -1
-    digit = torch.from_numpy(digit).float()
-    digit = digit.view(-1, 1, 28, 28)
+    session = get_session()
+    mode = options.get("inference", "float32")
+    if mode not in inference.MODES:
+        return json.dumps("Unknown inference mode: " + str(mode)), 400
+    if mode == "float32":
+        with session.lock:
+            model = session.get_test_model()
+    else:
+        with session.lock:
+            uuid = session.model_dict["_id"]
+        _, optimized = get_model(uuid, mode=mode)
+        with session.lock:
+            model = session.get_test_model(optimized)
 
-    model = MODEL
+    try:
+        with metrics.stage("forward"):
+            net_out, captured = activations.capture(model, digit, options.get("layers"), options.get("channels"), options.get("tap", "layer"))
+        feature_dict = activations.encode(captured, options.get("encoding", "json"), int(options.get("downsample", 1)))
+    except (KeyError, IndexError, ValueError) as e:
+        return json.dumps(str(e)), 400
+    result = {
+        "netOut": net_out,
+        "nodesDict": feature_dict
+    }
+    return responses.serialize(result)
 
-    if TEST_ABLATED_MODEL:
-        model = ABLATED_MODEL
+# Predict a batch of images in one stateless request with the network given by ?networkID=. The body is either multipart
+# with one or more image files, a single encoded image, or raw uint8 pixels (application/octet-stream) with an X-Shape
+# header "N,height,width". ?inference= selects an optimized inference mode (inference.MODES).
+@app.route("/predict", methods=["POST", "OPTIONS"])
+@cross_origin()
+def predict():
+    start = time.perf_counter()
+
+    network_id = request.args.get("networkID")
+    if not network_id:
+        return json.dumps("The networkID parameter is missing."), 400
+    mode = request.args.get("inference", "float32")
+    if mode not in inference.MODES:
+        return json.dumps("Unknown inference mode: " + str(mode)), 400
+    model_dict, model = get_model(network_id, mode=mode)
+
+    try:
+        if request.files:
+            images = [image_input.decode_image(f.read()) for name in request.files for f in request.files.getlist(name)]
+        elif request.mimetype == "application/octet-stream" and "X-Shape" in request.headers:
+            shape = [int(dim) for dim in request.headers["X-Shape"].split(",")]
+            images = image_input.decode_uint8_tensor(request.get_data(), shape)
+        else:
+            images = [image_input.decode_image(request.get_data())]
+    except ValueError as e:
+        return json.dumps(str(e)), 400
+
+    input_dim = model_dict.get("input_dim", [28, 28, 1])
+    batch = image_input.to_input_batch(images, input_dim[0], input_dim[1])
+    with neural_network.inference_mode(), metrics.stage("forward"):
+        net_out = model(batch)
+    seconds = time.perf_counter() - start
 
-    prediction = model.predict(digit)
-    feature_dict = model.visualize_input(digit)
     result = {
-        "netOut": prediction,
-        "nodesDict": feature_dict
+        "predictions": net_out.argmax(1),
+        "netOut": net_out,
+        "count": len(batch),
+        "seconds": seconds,
+        "imagesPerSecond": len(batch) / seconds
     }
-    return json.dumps(result)
+    return responses.serialize(result)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", debug=True, port=3000)
+    create_app().run(host="0.0.0.0", debug=True, port=3000, threaded=True)
@@ -0,0 +1,351 @@
+import bisect
+import collections
+import contextlib
+import cProfile
+import datetime
+import functools
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+
+# upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.)
+
+# adds the stages of every request as Server-Timing header, a single request can ask for it with ?timing=1
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+# allows profiling a single request with ?profile=cprofile or ?profile=torch, the traces are written to PROFILE_DIR
+PROFILING = os.environ.get("PROFILING", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "../data/profiles")
+PROFILERS = ["cprofile", "torch"]
+
+# response header with the file name of the profile of a request
+PROFILE_HEADER = "X-Profile"
+
+
+class Histogram:
+    """
+    Counts observed values in buckets like a Prometheus histogram.
+
+    :Parameters:
+        buckets: (tuple) Sorted upper bounds of the buckets. Default is BUCKETS.
+
+    :Attributes:
+        buckets: (tuple) upper bounds of the buckets.
+        counts: ([Integer]) number of values per bucket, the last one counts the values above every bound.
+        sum: (float) sum of the values.
+        count: (Integer) number of values.
+    """
+    def __init__(self, buckets = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Adds a value.
+
+        :Parameters:
+            value: (float) Observed value.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    Thread-safe histograms, counters and gauges of the process. Every metric has a name, a help text and a series per label set.
+
+    :Attributes:
+        __lock: (threading.Lock) guards the metrics.
+        __metrics: (collections.OrderedDict) name -> {"type", "help", "series": {labels: Histogram or float}}
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__metrics = collections.OrderedDict()
+
+    def observe(self, name, value, labels = {}, help_text = ""):
+        """
+        Adds a value to a histogram.
+
+        :Parameters:
+            name: (string) Name of the histogram.
+            value: (float) Observed value.
+            labels: (Dictionary) Label names and values of the series. Default no labels.
+            help_text: (string) Description of the metric. Default empty.
+        """
+        with self.__lock:
+            series = self.__get_series(name, "histogram", help_text)
+            key = tuple(sorted(labels.items()))
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def increment(self, name, amount = 1, labels = {}, help_text = ""):
+        """
+        Increments a counter.
+
+        :Parameters:
+            name: (string) Name of the counter.
+            amount: (float) Increment. Default is 1.
+            labels: (Dictionary) Label names and values of the series. Default no labels.
+            help_text: (string) Description of the metric. Default empty.
+        """
+        with self.__lock:
+            series = self.__get_series(name, "counter", help_text)
+            key = tuple(sorted(labels.items()))
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, value, labels = {}, help_text = ""):
+        """
+        Sets a gauge.
+
+        :Parameters:
+            name: (string) Name of the gauge.
+            value: (float) Actual value.
+            labels: (Dictionary) Label names and values of the series. Default no labels.
+            help_text: (string) Description of the metric. Default empty.
+        """
+        with self.__lock:
+            self.__get_series(name, "gauge", help_text)[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        """Returns every metric in the Prometheus text format."""
+        lines = []
+        with self.__lock:
+            for name, metric in self.__metrics.items():
+                lines += ["# HELP {} {}".format(name, metric["help"]), "# TYPE {} {}".format(name, metric["type"])]
+                for key, value in metric["series"].items():
+                    if metric["type"] != "histogram":
+                        lines.append(format_sample(name, key, value))
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + ("+Inf",), value.counts):
+                        cumulative += count
+                        lines.append(format_sample(name + "_bucket", key + (("le", str(bound)),), cumulative))
+                    lines.append(format_sample(name + "_sum", key, value.sum))
+                    lines.append(format_sample(name + "_count", key, value.count))
+        return lines
+
+    def __get_series(self, name, metric_type, help_text):
+        """
+        Private Method: Returns the series of a metric and creates the metric on first use. The lock has to be held.
+
+        :Parameters:
+            name: (string) Name of the metric.
+            metric_type: (string) "histogram", "counter" or "gauge".
+            help_text: (string) Description of the metric.
+        """
+        if name not in self.__metrics:
+            self.__metrics[name] = {"type": metric_type, "help": help_text, "series": collections.OrderedDict()}
+        return self.__metrics[name]["series"]
+
+
+REGISTRY = Registry()
+
+
+def format_sample(name, labels, value):
+    """
+    Returns a sample line of the Prometheus text format.
+
+    :Parameters:
+        name: (string) Name of the sample.
+        labels: (tuple) (label name, label value) pairs.
+        value: (float) Value of the sample.
+    """
+    if not labels:
+        return "{} {}".format(name, value)
+    label_text = ",".join('{}="{}"'.format(key, str(item).replace("\\", "\\\\").replace('"', '\\"')) for key, item in labels)
+    return "{}{{{}}} {}".format(name, label_text, value)
+
+def get_endpoint():
+    """Returns the route of the actual request, e.g. "/trainingEvents/<job_id>", or "background" outside of a request."""
+    if not has_request_context():
+        return "background"
+    return request.url_rule.rule if request.url_rule is not None else "unknown"
+
+def add_stage(name, seconds):
+    """
+    Records the duration of a stage in the stage histogram and in the Server-Timing stages of the actual request.
+
+    :Parameters:
+        name: (string) Name of the stage, e.g. "db".
+        seconds: (float) Duration of the stage.
+    """
+    REGISTRY.observe("backend_stage_seconds", seconds, {"stage": name, "endpoint": get_endpoint()}, "Duration of the stages of the requests.")
+    if has_request_context() and "stages" in g:
+        g.stages[name] = g.stages.get(name, 0.) + seconds
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Context manager that records the duration of its block as a stage.
+
+    :Parameters:
+        name: (string) Name of the stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - start)
+
+def timed_stage(name):
+    """
+    Decorator that records the duration of every call of a function as a stage.
+
+    :Parameters:
+        name: (string) Name of the stage.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_training(samples, seconds):
+    """
+    Records the throughput of a training epoch.
+
+    :Parameters:
+        samples: (Integer) Number of trained samples.
+        seconds: (float) Duration of the epoch.
+    """
+    REGISTRY.increment("backend_training_samples_total", samples, help_text="Number of trained samples.")
+    REGISTRY.increment("backend_training_seconds_total", seconds, help_text="Seconds spent in training epochs.")
+    REGISTRY.set("backend_training_samples_per_second", samples / max(seconds, 1e-9), help_text="Throughput of the last training epoch.")
+
+def get_server_timing(stages, total):
+    """
+    Returns the value of a Server-Timing header with the duration of every stage and of the whole request in milliseconds.
+
+    :Parameters:
+        stages: (collections.OrderedDict) Name of the stage -> seconds.
+        total: (float) Duration of the request in seconds.
+    """
+    entries = ["{};dur={:.2f}".format(name, seconds * 1000) for name, seconds in stages.items()]
+    return ", ".join(entries + ["total;dur={:.2f}".format(total * 1000)])
+
+def start_request():
+    """
+    Starts the timing of a request and, if PROFILING is enabled and the request asks for it with ?profile=, its profiler.
+    Registered as before_request handler of the app.
+    """
+    g.request_start = time.perf_counter()
+    g.stages = collections.OrderedDict()
+    kind = request.args.get("profile") if PROFILING else None
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        g.profiler = (kind, profiler)
+    elif kind == "torch":
+        # torch is only imported if a request is profiled with it
+        import torch
+        profiler = torch.autograd.profiler.profile()
+        profiler.__enter__()
+        g.profiler = (kind, profiler)
+
+def finish_request(response):
+    """
+    Records the duration of a request in the request histogram, stops its profiler and adds the Server-Timing header.
+    Registered as after_request handler of the app.
+
+    :Parameters:
+        response: (flask.Response) Response of the request.
+    """
+    if "request_start" not in g:
+        return response
+    seconds = observe_request(response.status_code)
+
+    if "profiler" in g:
+        response.headers[PROFILE_HEADER] = save_profile(*g.pop("profiler"))
+    if SERVER_TIMING or request.args.get("timing") == "1":
+        response.headers["Server-Timing"] = get_server_timing(g.stages, seconds)
+        # the frontend runs on another origin, the browser only shows it the timing with this header
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+def teardown_request(exception = None):
+    """
+    Records a request and stops its profiler if finish_request did not run, because the view raised an exception.
+    Registered as teardown_request handler of the app.
+
+    :Parameters:
+        exception: (Exception) Exception of the request. Default None.
+    """
+    if "request_start" in g:
+        observe_request(500)
+    if "profiler" in g:
+        save_profile(*g.pop("profiler"))
+
+def observe_request(status_code):
+    """
+    Records the duration of the actual request in the request histogram and returns it.
+    The start is removed from the request context, so every request is recorded once.
+
+    :Parameters:
+        status_code: (Integer) Status code of the response.
+    """
+    seconds = time.perf_counter() - g.pop("request_start")
+    REGISTRY.observe("backend_request_seconds", seconds,
+                     {"endpoint": get_endpoint(), "method": request.method, "status": str(status_code)},
+                     "Duration of the requests.")
+    return seconds
+
+def save_profile(kind, profiler):
+    """
+    Stops a profiler and writes its trace to PROFILE_DIR: cProfile stats (.prof) or a chrome trace of the torch profiler (.json).
+    Returns the file name.
+
+    :Parameters:
+        kind: (string) One of PROFILERS.
+        profiler: The running cProfile.Profile or torch.autograd.profiler.profile.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = "{}_{}".format(get_endpoint().strip("/").replace("/", "_").replace("<", "").replace(">", ""),
+                          datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f"))
+    if kind == "cprofile":
+        profiler.disable()
+        filename = name + ".prof"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+    else:
+        profiler.__exit__(None, None, None)
+        filename = name + ".json"
+        profiler.export_chrome_trace(os.path.join(PROFILE_DIR, filename))
+    return filename
+
+def render(cache_stats, db_stats):
+    """
+    Returns the metrics of the process in the Prometheus text format, with the model cache and database statistics added.
+
+    :Parameters:
+        cache_stats: (Dictionary) Statistics like model_cache.ModelCache.get_stats returns them.
+        db_stats: (Dictionary) Statistics like mongo_module.get_stats returns them.
+    """
+    lines = REGISTRY.render()
+    for key, metric_type, help_text in [
+        ("models", "gauge", "Number of cached models."),
+        ("size", "gauge", "Bytes of the cached models."),
+        ("max_size", "gauge", "Maximal bytes of the cached models."),
+        ("hits", "counter", "Model cache hits."),
+        ("misses", "counter", "Model cache misses."),
+        ("evictions", "counter", "Evicted models.")
+    ]:
+        name = "backend_model_cache_" + key + ("_total" if metric_type == "counter" else "")
+        lines += ["# HELP {} {}".format(name, help_text), "# TYPE {} {}".format(name, metric_type), format_sample(name, (), cache_stats[key])]
+
+    for key, help_text in [("count", "Number of database operations."), ("seconds", "Seconds spent in database operations.")]:
+        name = "backend_db_operations_total" if key == "count" else "backend_db_seconds_total"
+        lines += ["# HELP {} {}".format(name, help_text), "# TYPE {} counter".format(name)]
+        lines += [format_sample(name, (("operation", operation),), stats[key]) for operation, stats in sorted(db_stats.items())]
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    pass
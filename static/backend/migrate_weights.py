@@ -0,0 +1,50 @@
+import argparse
+
+import mongo_module as mongo
+
+import weight_store
+
+
+def get_list_epochs(network):
+    """
+    Returns the sorted epoch numbers that are still stored as lists in a network document.
+
+    :Parameters:
+        network: (Dictionary) Network document from the database.
+    """
+    return sorted(int(key[len("epoch_"):]) for key in network if key.startswith("epoch_"))
+
+def migrate(db_connection, store):
+    """
+    Moves every list encoded epoch of every network document into the weight store and removes it from the document.
+    Returns the number of migrated epochs.
+
+    :Parameters:
+        db_connection: (mongo_module.Mongo) Connection to the networks collection.
+        store: (weight_store.WeightStore) Store the epochs are moved to.
+    """
+    migrated = 0
+    # only the ids are fetched at once, every document is loaded and migrated on its own
+    for item in db_connection.get_all_attributes(["_id"]):
+        network = db_connection.get_item_by_id(item["_id"])
+        epochs = get_list_epochs(network)
+        store.save_epochs(network["_id"], {epoch: network["epoch_" + str(epoch)] for epoch in epochs})
+        if epochs:
+            db_connection.unset_attributes(network["_id"], ["epoch_" + str(epoch) for epoch in epochs])
+            print("Migrated {} epochs of network {} ({})".format(len(epochs), network["_id"], network.get("name")))
+        migrated += len(epochs)
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Moves list encoded epoch weights into the binary weight store.")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/", help="URI of the MongoDB.")
+    parser.add_argument("--db", default="networkDB", help="Name of the database.")
+    parser.add_argument("--dtype", default="float32", choices=sorted(weight_store.DTYPES), help="Type the weights are stored with.")
+    parser.add_argument("--keyframes", default=10, type=int, help="Number of epochs from one keyframe to the next, 0 stores every epoch in full.")
+    parser.add_argument("--no-compress", action="store_true", help="Stores the keyframes uncompressed.")
+    args = parser.parse_args()
+
+    networks = mongo.Mongo(args.uri, args.db, "networks")
+    store = weight_store.WeightStore(mongo.Mongo(args.uri, args.db, "weights"), args.dtype, args.keyframes, not args.no_compress)
+    print("Migrated {} epochs.".format(migrate(networks, store)))
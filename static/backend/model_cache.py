@@ -0,0 +1,170 @@
+import collections
+import threading
+
+import torch
+
+
+def get_model_size(model):
+    """
+    Returns the number of bytes the parameters and buffers of a model use, including packed weights of quantized layers.
+
+    :Parameters:
+        model: (nn.Module) Model whose size should be computed.
+    """
+    size = 0
+    for value in model.state_dict().values():
+        for tensor in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(tensor, torch.Tensor):
+                size += tensor.numel() * tensor.element_size()
+    return size
+
+
+class ModelCache:
+    """
+    Least recently used cache of loaded models, bounded by the memory footprint of the cached models.
+    Entries are keyed by (network id, epoch, variant), epoch -1 stands for the latest epoch and variant None for the plain model.
+
+    :Parameters:
+        max_bytes: (Integer) Maximal number of bytes the cached models may use.
+
+    :Attributes:
+        __entries: (collections.OrderedDict) key -> (network dict, model, size), least recently used first.
+        __lock: (threading.RLock) guards the entries and the counters.
+        __loading: (Dictionary) key -> threading.Lock, so that concurrent requests load a model only once.
+        __generations: (Dictionary) network id -> number of invalidations, a model loaded before an invalidation is not stored.
+        max_bytes: (Integer) maximal number of bytes the cached models may use.
+        size: (Integer) number of bytes the cached models use.
+        hits: (Integer) number of lookups that found a model.
+        misses: (Integer) number of lookups that had to load a model.
+        evictions: (Integer) number of models that were removed to free memory.
+    """
+    def __init__(self, max_bytes):
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.RLock()
+        self.__loading = {}
+        self.__generations = {}
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns the cached (network dict, model) tuple for the key or None.
+
+        :Parameters:
+            key: (tuple) (network id, epoch, variant)
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def put(self, key, network_dict, model, generation = None):
+        """
+        Adds a model to the cache and evicts the least recently used models until it fits.
+        Models that are bigger than the whole cache are not stored.
+
+        :Parameters:
+            key: (tuple) (network id, epoch, variant)
+            network_dict: (Dictionary) Network document without weights.
+            model: (Sequential_Net) The loaded model.
+            generation: (Integer) Generation of the network the model was loaded in, like get_generation returned it.
+                The model is not stored if the network was invalidated since. Default None always stores it.
+        """
+        size = get_model_size(model)
+        with self.__lock:
+            if generation is not None and generation != self.get_generation(key[0]):
+                return
+            self.__remove(key)
+            if size > self.max_bytes:
+                return
+            while self.__entries and self.size + size > self.max_bytes:
+                self.__remove(next(iter(self.__entries)))
+                self.evictions += 1
+            self.__entries[key] = (network_dict, model, size)
+            self.size += size
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached (network dict, model) tuple for the key or loads and caches it.
+        Concurrent calls with the same key wait for the first one instead of loading the model again.
+
+        :Parameters:
+            key: (tuple) (network id, epoch, variant)
+            loader: (function) Function without arguments that returns a (network dict, model) tuple.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+
+        with self.__lock:
+            key_lock = self.__loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.__lock:
+                entry = self.__entries.get(key)
+            if entry is not None:
+                return entry[0], entry[1]
+            # a model that is invalidated while it is loaded, e.g. by a finished training, would be stale
+            generation = self.get_generation(key[0])
+            try:
+                entry = loader()
+                self.put(key, entry[0], entry[1], generation)
+            finally:
+                with self.__lock:
+                    self.__loading.pop(key, None)
+        return entry
+
+    def invalidate(self, network_id):
+        """
+        Removes all models of a network from the cache, e.g. after it was trained.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+        """
+        with self.__lock:
+            self.__generations[network_id] = self.get_generation(network_id) + 1
+            for key in [key for key in self.__entries if key[0] == network_id]:
+                self.__remove(key)
+
+    def get_generation(self, network_id):
+        """
+        Returns the number of times the models of a network were invalidated.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+        """
+        with self.__lock:
+            return self.__generations.get(network_id, 0)
+
+    def get_stats(self):
+        """Returns a dictionary with the counters and the memory usage of the cache."""
+        with self.__lock:
+            return {
+                "models": len(self.__entries),
+                "size": self.size,
+                "max_size": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def __remove(self, key):
+        """
+        Private Method: Removes an entry without touching the counters.
+
+        :Parameters:
+            key: (tuple) (network id, epoch, variant)
+        """
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+
+if __name__ == "__main__":
+    pass
@@ -1,47 +1,145 @@
+import functools
+import os
+import threading
+import time
+
 import pymongo as mongo
 from bson.objectid import ObjectId
 
+import metrics
+
+
+# one pooled client per URI, shared by every collection of the process
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+
+# number of calls and seconds of every operation, e.g. "networks.get_item_by_id" -> {"count": 3, "seconds": 0.012}
+STATS = {}
+STATS_LOCK = threading.Lock()
+# marks the threads that are inside a timed method, the methods they call are not timed again
+TIMING = threading.local()
+
+
+def get_uri(environ = os.environ):
+    """
+    Returns the URI of the database: MONGO_URI if it is set, the database container in production (env=prod), otherwise localhost.
+
+    :Parameters:
+        environ: (Dictionary) Environment variables. Default os.environ.
+    """
+    if environ.get("MONGO_URI"):
+        return environ["MONGO_URI"]
+    if environ.get("env") == "prod":
+        return "mongodb://database:27017/"
+    return "mongodb://localhost:27017/"
+
+def get_client(uri):
+    """
+    Returns the client of a URI and creates it on first use. The client holds a connection pool of MONGO_POOL_SIZE connections.
+    "mongomock://" returns an in-memory mongomock client for tests and benchmarks without a database server.
+
+    :Parameters:
+        uri: (String) URI of the MongoDB.
+    """
+    with CLIENTS_LOCK:
+        if uri not in CLIENTS:
+            if uri.startswith("mongomock://"):
+                # mongomock is only needed without a database server
+                import mongomock
+                CLIENTS[uri] = mongomock.MongoClient()
+            else:
+                CLIENTS[uri] = mongo.MongoClient(uri, maxPoolSize=int(os.environ.get("MONGO_POOL_SIZE", 100)))
+        return CLIENTS[uri]
+
+def record(operation, seconds):
+    """
+    Adds a call of an operation to the statistics and its duration to the "db" stage of the actual request.
+
+    :Parameters:
+        operation: (String) Name of the operation.
+        seconds: (Float) Duration of the call.
+    """
+    with STATS_LOCK:
+        stats = STATS.setdefault(operation, {"count": 0, "seconds": 0.})
+        stats["count"] += 1
+        stats["seconds"] += seconds
+    metrics.add_stage("db", seconds)
+
+def get_stats():
+    """Returns a copy of the statistics of every operation."""
+    with STATS_LOCK:
+        return {operation: dict(stats) for operation, stats in STATS.items()}
+
+def timed(method):
+    """
+    Decorator that records the duration of every call of a Mongo method under "collection.method".
+    Only the outermost timed call is recorded, so a method that calls other timed methods is not counted twice.
+
+    :Parameters:
+        method: (function) Method that should be timed.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if getattr(TIMING, "active", False):
+            return method(self, *args, **kwargs)
+        TIMING.active = True
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            TIMING.active = False
+            record(self.name + "." + method.__name__, time.perf_counter() - start)
+    return wrapper
+
+def to_item(document):
+    """
+    Returns a document with its ObjectId converted to a string.
+
+    :Parameters:
+        document: (Dictionary) Document from the database.
+    """
+    document["_id"] = str(document["_id"])
+    return document
+
 
 class Mongo:
     """
     Module class that provides access to MongoDB with the ability to insert data into a collection and get data
 
     :Parameters:
-        client: (String) URI of the MongoDB you want to connect with.
+        client: (String/MongoClient) URI of the MongoDB you want to connect with, or a client, e.g. a mongomock.MongoClient.
         db_name: (String) Name of the Database you want to access.
         collection: (String) Name of the collection you want to have the data from.
     
     :Attributes:
-        __client: (MongoClient) holds the connection with the MongoDB.
+        __client: (MongoClient) holds the connection with the MongoDB, shared by every collection with the same URI.
         __db: (Database) holds the connection to the choosen database.
         __collection: (Collection) hold the connection to the choosen collection.
+        name: (String) name of the collection, used in the statistics.
     """
     def __init__(self, client, db_name, collection):
-        self.__client = mongo.MongoClient(client)
+        self.__client = get_client(client) if isinstance(client, str) else client
         self.__db = self.__client[db_name]
         self.__collection = self.__db[collection]
+        self.name = collection
     
-    def get_item_by_id(self, item_id):
+    @timed
+    def get_item_by_id(self, item_id, a_list=None):
         """
         Returns an Item by uuid
         
         :Parameters:
             item_id: (string) The MongoDB uuid from the item you want to retrieve.
+            a_list: ([string]) List of attributes that should be returned. Default None returns all attributes.
         """
-        item = self.__collection.find_one({"_id": ObjectId(item_id)})
-        item["_id"] = str(item["_id"])
-        return item
+        return to_item(self.__collection.find_one({"_id": ObjectId(item_id)}, a_list))
     
+    @timed
     def get_all_items(self):
         """Returns a list of all items from the collaction"""
-        
-        item_list = []
-        for item in self.__collection.find():
-            item["_id"] = str(item["_id"])
-            item_list.append(item)
-        
-        return item_list
+        return [to_item(item) for item in self.__collection.find()]
     
+    @timed
     def get_items_by_attribute(self, a_name, a_content):
         """
         Returns a list all items that has given attributes
@@ -50,13 +148,9 @@ class Mongo:
             a_name: (string) Name of the attribute you want look for.
             a_content: (string) Content/Identifier of the attribute you are looking for.
         """
-        item_list = []
-        for item in self.__collection.find({a_name: a_content}):
-            item["_id"] = str(item["_id"])
-            item_list.append(item)
-        
-        return item_list
+        return [to_item(item) for item in self.__collection.find({a_name: a_content})]
     
+    @timed
     def count_items_by_attribute(self, a_name, a_content):
         """
         Returns the number of items in the collection with given attributes.
@@ -67,10 +161,12 @@ class Mongo:
         """
         return self.__collection.count_documents({a_name: a_content})
     
+    @timed
     def count_all_items(self):
         """Returns the number of all items in the collections"""
         return self.__collection.count_documents({})
     
+    @timed
     def get_all_attributes(self, a_list):
         """
         Returns only the uuid and the wanted attributes from the collection.
@@ -82,12 +178,9 @@ class Mongo:
         for a in a_list:
             attribues_dict.setdefault(a, 1)
 
-        item_list = []
-        for item in self.__collection.find({}, attribues_dict):
-            item["_id"] = str(item["_id"])
-            item_list.append(item)
-        return item_list
+        return [to_item(item) for item in self.__collection.find({}, attribues_dict)]
     
+    @timed
     def get_attributes_with_condition(self, a_list, condition):
         """
         Returns all uuids and all wanted attributes from the collection with a given condition.
@@ -100,13 +193,10 @@ class Mongo:
         for a in a_list:
             attribues_dict.setdefault(a, 1)
 
-        item_list = []
-        for item in self.__collection.find(condition, attribues_dict):
-            item["_id"] = str(item["_id"])
-            item_list.append(item)
-        return item_list
+        return [to_item(item) for item in self.__collection.find(condition, attribues_dict)]
 
 
+    @timed
     def post_item(self, item):
         """
         Posts an item to the database if it fails returns false, otherwise true and returns the uuid.
@@ -118,6 +208,7 @@ class Mongo:
         result = self.__collection.insert_one(item)
         return [result.inserted_id, result.acknowledged]
 
+    @timed
     def post_many_items(self, items):
         """
         Posts an item to the database if it fails returns false, otherwise true.
@@ -128,6 +219,7 @@ class Mongo:
         result = self.__collection.insert_many(items)
         return result.acknowledged
     
+    @timed
     def update_item(self, item_id, content):
         """
         Updates the attributes of an item with given uuid. It Returns the number of the updated element.
@@ -138,6 +230,140 @@ class Mongo:
         """
         result = self.__collection.update_one({"_id": ObjectId(item_id)}, {"$set": content})
         return result.modified_count
+
+    @timed
+    def unset_attributes(self, item_id, a_list):
+        """
+        Removes the given attributes from an item with given uuid. It Returns the number of the updated element.
+
+        :Parameters:
+            item_id: (string) The MongoDB uuid from the item you want to update.
+            a_list: ([string]) List of attributes that should be removed.
+        """
+        result = self.__collection.update_one({"_id": ObjectId(item_id)}, {"$unset": {a: "" for a in a_list}})
+        return result.modified_count
+
+    @timed
+    def get_item_by_condition(self, condition, a_list=None):
+        """
+        Returns the first item with a given condition or None if there is no such item.
+
+        :Parameters:
+            condition: (Dictionary/JSON) Conditions that have to be fullfiled for the item.
+            a_list: ([string]) List of attributes that should be returned. Default None returns all attributes.
+        """
+        item = self.__collection.find_one(condition, a_list)
+        return to_item(item) if item is not None else None
+
+    @timed
+    def get_items_by_condition(self, condition, a_list=None, sort=None):
+        """
+        Returns a list of all items with a given condition.
+
+        :Parameters:
+            condition: (Dictionary/JSON) Conditions that have to be fullfiled for an item.
+            a_list: ([string]) List of attributes that should be returned. Default None returns all attributes.
+            sort: ([(string, int)]) List of (attribute, direction) pairs the items are sorted by.
+        """
+        cursor = self.__collection.find(condition, a_list)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        return [to_item(item) for item in cursor]
+
+    def iterate_items_by_condition(self, condition, a_list=None, sort=None):
+        """
+        Returns a generator over the items with a given condition, the items are fetched from the database in batches
+        while iterating instead of being held in a list.
+
+        :Parameters:
+            condition: (Dictionary/JSON) Conditions that have to be fullfiled for an item.
+            a_list: ([string]) List of attributes that should be returned. Default None returns all attributes.
+            sort: ([(string, int)]) List of (attribute, direction) pairs the items are sorted by.
+        """
+        cursor = self.__collection.find(condition, a_list)
+        if sort:
+            cursor = cursor.sort(sort)
+        # only the time spent fetching is recorded, not the time the caller spends between the items
+        items = iter(cursor)
+        seconds = 0.
+        try:
+            while True:
+                start = time.perf_counter()
+                item = next(items, None)
+                seconds += time.perf_counter() - start
+                if item is None:
+                    return
+                yield to_item(item)
+        finally:
+            cursor.close()
+            record(self.name + ".iterate_items_by_condition", seconds)
+
+    @timed
+    def replace_item_by_condition(self, condition, item):
+        """
+        Replaces the item with a given condition or inserts it if there is none. Returns the acknowledge.
+
+        :Parameters:
+            condition: (Dictionary/JSON) Conditions that identify the item.
+            item: (Dictionary/JSON) Item that should be stored.
+        """
+        result = self.__collection.replace_one(condition, item, upsert=True)
+        return result.acknowledged
+
+    @timed
+    def replace_items_by_conditions(self, pairs):
+        """
+        Replaces or inserts several items in one bulk write. Returns the acknowledge.
+
+        :Parameters:
+            pairs: ([(Dictionary, Dictionary)]) List of (condition, item) pairs like replace_item_by_condition takes them.
+        """
+        if not pairs:
+            return True
+        result = self.__collection.bulk_write(
+            [mongo.ReplaceOne(condition, item, upsert=True) for condition, item in pairs])
+        return result.acknowledged
+
+    @timed
+    def get_page(self, a_list, condition=None, after=None, limit=50):
+        """
+        Returns a page of items sorted by uuid and the uuid to continue after, or None if it was the last page.
+        The page continues after a uuid instead of skipping items, so every page is found through the _id index.
+
+        :Parameters:
+            a_list: ([string]) List of attributes that should be returned.
+            condition: (Dictionary/JSON) Conditions that have to be fullfiled for an item. Default None returns all items.
+            after: (string) uuid of the last item of the previous page. Default None starts with the first item.
+            limit: (Integer) Maximal number of items of the page. Default is 50.
+        """
+        condition = dict(condition or {})
+        if after is not None:
+            condition["_id"] = {"$gt": ObjectId(after)}
+        items = [to_item(item) for item in self.__collection.find(condition, a_list).sort("_id", 1).limit(limit)]
+        return items, (items[-1]["_id"] if len(items) == limit else None)
+
+    @timed
+    def delete_items_by_condition(self, condition):
+        """
+        Deletes all items with a given condition. Returns the number of deleted items.
+
+        :Parameters:
+            condition: (Dictionary/JSON) Conditions that have to be fullfiled for an item.
+        """
+        result = self.__collection.delete_many(condition)
+        return result.deleted_count
+
+    @timed
+    def create_index(self, keys, unique=False):
+        """
+        Creates an index on the collection if it does not exist yet.
+
+        :Parameters:
+            keys: ([(string, int)]) List of (attribute, direction) pairs of the index.
+            unique: (boolean) Flag if the index should be unique. False by default.
+        """
+        return self.__collection.create_index(keys, unique=unique)
     
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -1,20 +1,26 @@
 import torch
-import torchvision
 import json
 
 import re
 
 import torch.nn as nn
 import torch.optim as optim
-import torchvision.transforms as transforms
 import torch.nn.functional as F
 
 import numpy as np
 
 import collections
 
+import time
+
 from torch.autograd import Variable
 
+import dataset_loader
+
+import ablation
+
+import metrics
+
 
 class Sequential_Net(nn.Module):
     """
@@ -141,13 +147,34 @@ class Sequential_Net(nn.Module):
                 """
                 If the model is linear reshape the input.
                 """
-                x = x.view(x.shape[0], -1)
+                x = x.reshape(x.shape[0], -1)
             x = self.__getattr__(container)(x)
         return x
 
-    def train_start(self, num_epochs, trainloader, loss, opti, l_rate, device = "cpu"):
+    @staticmethod
+    def get_criterion(loss):
+        """
+        Returns the loss function of a name.
+
+        :Parameters:
+            loss: (string) Name of the loss function, e.g. "crossEntropy".
+        """
+        return Sequential_Net.__loss[loss]()
+
+    def get_optimizer(self, opti, l_rate):
+        """
+        Returns an optimizer of the parameters of the network.
+
+        :Parameters:
+            opti: (string) Name of the optimizer, e.g. "sgd".
+            l_rate: (Float) learningrate of the optimizer.
+        """
+        return Sequential_Net.__optimizer[opti](self.parameters(), lr=l_rate)
+
+    def train_start(self, num_epochs, trainloader, loss, opti, l_rate, device = "cpu", on_batch = None, on_epoch = None):
         """
         Train the neural network and returns a list with a dictionary for each epoch with weights.
+        If on_epoch is given the weights are handed to it after every epoch instead and the returned list is empty.
 
         :Parameters:
             num_epochs: (Integer) Number of epochs the network should be trained.
@@ -156,16 +183,22 @@ class Sequential_Net(nn.Module):
             loss: (string) Loss Function for the training.
             opti: (string) Function for the optimazation of the weights.
             l_rate: (Float) learningrate for the training.
+            on_batch: (function) Called with (epoch, batch_idx, number of batches, loss) every log interval. Default None.
+            on_epoch: (function) Called with (epoch, weights, metrics) after every epoch. Default None.
         """
         log_interval = 10
 
-        criterion = Sequential_Net.__loss[loss]()
+        criterion = Sequential_Net.get_criterion(loss)
 
-        optimizer = Sequential_Net.__optimizer[opti](self.parameters(), lr=l_rate)
+        optimizer = self.get_optimizer(opti, l_rate)
 
         # dict for storeing the weights after an epoch
         epoch_weights_list = []
         for epoch in range(num_epochs):
+            epoch_start = time.perf_counter()
+            epoch_loss = 0
+            epoch_correct = 0
+            epoch_samples = 0
             for batch_idx, (data, target) in enumerate(trainloader):
                 data, target = Variable(data), Variable(target)
                 if device == "cuda:0":
@@ -177,51 +210,68 @@ class Sequential_Net(nn.Module):
                 loss = criterion(net_out, target)
                 loss.backward()
                 optimizer.step()
+                epoch_loss += loss.data.item() * len(data)
+                epoch_correct += (net_out.data.max(1)[1] == target.data).sum().item()
+                epoch_samples += len(data)
                 if batch_idx % log_interval == 0:
+                    if on_batch is not None:
+                        on_batch(epoch, batch_idx, len(trainloader), loss.data.item())
                     print('Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}'.format(epoch, batch_idx * len(data),
                                                                                    len(trainloader.dataset),
                                                                                    100. * batch_idx / len(
                                                                                        trainloader),
                                                                                    loss.data.item()))
-            epoch_weights_list.append(get_weights(self))
+            epoch_seconds = time.perf_counter() - epoch_start
+            metrics.record_training(epoch_samples, epoch_seconds)
+            weights = get_weights(self, as_tensors=True)
+            if on_epoch is None:
+                epoch_weights_list.append(weights)
+            else:
+                on_epoch(epoch, weights, {
+                    "loss": epoch_loss / max(epoch_samples, 1),
+                    "accuracy": 100. * epoch_correct / max(epoch_samples, 1),
+                    "samples_per_second": epoch_samples / max(epoch_seconds, 1e-9)
+                })
         return epoch_weights_list
 
     def test_start(self, loss, testloader, device = "cpu"):
-        # test the net
-        criterion = Sequential_Net.__loss[loss]()
+        """
+        Test the neural network and returns the accuracy, a flag for every sample if it was classified correctly,
+        the accuracy of every class and the label of every sample.
+
+        :Parameters:
+            loss: (string) Loss Function for the test loss.
+            testloader: (testloader) Test data, its dataset has to provide the number of samples.
+            device: (String) Divice that will be used for the test. Default is cpu.
+        """
+        criterion = Sequential_Net.get_criterion(loss)
+        num_samples = len(testloader.dataset)
 
         test_loss = 0
-        correct = 0
-        correct_class = np.zeros(10)
-        correct_labels = np.array([], dtype=int)
-        class_labels = np.array([], dtype=int)
-        for i_batch, (data, target) in enumerate(testloader):
-            data, target = Variable(data), Variable(target)
-            if device == "cuda:0":
-                data, target = data.to(device), target.to(device)
-            # data = data.view(-1, 28 * 28)
-            net_out = self(data)
-            # sum up batch loss
-            test_loss += criterion(net_out, target).data.item()
-            pred = net_out.data.max(1)[1]  # get the index of the max log-probability
-            batch_labels = pred.eq(target.data)
-            correct_labels = np.append(correct_labels, batch_labels.cpu())
-            class_labels = np.append(class_labels, target.data.cpu())
-            for i_label in range(len(target)):
-                label = target[i_label].item()
-                correct_class[label] += batch_labels[i_label].item()
-            correct += batch_labels.sum()
-        test_loss /= len(testloader.dataset)
+        correct_labels = np.zeros(num_samples, dtype=int)
+        class_labels = np.zeros(num_samples, dtype=int)
+        position = 0
+        with inference_mode():
+            for data, target in testloader:
+                if device == "cuda:0":
+                    data, target = data.to(device), target.to(device)
+                net_out = self(data)
+                # sum up batch loss
+                test_loss += criterion(net_out, target).item()
+                pred = net_out.argmax(1)  # get the index of the max log-probability
+                batch_size = len(target)
+                correct_labels[position:position + batch_size] = pred.eq(target).cpu().numpy()
+                class_labels[position:position + batch_size] = target.cpu().numpy()
+                position += batch_size
+
+        correct = int(correct_labels.sum())
+        test_loss /= num_samples
         print('\nTest set: Average loss: {:.4f}, Accuracy: {}/{} ({:.2f}%)\n'.format(test_loss, correct,
-                                                                                     len(testloader.dataset),
-                                                                                     100. * correct.item() / len(
-                                                                                         testloader.dataset)))
-        acc = 100. * correct.item() / len(testloader.dataset)
-        # calculate class_acc
-        acc_class = np.zeros(10)
-        for i_label in range(10):
-            num = (testloader.dataset.test_labels.numpy() == i_label).sum()
-            acc_class[i_label] = correct_class[i_label] / num
+                                                                                     num_samples,
+                                                                                     100. * correct / num_samples))
+        acc = 100. * correct / num_samples
+        num_classes = len(getattr(testloader.dataset, "classes", []))
+        acc_class = get_class_accuracy(correct_labels, class_labels, num_classes)
         return acc, correct_labels, acc_class, class_labels
 
     def predict(self, _input):
@@ -233,34 +283,110 @@ class Sequential_Net(nn.Module):
         """
         return self(_input).tolist()
     
-    def visualize_input(self, x):
+    def forward_layers(self, x, on_output, masks = {}):
         """
-        Returns a Dictionary of input visualization.
+        Runs the input through the network like forward and returns the output. The outputs of every layer module
+        and of its activation are passed to on_output on the way, so they can be captured without a second forward pass.
 
         :Parameters:
-            x: Input that should be vizualize.
+            x: Input of the network.
+            on_output: (function) Called with (container, layer, tap, output), e.g. ("features", "layer_0", "layer", x).
+                tap is "layer" for the output of the layer module and "activation" for the output of its activation.
+            masks: (Dictionary) (container, layer name) -> unit mask of a single ablation like ablation.build_masks returns it. Default no ablation.
         """
-        feature_dict = collections.OrderedDict()
-
         for container in self.layer_settings:
             layers = self.layer_settings[container]
+            modules = self.__getattr__(container)
             layer_counter = 0
             is_linear = False
-            feature_dict[container] = {}
             for layer in layers:
                 if layers[layer]["type"] == "linear" and not is_linear:
-                    x = x.view(x.shape[0], -1)
+                    x = x.reshape(x.shape[0], -1)
                     is_linear = True
 
-                x = self.__getattr__(container).__getattr__(layers[layer]["type"] + str(layer_counter))(x)
-                # if layers[layer]["activation"] != "none":
-                #     x = self.__getattr__(container).__getattr__(layers[layer]["activation"] + str(layer_counter))(x)
-                feature_dict[container].update({"layer_" + str(layer_counter): x.data.numpy().tolist()})
+                layer_name = layers[layer]["type"] + str(layer_counter)
+                x = modules.__getattr__(layer_name)(x)
+                if (container, layer_name) in masks:
+                    x = ablation.apply_mask(x, masks[(container, layer_name)], x.shape[0], False)
+                on_output(container, layer, "layer", x)
+                if layers[layer]["activation"] != "none":
+                    x = modules.__getattr__(layers[layer]["activation"] + str(layer_counter))(x)
+                    on_output(container, layer, "activation", x)
 
                 layer_counter += 1
-        
+
+        return x
+
+    def visualize_input(self, x, masks = {}):
+        """
+        Returns a Dictionary of input visualization, the output of every layer module before its activation.
+
+        :Parameters:
+            x: Input that should be vizualize.
+            masks: (Dictionary) (container, layer name) -> unit mask of a single ablation like ablation.build_masks returns it. Default no ablation.
+        """
+        feature_dict = collections.OrderedDict((container, {}) for container in self.layer_settings)
+
+        def on_output(container, layer, tap, output):
+            if tap == "layer":
+                feature_dict[container][layer] = output.data.numpy().tolist()
+
+        with inference_mode():
+            self.forward_layers(x, on_output, masks)
         return feature_dict
 
+    def get_layer_output(self, x, container, layer):
+        """
+        Returns the output of a layer, the same tap visualize_input returns for it. The layers behind it are not computed.
+
+        :Parameters:
+            x: Input batch.
+            container: (string) Name of the container, e.g. "features".
+            layer: (string) Name of the layer in the container, e.g. "layer_1".
+        """
+        layer_name = self.layer_settings[container][layer]["type"] + layer[len("layer_"):]
+        for name in self.layer_settings:
+            if self.layer_settings[name]["layer_0"]["type"] == "linear":
+                x = x.reshape(x.shape[0], -1)
+            for module_name, module in self.__getattr__(name).named_children():
+                x = module(x)
+                if name == container and module_name == layer_name:
+                    return x
+        raise KeyError(container + "." + layer)
+
+def inference_mode():
+    """
+    Returns a context that disables autograd, torch.inference_mode if the torch version has it.
+    """
+    if hasattr(torch, "inference_mode"):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+def get_class_counts(correct_labels, class_labels, num_classes = 0):
+    """
+    Returns the number of correctly classified samples and the number of samples of every class.
+
+    :Parameters:
+        correct_labels: (np.array) 1 for every correctly classified sample, 0 otherwise.
+        class_labels: (np.array) Label of every sample.
+        num_classes: (Integer) Minimal number of classes. Default 0 uses the highest label.
+    """
+    correct_class = np.bincount(class_labels, weights=correct_labels, minlength=num_classes)
+    num_class = np.bincount(class_labels, minlength=num_classes)
+    return correct_class, num_class
+
+def get_class_accuracy(correct_labels, class_labels, num_classes = 0):
+    """
+    Returns the accuracy of every class. Classes without samples get the accuracy 0.
+
+    :Parameters:
+        correct_labels: (np.array) 1 for every correctly classified sample, 0 otherwise.
+        class_labels: (np.array) Label of every sample.
+        num_classes: (Integer) Minimal number of classes. Default 0 uses the highest label.
+    """
+    correct_class, num_class = get_class_counts(correct_labels, class_labels, num_classes)
+    return np.divide(correct_class, num_class, out=np.zeros(len(num_class)), where=num_class > 0)
+
 def create_model(input_dim, layers):
     """
     Creates and Return a neural network model for given input.
@@ -271,7 +397,7 @@ def create_model(input_dim, layers):
     """
     return Sequential_Net(input_dim, layers)
 
-def train_model(model, num_epochs, criterion, optimizer, trainset, batchsize, l_rate, device = "cpu"):
+def train_model(model, num_epochs, criterion, optimizer, trainset, batchsize, l_rate, device = "cpu", on_batch = None, on_epoch = None, config = None):
     """
     Trains a given model and returns for each epochs a list of layer dictionary with weights.
 
@@ -284,11 +410,15 @@ def train_model(model, num_epochs, criterion, optimizer, trainset, batchsize, l_
         batchsize: (Integer) Number of the Batches it should be used while training.
         l_rate: (Float) learningrate for the training.
         device: (String) Divice that will be used for the training. Default is cpu.
+        on_batch: (function) Called with (epoch, batch_idx, number of batches, loss) every log interval. Default None.
+        on_epoch: (function) Called with (epoch, weights, metrics) after every epoch. Default None.
+        config: (Dictionary) Execution settings of the loader like execution.get_config returns them. Default the process settings.
     """
-    trainloader = torch.utils.data.DataLoader(trainset, batch_size=batchsize, shuffle=True, num_workers=2)
-    return model.train_start(num_epochs, trainloader, criterion, optimizer, l_rate, device)
+    trainloader = dataset_loader.get_loader(trainset, batchsize, shuffle=True, config=config)
+    with metrics.stage("train"):
+        return model.train_start(num_epochs, trainloader, criterion, optimizer, l_rate, device, on_batch, on_epoch)
 
-def test_model(model, criterion, testset, batchsize, device = "cpu"):
+def test_model(model, criterion, testset, batchsize, device = "cpu", config = None):
     """
     Test the model and returns usefull values (will be more concrete later)
 
@@ -298,16 +428,19 @@ def test_model(model, criterion, testset, batchsize, device = "cpu"):
         testset: Testset of input data.
         batchsize: (Integer) Number of the Batches it should be used while training.
         device: (String) Divice that will be used for the training. Default is cpu.
+        config: (Dictionary) Execution settings of the loader like execution.get_config returns them. Default the process settings.
     """
-    testloader = torch.utils.data.DataLoader(testset, batch_size=batchsize, shuffle=False, num_workers=2)
-    return model.test_start(criterion, testloader, device)
+    testloader = dataset_loader.get_loader(testset, batchsize, shuffle=False, config=config)
+    with metrics.stage("test"):
+        return model.test_start(criterion, testloader, device)
 
-def get_weights(model):
+def get_weights(model, as_tensors=False):
     """
     Returns a weights dictionary of the actual weights split in Layers from a given neural network model for saving in a json.
 
     :Parameters: 
         model: (Net) Neural network model from getting the weights and bias from.
+        as_tensors: (boolean) Flag for returning copies of the tensors instead of lists. False by default.
     """
     weights_dict = collections.OrderedDict()
     
@@ -320,8 +453,13 @@ def get_weights(model):
             else:
                 layer_number = int(re.findall("\d+", layer)[0])
                 layer_name = layers[layer]["type"] + str(layer_number)
-                weights = model.__getattr__(container).__getattr__(layer_name).state_dict()["weight"].tolist()
-                bias = model.__getattr__(container).__getattr__(layer_name).state_dict()["bias"].tolist()
+                state_dict = model.__getattr__(container).__getattr__(layer_name).state_dict()
+                if as_tensors:
+                    weights = state_dict["weight"].detach().cpu().clone()
+                    bias = state_dict["bias"].detach().cpu().clone()
+                else:
+                    weights = state_dict["weight"].tolist()
+                    bias = state_dict["bias"].tolist()
                 weights_dict[container][layer] = ({
                     "settings": layers[layer],
                     "weights": weights,
@@ -339,19 +477,29 @@ def load_model_from_weights(weights_dict, input_dim, epoch = -1):
         input_dim: ([Integer]) Input dimension for the neural network as Array. Example: [x], [x, y], [x, y, z]
         epoch: (Integer) Wiche epoch the weights should be loaden from. Default = -1, it loads the leatest epoch.
     """
-    ordered_dict = collections.OrderedDict()
-    layer_build_dict = collections.OrderedDict()
     epoch_num = str(weights_dict["epochs"]) if epoch is -1 else str(epoch)
     last_epoch = "epoch_" + epoch_num
-    # for every layer in the last epoch of weights_dict it creates a weights and bias tensor and add it to the ordered_dict
-    for container, layers in weights_dict[last_epoch].items():
+    return load_model_from_epoch(weights_dict[last_epoch], input_dim)
+
+def load_model_from_epoch(epoch_weights, input_dim):
+    """
+    Returns a Pytorch model load from the weights of a single epoch.
+
+    :Parameters: 
+        epoch_weights: (Dictionary) Dictionary of layers with weights, bias and types. Weights can be lists or tensors.
+        input_dim: ([Integer]) Input dimension for the neural network as Array. Example: [x], [x, y], [x, y, z]
+    """
+    ordered_dict = collections.OrderedDict()
+    layer_build_dict = collections.OrderedDict()
+    # for every layer of the epoch it creates a weights and bias tensor and add it to the ordered_dict
+    for container, layers in epoch_weights.items():
         for layer in layers:
             if not "Pool" in layers[layer]["settings"]["type"]:
                 layer_number = int(re.findall("\d+", layer)[0])
                 attribute_name = container + "." + layers[layer]["settings"]["type"] + str(layer_number) 
 
-                ordered_dict[attribute_name + ".weight"] = torch.Tensor(layers[layer]["weights"])
-                ordered_dict[attribute_name + ".bias"] = torch.Tensor(layers[layer]["bias"])
+                ordered_dict[attribute_name + ".weight"] = torch.as_tensor(layers[layer]["weights"], dtype=torch.float32)
+                ordered_dict[attribute_name + ".bias"] = torch.as_tensor(layers[layer]["bias"], dtype=torch.float32)
             layer_build_dict.setdefault(container, []).append(layers[layer]["settings"])
     
     model = create_model(input_dim, layer_build_dict)
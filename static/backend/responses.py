@@ -0,0 +1,209 @@
+import gzip
+import json
+
+from flask import Response, request
+
+import numpy as np
+
+import metrics
+
+# the fast serializers and brotli are optional, without them the standard library is used
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# binary encodings of arrays, chosen with the format query parameter
+ENCODINGS = ["float32", "int16", "uint8"]
+
+# headers that describe a binary array, the browser may only read them if they are exposed
+ARRAY_HEADERS = ["X-Shape", "X-Dtype", "X-Scale", "X-Offset"]
+
+# responses smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+
+def get_requested_encoding(default = None):
+    """
+    Returns the binary encoding the request asks for with the format query parameter or the Accept header,
+    or the default (None for json).
+
+    :Parameters:
+        default: (string) Encoding if the request does not ask for one. Default None.
+    """
+    encoding = request.args.get("format")
+    if encoding in ENCODINGS:
+        return encoding
+    if request.accept_mimetypes.best == "application/octet-stream":
+        return "float32"
+    return default
+
+def encode_array(array, encoding = "float32"):
+    """
+    Returns the raw little-endian bytes of an array and the headers that describe them.
+    "float32" stores the values as they are, "int16" and "uint8" quantize them to value = quantized * X-Scale + X-Offset.
+
+    :Parameters:
+        array: (np.array) Array that should be encoded.
+        encoding: (string) "float32", "int16" or "uint8". Default is float32.
+    """
+    array = np.asarray(array, dtype=np.float32)
+    headers = {"X-Shape": ",".join(str(dim) for dim in array.shape), "X-Dtype": encoding}
+
+    if encoding == "float32":
+        data = np.ascontiguousarray(array, dtype="<f4").tobytes()
+    elif encoding == "int16":
+        low = float(array.min()) if array.size else 0.
+        high = float(array.max()) if array.size else 0.
+        offset = (high + low) / 2
+        scale = (high - low) / 65534 or 1.
+        quantized = np.round((array - offset) / scale).astype("<i2")
+        data = np.ascontiguousarray(quantized).tobytes()
+        headers.update({"X-Scale": repr(scale), "X-Offset": repr(offset)})
+    elif encoding == "uint8":
+        offset = float(array.min()) if array.size else 0.
+        scale = ((float(array.max()) - offset) / 255 if array.size else 0.) or 1.
+        quantized = np.round((array - offset) / scale).astype(np.uint8)
+        data = np.ascontiguousarray(quantized).tobytes()
+        headers.update({"X-Scale": repr(scale), "X-Offset": repr(offset)})
+    else:
+        raise ValueError("Unknown encoding: " + str(encoding))
+    return data, headers
+
+def array_response(array, encoding = "float32"):
+    """
+    Returns a binary response of an array with the describing headers.
+
+    :Parameters:
+        array: (np.array) Array that should be sent.
+        encoding: (string) "float32", "int16" or "uint8". Default is float32.
+    """
+    data, headers = encode_array(array, encoding)
+    return Response(data, mimetype="application/octet-stream", headers=headers)
+
+def to_serializable(value):
+    """
+    Returns numpy arrays, numpy scalars and tensors as python values for the serializers, raises a TypeError for anything else.
+
+    :Parameters:
+        value: Value the serializer does not know.
+    """
+    if hasattr(value, "detach"):
+        value = value.detach().cpu().numpy()
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError("Object of type {} is not serializable".format(type(value).__name__))
+
+def round_floats(value, digits):
+    """
+    Returns a copy of a json like structure with every float rounded to a number of decimal digits.
+    Arrays and tensors are rounded as a whole and returned as numpy arrays.
+
+    :Parameters:
+        value: Structure of dictionaries, lists, floats, numpy arrays and tensors.
+        digits: (Integer) Number of decimal digits.
+    """
+    if hasattr(value, "detach"):
+        value = value.detach().cpu().numpy()
+    if isinstance(value, np.ndarray):
+        return np.round(value, digits) if np.issubdtype(value.dtype, np.floating) else value
+    if isinstance(value, float):
+        return round(value, digits)
+    if isinstance(value, dict):
+        return type(value)((key, round_floats(item, digits)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [round_floats(item, digits) for item in value]
+    return value
+
+def get_requested_serialization():
+    """Returns "msgpack" if the request accepts application/msgpack more than json and msgpack is installed, otherwise "json"."""
+    best = request.accept_mimetypes.best_match(["application/json", "application/msgpack"], "application/json")
+    if best == "application/msgpack" and msgpack is not None:
+        return "msgpack"
+    return "json"
+
+@metrics.timed_stage("serialize")
+def serialize(data, precision = None):
+    """
+    Returns a response with the data serialized like the request asks for it: MessagePack if it accepts application/msgpack,
+    otherwise json. numpy arrays and tensors can be put into the data directly, they are not converted to lists first with orjson.
+    Floats are rounded to precision decimal digits, by default to the ?precision= of the request if it has one.
+
+    :Parameters:
+        data: Json like structure of the response.
+        precision: (Integer) Number of decimal digits of the floats. Default None uses the request or does not round.
+    """
+    if precision is None:
+        precision = request.args.get("precision", type=int)
+    if precision is not None:
+        data = round_floats(data, precision)
+
+    if get_requested_serialization() == "msgpack":
+        return Response(msgpack.packb(data, default=to_serializable, use_bin_type=True), mimetype="application/msgpack")
+    if orjson is not None:
+        body = orjson.dumps(data, default=to_serializable, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    else:
+        body = json.dumps(data, default=to_serializable)
+    return Response(body, mimetype="application/json")
+
+@metrics.timed_stage("compress")
+def compress(response):
+    """
+    Compresses the body of a response with brotli or gzip if the request accepts it. Streamed responses, small bodies,
+    and responses that are already encoded are sent as they are. Registered as after_request handler of the app.
+
+    :Parameters:
+        response: (flask.Response) Response of the request.
+    """
+    if response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers:
+        return response
+    if response.status_code < 200 or response.status_code >= 300:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and "br" in accepted:
+        response.set_data(brotli.compress(data, quality=4))
+        response.headers["Content-Encoding"] = "br"
+    elif "gzip" in accepted:
+        response.set_data(gzip.compress(data, compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        return response
+    response.vary.add("Accept-Encoding")
+    return response
+
+def cacheable(response, etag, max_age = 86400):
+    """
+    Adds an ETag and Cache-Control to a response and returns 304 Not Modified if the browser already has the content.
+    The response is compressed here already, so the ETag can name its encoding, every encoding needs its own strong ETag.
+
+    :Parameters:
+        response: (flask.Response) Response of the request.
+        etag: (string) Identifier of the content.
+        max_age: (Integer) Seconds the browser may use the content without asking again. Default is one day.
+    """
+    response = compress(response)
+    encoding = response.headers.get("Content-Encoding")
+    response.set_etag(etag + "-" + encoding if encoding else etag)
+    # the format and the encoding of the content are negotiated, so caches must not mix them
+    response.vary.add("Accept")
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+
+if __name__ == "__main__":
+    pass
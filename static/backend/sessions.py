@@ -0,0 +1,122 @@
+import contextlib
+import threading
+import time
+
+import neural_network_module as neural_network
+
+import ablation
+
+
+# header the frontend sends to identify its session, requests without it share the default session
+SESSION_HEADER = "X-Session-ID"
+DEFAULT_SESSION = "default"
+
+
+class Session:
+    """
+    Model and ablation state of one user session.
+
+    :Attributes:
+        model: (Sequential_Net) model of the selected network, shared with the model cache.
+        model_dict: (Dictionary) network document of the selected network without weights.
+        ablation_nodes: ([Dictionary]) ablated nodes of the model, empty if tests should use the model itself.
+        last_access: (Float) time of the last request of this session.
+        lock: (threading.RLock) serializes the requests of this session.
+    """
+    def __init__(self):
+        self.model = neural_network.Sequential_Net()
+        self.model_dict = {}
+        self.ablation_nodes = []
+        self.last_access = time.time()
+        self.lock = threading.RLock()
+
+    def get_test_model(self, model = None):
+        """
+        Returns a masked view of the model if nodes are ablated, otherwise the model.
+
+        :Parameters:
+            model: (Sequential_Net) Version of the model that should be used, e.g. an optimized one. Default the model of the session.
+        """
+        model = self.model if model is None else model
+        if self.ablation_nodes:
+            return ablation.MaskedNet(model, self.ablation_nodes)
+        return model
+
+
+class SessionStore:
+    """
+    Thread-safe mapping of session ids to their Session. Sessions that were idle longer than the timeout are removed.
+
+    :Parameters:
+        timeout: (Integer) Seconds a session may be idle before it is removed.
+
+    :Attributes:
+        __sessions: (Dictionary) session id -> Session.
+        __lock: (threading.Lock) guards the sessions dictionary.
+        timeout: (Integer) seconds a session may be idle before it is removed.
+    """
+    def __init__(self, timeout=3600):
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+        self.timeout = timeout
+
+    def get(self, session_id):
+        """
+        Returns the Session for the id and creates it if it does not exist.
+
+        :Parameters:
+            session_id: (string) id of the session.
+        """
+        now = time.time()
+        with self.__lock:
+            for expired in [key for key, session in self.__sessions.items() if now - session.last_access > self.timeout]:
+                del self.__sessions[expired]
+            session = self.__sessions.get(session_id)
+            if session is None:
+                session = Session()
+                self.__sessions[session_id] = session
+            session.last_access = now
+            return session
+
+    def count(self):
+        """Returns the number of active sessions."""
+        with self.__lock:
+            return len(self.__sessions)
+
+
+class KeyedLocks:
+    """
+    Hands out one lock per key, e.g. to serialize the training of the same network.
+    A lock is removed again when no thread holds or waits for it, so the keys do not pile up.
+
+    :Attributes:
+        __locks: (Dictionary) key -> [threading.Lock, number of threads that hold or wait for it].
+        __lock: (threading.Lock) guards the locks dictionary.
+    """
+    def __init__(self):
+        self.__locks = {}
+        self.__lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def get(self, key):
+        """
+        Returns a context that holds the lock for the key.
+
+        :Parameters:
+            key: Hashable key the lock belongs to.
+        """
+        with self.__lock:
+            entry = self.__locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.__lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.__locks[key]
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,165 @@
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import neural_network_module as neural_network
+
+import dataset_loader
+
+import metrics
+
+
+# training settings that can differ between the networks trained together, every other setting is shared
+NETWORK_SETTINGS = ["loss", "optimizer", "learningrate"]
+
+
+def check_architecture(models):
+    """
+    Raises a ValueError unless every model has the same layers and parameter shapes as the first one.
+
+    :Parameters:
+        models: ([Sequential_Net]) Networks that should be trained together.
+    """
+    reference = models[0]
+    shapes = [parameter.shape for parameter in reference.parameters()]
+    for model in models[1:]:
+        if model.layer_settings != reference.layer_settings or [parameter.shape for parameter in model.parameters()] != shapes:
+            raise ValueError("The networks do not share an architecture.")
+
+def apply_activation(layer, stacked, num_models):
+    """
+    Applies an activation layer to the stacked outputs. Softmax is applied per network over its own units,
+    every other activation works on each value alone.
+
+    :Parameters:
+        layer: (nn.Module) Activation layer of the networks.
+        stacked: (torch.Tensor) Stacked outputs, (N, networks * channels, height, width) or (N, networks, units).
+        num_models: (Integer) Number of stacked networks.
+    """
+    if not isinstance(layer, nn.Softmax):
+        return layer(stacked)
+    if stacked.dim() == 3:
+        return F.softmax(stacked, dim=2)
+    shape = stacked.shape
+    return F.softmax(stacked.reshape(shape[0], num_models, -1, shape[2], shape[3]), dim=2).reshape(shape)
+
+def stacked_forward(models, x):
+    """
+    Passes a batch through networks of the same architecture at once and returns their outputs with the shape (N, networks, ...).
+    The convolutions of the networks run as one grouped convolution on their stacked channels, the linear layers as one
+    batched matrix product. The stacked weights are built from the parameters of every network, so the gradients reach them.
+
+    :Parameters:
+        models: ([Sequential_Net]) Networks with the same layers.
+        x: (torch.Tensor) Input batch shared by every network.
+    """
+    num_models = len(models)
+    batch_size = x.shape[0]
+    reference = models[0]
+    # None before the first layer, then (N, networks * channels, height, width) in conv containers, (N, networks, units) in linear ones
+    stacked = None
+    for container in reference.layer_settings:
+        if reference.layer_settings[container]["layer_0"]["type"] == "linear":
+            if stacked is None:
+                stacked = x.reshape(batch_size, 1, -1).expand(batch_size, num_models, -1)
+            elif stacked.dim() == 4:
+                stacked = stacked.reshape(batch_size, num_models, -1)
+        elif stacked is None:
+            stacked = x.repeat(1, num_models, 1, 1)
+
+        for layers in zip(*[getattr(model, container).children() for model in models]):
+            layer = layers[0]
+            if isinstance(layer, nn.Conv2d):
+                weight = torch.cat([model_layer.weight for model_layer in layers])
+                bias = torch.cat([model_layer.bias for model_layer in layers])
+                stacked = F.conv2d(stacked, weight, bias, layers[0].stride, layers[0].padding, layers[0].dilation, layers[0].groups * num_models)
+            elif isinstance(layer, nn.Linear):
+                weight = torch.stack([model_layer.weight for model_layer in layers])
+                bias = torch.stack([model_layer.bias for model_layer in layers])
+                stacked = torch.einsum("nki,koi->nko", stacked, weight) + bias
+            else:
+                # pooling and activations work on every channel alone
+                stacked = apply_activation(layer, stacked, num_models)
+
+    if stacked.dim() == 4:
+        stacked = stacked.reshape(batch_size, num_models, -1, stacked.shape[2], stacked.shape[3])
+    return stacked
+
+def train_stacked(models, num_epochs, settings, trainloader, device = "cpu", on_batch = None, on_epoch = None):
+    """
+    Trains networks of the same architecture together: every batch is read once and passed through all of them
+    with stacked_forward. Every network keeps its own parameters, loss function and optimizer, so its weights are updated
+    like Sequential_Net.train_start would update them.
+
+    :Parameters:
+        models: ([Sequential_Net]) Networks with the same layers.
+        num_epochs: (Integer) Number of epochs the networks should be trained.
+        settings: ([Dictionary]) "loss", "optimizer" and "learningrate" of every network.
+        trainloader: (trainloader) Train data shared by the networks.
+        device: (String) Divice that will be used for the training. Default is cpu.
+        on_batch: (function) Called with (epoch, batch_idx, number of batches, mean loss of the networks) every log interval. Default None.
+        on_epoch: (function) Called with (index of the network, epoch, weights, metrics) for every network after every epoch. Default None.
+    """
+    check_architecture(models)
+    log_interval = 10
+
+    criteria = [neural_network.Sequential_Net.get_criterion(setting["loss"]) for setting in settings]
+    optimizers = [model.get_optimizer(setting["optimizer"], setting["learningrate"]) for model, setting in zip(models, settings)]
+
+    for epoch in range(num_epochs):
+        epoch_start = time.perf_counter()
+        epoch_loss = torch.zeros(len(models), dtype=torch.float64)
+        epoch_correct = torch.zeros(len(models), dtype=torch.long)
+        epoch_samples = 0
+        for batch_idx, (data, target) in enumerate(trainloader):
+            if device == "cuda:0":
+                data, target = data.to(device), target.to(device)
+            for optimizer in optimizers:
+                optimizer.zero_grad()
+            net_out = stacked_forward(models, data)
+            losses = torch.stack([criterion(net_out[:, index], target) for index, criterion in enumerate(criteria)])
+            # the networks share no parameters, so every network gets the gradient of its own loss
+            losses.sum().backward()
+            for optimizer in optimizers:
+                optimizer.step()
+            epoch_loss += losses.detach().double().cpu() * len(data)
+            epoch_correct += (net_out.detach().argmax(2) == target.unsqueeze(1)).sum(0).cpu()
+            epoch_samples += len(data)
+            if batch_idx % log_interval == 0 and on_batch is not None:
+                on_batch(epoch, batch_idx, len(trainloader), losses.mean().item())
+
+        epoch_seconds = time.perf_counter() - epoch_start
+        metrics.record_training(epoch_samples * len(models), epoch_seconds)
+        if on_epoch is None:
+            continue
+        for index, model in enumerate(models):
+            on_epoch(index, epoch, neural_network.get_weights(model, as_tensors=True), {
+                "loss": epoch_loss[index].item() / max(epoch_samples, 1),
+                "accuracy": 100. * epoch_correct[index].item() / max(epoch_samples, 1),
+                "samples_per_second": epoch_samples / max(epoch_seconds, 1e-9)
+            })
+
+def train_models(models, num_epochs, settings, trainset, batchsize, device = "cpu", on_batch = None, on_epoch = None, config = None):
+    """
+    Trains networks of the same architecture together on a trainset, like neural_network_module.train_model trains one.
+
+    :Parameters:
+        models: ([Sequential_Net]) Networks with the same layers.
+        num_epochs: (Integer) Number of epochs the networks should be trained.
+        settings: ([Dictionary]) "loss", "optimizer" and "learningrate" of every network.
+        trainset: Trainset of input data.
+        batchsize: (Integer) Number of the Batches it should be used while training.
+        device: (String) Divice that will be used for the training. Default is cpu.
+        on_batch: (function) Called with (epoch, batch_idx, number of batches, mean loss) every log interval. Default None.
+        on_epoch: (function) Called with (index of the network, epoch, weights, metrics) after every epoch. Default None.
+        config: (Dictionary) Execution settings of the loader like execution.get_config returns them. Default the process settings.
+    """
+    trainloader = dataset_loader.get_loader(trainset, batchsize, shuffle=True, config=config)
+    with metrics.stage("train"):
+        train_stacked(models, num_epochs, settings, trainloader, device, on_batch, on_epoch)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,107 @@
+import os
+
+import mongo_module as mongo
+
+import weight_store
+
+import local_storage
+
+
+class MongoStorage:
+    """
+    Storage backend on a MongoDB: every collection is a mongo_module.Mongo, the weights are binary blobs in the weights collection.
+
+    A storage backend provides:
+        get_collection(name): a collection with the methods of mongo_module.Mongo that the backend uses
+            (get_item_by_id, post_item, update_item, unset_attributes, get_all_attributes, get_page, get_item_by_condition,
+            get_items_by_condition, iterate_items_by_condition, replace_item_by_condition, replace_items_by_conditions,
+            delete_items_by_condition, create_index).
+        get_weight_store(dtype, keyframe_interval, compress): a store with the methods of weight_store.WeightStore.
+
+    :Parameters:
+        uri: (string) URI of the MongoDB.
+        db_name: (string) Name of the database. Default is networkDB.
+
+    :Attributes:
+        uri: (string) URI of the MongoDB.
+        db_name: (string) name of the database.
+    """
+    def __init__(self, uri, db_name="networkDB"):
+        self.uri = uri
+        self.db_name = db_name
+
+    def get_collection(self, name):
+        """
+        Returns a collection of the storage.
+
+        :Parameters:
+            name: (string) Name of the collection, e.g. "networks".
+        """
+        return mongo.Mongo(self.uri, self.db_name, name)
+
+    def get_weight_store(self, dtype="float32", keyframe_interval=0, compress=False):
+        """
+        Returns the store of the epoch weights.
+
+        :Parameters:
+            dtype: (string) Type the weights are stored with. Default is float32.
+            keyframe_interval: (Integer) Number of epochs from one keyframe to the next. Default is 0.
+            compress: (boolean) Flag for compressing the stored weights. False by default.
+        """
+        return weight_store.WeightStore(self.get_collection("weights"), dtype, keyframe_interval, compress)
+
+
+class LocalStorage:
+    """
+    Storage backend in a local directory without a database server: the documents are in a SQLite file,
+    the weights are memory-mapped .npy files. Provides the same methods as MongoStorage.
+
+    :Parameters:
+        directory: (string) Directory of the storage.
+
+    :Attributes:
+        directory: (string) directory of the storage.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get_collection(self, name):
+        """
+        Returns a collection of the storage.
+
+        :Parameters:
+            name: (string) Name of the collection, e.g. "networks".
+        """
+        return local_storage.SQLiteCollection(os.path.join(self.directory, "metadata.sqlite"), name)
+
+    def get_weight_store(self, dtype="float32", keyframe_interval=0, compress=False):
+        """
+        Returns the store of the epoch weights. The .npy files are memory-mapped, so they are neither compressed nor delta encoded.
+
+        :Parameters:
+            dtype: (string) Type the weights are stored with. Default is float32.
+            keyframe_interval: (Integer) Ignored, every epoch is stored in full.
+            compress: (boolean) Ignored, the files are not compressed.
+        """
+        return local_storage.FileWeightStore(os.path.join(self.directory, "weights"), dtype)
+
+
+def get_storage(environ = os.environ):
+    """
+    Returns the storage backend chosen with STORAGE: "mongo" (default) uses the MongoDB of mongo_module.get_uri,
+    "local" stores everything in STORAGE_DIR (default ../data/storage).
+
+    :Parameters:
+        environ: (Dictionary) Environment variables. Default os.environ.
+    """
+    backend = environ.get("STORAGE", "mongo")
+    if backend == "mongo":
+        return MongoStorage(mongo.get_uri(environ))
+    if backend == "local":
+        return LocalStorage(environ.get("STORAGE_DIR", "../data/storage"))
+    raise ValueError("Unknown storage backend: " + str(backend))
+
+
+if __name__ == "__main__":
+    pass
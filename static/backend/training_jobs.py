@@ -0,0 +1,233 @@
+import collections
+import concurrent.futures
+import json
+import threading
+import time
+import traceback
+import uuid
+
+
+class JobCancelled(Exception):
+    """Raised inside a job, e.g. in the training loop, when the job was cancelled."""
+    pass
+
+
+class Job:
+    """
+    A task that is executed in the background and publishes its progress as events.
+
+    :Parameters:
+        network_id: (string) uuid of the network the job works on.
+        settings: (Dictionary) Settings of the job from the request.
+
+    :Attributes:
+        id: (string) id of the job.
+        network_id: (string) uuid of the network the job works on.
+        settings: (Dictionary) settings of the job from the request.
+        status: (string) "queued", "running", "finished", "cancelled" or "failed".
+        events: ([Dictionary]) published events in the order they happened.
+        result: result of the job once it is finished.
+        error: (string) error message if the job failed.
+        __cancelled: (threading.Event) set when the job should stop.
+        __condition: (threading.Condition) notifies waiting streams about new events.
+    """
+    def __init__(self, network_id, settings):
+        self.id = uuid.uuid4().hex
+        self.network_id = network_id
+        self.settings = settings
+        self.status = "queued"
+        self.events = []
+        self.result = None
+        self.error = None
+        self.__cancelled = threading.Event()
+        self.__condition = threading.Condition()
+
+    def publish(self, event_type, data):
+        """
+        Adds an event and wakes up every waiting stream.
+
+        :Parameters:
+            event_type: (string) Type of the event, e.g. "batch", "epoch" or "status".
+            data: (Dictionary) Content of the event.
+        """
+        with self.__condition:
+            self.events.append({"type": event_type, "time": time.time(), "data": data})
+            self.__condition.notify_all()
+
+    def set_status(self, status):
+        """
+        Changes the status of the job and publishes it.
+
+        :Parameters:
+            status: (string) New status of the job.
+        """
+        self.status = status
+        self.publish("status", {"status": status, "error": self.error})
+
+    def cancel(self):
+        """Requests the job to stop at its next check."""
+        self.__cancelled.set()
+
+    def is_cancelled(self):
+        """Returns True if the job should stop."""
+        return self.__cancelled.is_set()
+
+    def get_network_ids(self):
+        """Returns the ids of the networks the job works on."""
+        return list(self.network_id) if isinstance(self.network_id, (list, tuple)) else [self.network_id]
+
+    def is_done(self):
+        """Returns True if the job does not run anymore."""
+        return self.status in ("finished", "cancelled", "failed")
+
+    def wait_for_events(self, start, timeout=15):
+        """
+        Returns the events from index start on, waits up to timeout seconds if there are none yet.
+
+        :Parameters:
+            start: (Integer) Index of the first event that should be returned.
+            timeout: (Float) Seconds to wait for new events.
+        """
+        with self.__condition:
+            if len(self.events) <= start and not self.is_done():
+                self.__condition.wait(timeout)
+            return self.events[start:]
+
+    def stream(self):
+        """Generator of server-sent events with every event of the job until it is done."""
+        index = 0
+        while True:
+            events = self.wait_for_events(index)
+            if not events:
+                if self.is_done():
+                    return
+                # comment line that keeps the connection open
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                yield "event: {}\ndata: {}\n\n".format(event["type"], json.dumps(event["data"]))
+            index += len(events)
+
+    def get_state(self):
+        """Returns a json serializable summary of the job."""
+        last_epoch = None
+        for event in reversed(self.events):
+            if event["type"] == "epoch":
+                last_epoch = event["data"]
+                break
+        return {
+            "jobId": self.id,
+            "networkID": self.network_id,
+            "status": self.status,
+            "error": self.error,
+            "lastEpoch": last_epoch
+        }
+
+
+class TrainingJob(Job):
+    """
+    A training run that is executed in the background, publishes the batch losses and can be cancelled between batches.
+    """
+    def on_batch(self, epoch, batch_idx, num_batches, loss):
+        """
+        Callback for the training loop. Publishes the loss of a batch and stops the training if the job was cancelled.
+
+        :Parameters:
+            epoch: (Integer) Index of the actual epoch in this run.
+            batch_idx: (Integer) Index of the batch in the epoch.
+            num_batches: (Integer) Number of batches in an epoch.
+            loss: (Float) Loss of the batch.
+        """
+        if self.is_cancelled():
+            raise JobCancelled()
+        self.publish("batch", {"epoch": epoch, "batch": batch_idx, "batches": num_batches, "loss": loss})
+
+
+class JobManager:
+    """
+    Runs jobs in a pool of worker threads and keeps the latest jobs for status requests.
+
+    :Parameters:
+        max_workers: (Integer) Number of jobs that run at the same time.
+        max_jobs: (Integer) Number of jobs that are kept for status requests.
+
+    :Attributes:
+        __executor: (concurrent.futures.ThreadPoolExecutor) runs the jobs.
+        __jobs: (collections.OrderedDict) job id -> Job, oldest first.
+        __lock: (threading.Lock) guards the jobs dictionary.
+        max_jobs: (Integer) number of jobs that are kept for status requests.
+    """
+    def __init__(self, max_workers=2, max_jobs=100):
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.__jobs = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.max_jobs = max_jobs
+
+    def submit(self, job, run, exclusive=False, deduplicate=False):
+        """
+        Queues a job and returns it.
+
+        :Parameters:
+            job: (Job) Job that should be executed.
+            run: (function) Function that gets the job as argument, does the work and returns the result.
+            exclusive: (boolean) Flag for not queueing the job while an unfinished job works on one of its networks,
+                None is returned then. False by default.
+            deduplicate: (boolean) Flag for not queueing the job while an unfinished job has the same networks and settings,
+                that job is returned then. False by default.
+        """
+        with self.__lock:
+            network_ids = set(job.get_network_ids())
+            for other in self.__jobs.values():
+                if other.is_done():
+                    continue
+                if exclusive and network_ids.intersection(other.get_network_ids()):
+                    return None
+                if deduplicate and other.network_id == job.network_id and other.settings == job.settings:
+                    return other
+            self.__jobs[job.id] = job
+            while len(self.__jobs) > self.max_jobs:
+                oldest = next(iter(self.__jobs))
+                if not self.__jobs[oldest].is_done():
+                    break
+                del self.__jobs[oldest]
+        self.__executor.submit(self.__run, job, run)
+        return job
+
+    def get(self, job_id):
+        """
+        Returns the job with the id or None.
+
+        :Parameters:
+            job_id: (string) id of the job.
+        """
+        with self.__lock:
+            return self.__jobs.get(job_id)
+
+    def get_jobs(self):
+        """Returns a list with the summaries of all kept jobs."""
+        with self.__lock:
+            jobs = list(self.__jobs.values())
+        return [job.get_state() for job in jobs]
+
+    def __run(self, job, run):
+        """
+        Private Method: Executes a job and sets its status.
+
+        :Parameters:
+            job: (Job) Job that should be executed.
+            run: (function) Function that does the work.
+        """
+        job.set_status("running")
+        try:
+            job.result = run(job)
+            job.set_status("finished")
+        except JobCancelled:
+            job.set_status("cancelled")
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.set_status("failed")
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,83 @@
+import collections
+import threading
+import time
+import traceback
+
+
+class WarmUp:
+    """
+    Runs the warm-up steps of the backend in a background thread after the start, e.g. loading the datasets and
+    the latest networks, so the first requests do not pay for it. The backend is ready once every step finished,
+    a failed step is reported but does not keep the backend from getting ready.
+
+    :Parameters:
+        steps: ([(string, function)]) Name and function of every step, they run in this order.
+
+    :Attributes:
+        __steps: ([(string, function)]) name and function of every step.
+        __lock: (threading.Lock) guards the state of the steps.
+        __state: (collections.OrderedDict) name -> {"status": "pending", "running", "done" or "failed", "seconds", "error"}.
+        __thread: (threading.Thread) thread that runs the steps, None until the warm-up is started.
+        __finished: (threading.Event) set when every step finished.
+    """
+    def __init__(self, steps):
+        self.__steps = steps
+        self.__lock = threading.Lock()
+        self.__state = collections.OrderedDict((name, {"status": "pending", "seconds": None, "error": None}) for name, _ in steps)
+        self.__thread = None
+        self.__finished = threading.Event()
+
+    def start(self):
+        """Starts running the steps in the background, calling it again has no effect."""
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def wait(self, timeout = None):
+        """
+        Blocks until every step finished or the timeout passed and returns if the backend is ready.
+
+        :Parameters:
+            timeout: (float) Maximal number of seconds to wait. Default None waits until the end.
+        """
+        return self.__finished.wait(timeout)
+
+    def is_ready(self):
+        """Returns if every step finished."""
+        return self.__finished.is_set()
+
+    def get_state(self):
+        """Returns a dictionary with the readiness and a copy of the state of every step."""
+        with self.__lock:
+            steps = collections.OrderedDict((name, dict(state)) for name, state in self.__state.items())
+        return {"ready": self.is_ready(), "steps": steps}
+
+    def __run(self):
+        """Private Method: Runs the steps in order and records their duration and errors."""
+        for name, step in self.__steps:
+            self.__update(name, status="running")
+            start = time.perf_counter()
+            try:
+                step()
+                self.__update(name, status="done", seconds=time.perf_counter() - start)
+            except Exception as e:
+                traceback.print_exc()
+                self.__update(name, status="failed", seconds=time.perf_counter() - start, error=str(e))
+        self.__finished.set()
+
+    def __update(self, name, **state):
+        """
+        Private Method: Changes the state of a step.
+
+        :Parameters:
+            name: (string) Name of the step.
+            state: Changed values of the state.
+        """
+        with self.__lock:
+            self.__state[name].update(state)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,100 @@
+import json
+import struct
+
+import torch
+
+import responses
+
+
+# what a frame of an epoch holds: the values, the difference to the previous frame or only summary statistics
+MODES = ["values", "delta", "stats"]
+
+
+def encode_frame(header, payload = b""):
+    """
+    Returns a frame of the weight history stream: the byte length of the json header and of the payload
+    as two little-endian uint32, followed by the json header and the payload.
+
+    :Parameters:
+        header: (Dictionary) Json serializable description of the frame.
+        payload: (bytes) Binary content of the frame. Default is empty.
+    """
+    header = json.dumps(header).encode("utf-8")
+    return struct.pack("<II", len(header), len(payload)) + header + payload
+
+def get_stats(values, bins = 32):
+    """
+    Returns summary statistics of a tensor: norm, mean, std, min, max and a histogram with bins equal bins between min and max.
+
+    :Parameters:
+        values: (torch.Tensor) Values of a layer.
+        bins: (Integer) Number of histogram bins. Default is 32.
+    """
+    values = values.reshape(-1).float()
+    low, high = float(values.min()), float(values.max())
+    return {
+        "norm": float(values.norm()),
+        "mean": float(values.mean()),
+        "std": float(values.std()) if len(values) > 1 else 0.,
+        "min": low,
+        "max": high,
+        "histogram": torch.histc(values, bins, low, high).long().tolist()
+    }
+
+def stream_frames(epochs, container, layer, tensor = "weights", mode = "values", encoding = "float32", units = None, bins = 32):
+    """
+    Generator of the frames of one layer's weight history, one frame per epoch and a last frame {"kind": "end"}.
+    Values and deltas are sent binary with responses.encode_array, the header holds "epoch", "kind", "shape", "dtype"
+    and for quantized encodings "scale" and "offset". Stats frames have no payload, their header holds the statistics
+    and the norm of the change to the previous epoch.
+
+    :Parameters:
+        epochs: (generator) (epoch number, weights) tuples like WeightStore.iter_epochs returns them.
+        container: (string) Name of the container.
+        layer: (string) Name of the layer in the container.
+        tensor: (string) "weights" or "bias". Default is weights.
+        mode: (string) One of MODES. Default is values.
+        encoding: (string) Binary encoding of values and deltas, one of responses.ENCODINGS. Default is float32.
+        units: ([Integer]) Only these output units of the layer are sent. Default all units.
+        bins: (Integer) Number of histogram bins of stats frames. Default is 32.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown mode: " + str(mode))
+    if encoding not in responses.ENCODINGS:
+        raise ValueError("Unknown encoding: " + str(encoding))
+
+    previous = None
+    count = 0
+    for epoch, weights in epochs:
+        values = weights.get(container, {}).get(layer, {}).get(tensor)
+        if values is None:
+            continue
+        if units is not None:
+            values = values.index_select(0, torch.as_tensor(units, dtype=torch.long))
+
+        header = {"epoch": epoch, "kind": mode}
+        if mode == "stats":
+            header.update(get_stats(values, bins))
+            header["deltaNorm"] = float((values - previous).norm()) if previous is not None else None
+            frame = encode_frame(header)
+        else:
+            # the first frame of a delta stream holds the values the deltas add up to
+            if mode == "delta" and previous is not None:
+                content = values - previous
+            else:
+                content = values
+                header["kind"] = "values"
+            data, array_headers = responses.encode_array(content.numpy(), encoding)
+            header.update({"shape": list(content.shape), "dtype": encoding})
+            if "X-Scale" in array_headers:
+                header.update({"scale": float(array_headers["X-Scale"]), "offset": float(array_headers["X-Offset"])})
+            frame = encode_frame(header, data)
+
+        previous = values
+        count += 1
+        yield frame
+    yield encode_frame({"kind": "end", "epochs": count})
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,437 @@
+import collections
+import threading
+import warnings
+import zlib
+
+import numpy as np
+import torch
+
+
+# supported storage types of the weights: name -> (torch dtype, numpy dtype, integer type of the same size)
+DTYPES = {
+    "float32": (torch.float32, np.float32, np.int32),
+    "float16": (torch.float16, np.float16, np.int16)
+}
+
+# codecs of compressed blobs: "shuffle-zlib" stores the values, "xor-shuffle-zlib" their bits xor-ed with the keyframe.
+# The bytes are grouped by their position in the value before zlib, so the mostly equal sign and exponent bytes compress well.
+CODECS = ["shuffle-zlib", "xor-shuffle-zlib"]
+
+# number of networks whose latest keyframe is kept in memory for saving the following epochs
+MAX_KEYFRAMES = 8
+
+
+def shuffle_compress(array, level=6):
+    """
+    Returns the bytes of an array grouped by their position in the value and compressed with zlib.
+
+    :Parameters:
+        array: (np.array) Array that should be compressed.
+        level: (Integer) zlib compression level. Default is 6.
+    """
+    planes = np.ascontiguousarray(array).reshape(-1).view(np.uint8).reshape(-1, array.itemsize).T
+    return zlib.compress(np.ascontiguousarray(planes).tobytes(), level)
+
+def shuffle_decompress(data, dtype, shape):
+    """
+    Returns the array of bytes that were compressed with shuffle_compress.
+
+    :Parameters:
+        data: (bytes) Compressed bytes.
+        dtype: (np.dtype) Type of the array.
+        shape: ([Integer]) Shape of the array.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    planes = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+def encode_tensor(value, dtype="float32", compress=False, base=None):
+    """
+    Returns a dictionary with the raw bytes, the shape and the dtype of a tensor for saving in the database.
+    Compressed tensors additionally name their codec, with a base tensor only the bits that changed against it are stored.
+
+    :Parameters:
+        value: (torch.Tensor/list) Tensor or nested list that should be encoded.
+        dtype: (string) Type the values are stored with. Default is float32.
+        compress: (boolean) Flag for compressing the bytes. False by default.
+        base: (torch.Tensor) Tensor of the keyframe the value is stored as difference to. Default None stores the value itself.
+    """
+    _, np_dtype, int_dtype = DTYPES[dtype]
+    array = torch.as_tensor(value, dtype=torch.float32).detach().cpu().numpy()
+    array = np.ascontiguousarray(array, dtype=np_dtype)
+    blob = {
+        "dtype": dtype,
+        "shape": list(array.shape)
+    }
+    if base is not None and list(base.shape) == blob["shape"]:
+        base_array = np.ascontiguousarray(base.numpy(), dtype=np_dtype)
+        blob.update({"codec": "xor-shuffle-zlib", "data": shuffle_compress(array.view(int_dtype) ^ base_array.view(int_dtype))})
+    elif compress or base is not None:
+        blob.update({"codec": "shuffle-zlib", "data": shuffle_compress(array)})
+    else:
+        blob["data"] = array.tobytes()
+    return blob
+
+def decode_tensor(blob, base=None):
+    """
+    Returns a float32 tensor for an encoded tensor dictionary. Uncompressed float32 blobs are not copied.
+
+    :Parameters:
+        blob: (Dictionary) Encoded tensor with the keys dtype, shape, data and optionally codec.
+        base: (torch.Tensor) Tensor of the keyframe, needed for blobs with the xor codec. Default None.
+    """
+    torch_dtype, np_dtype, int_dtype = DTYPES[blob["dtype"]]
+    codec = blob.get("codec")
+    if codec == "shuffle-zlib":
+        return torch.from_numpy(shuffle_decompress(blob["data"], np_dtype, blob["shape"])).float()
+    if codec == "xor-shuffle-zlib":
+        if base is None:
+            raise ValueError("The keyframe of a delta encoded tensor is missing.")
+        bits = shuffle_decompress(blob["data"], int_dtype, blob["shape"])
+        base_array = np.ascontiguousarray(base.numpy(), dtype=np_dtype)
+        return torch.from_numpy((bits ^ base_array.view(int_dtype)).view(np_dtype)).float()
+
+    with warnings.catch_warnings():
+        # the bytes from the database are read-only, the tensor is only read when loading the state dict
+        warnings.simplefilter("ignore", UserWarning)
+        tensor = torch.frombuffer(blob["data"], dtype=torch_dtype).view(blob["shape"])
+    if torch_dtype != torch.float32:
+        tensor = tensor.float()
+    return tensor
+
+def is_encoded(value):
+    """
+    Returns True if the value is an encoded tensor dictionary.
+
+    :Parameters:
+        value: Value that should be checked.
+    """
+    return isinstance(value, dict) and "data" in value and "shape" in value
+
+def map_weights(weights, function, base=None):
+    """
+    Returns a copy of an epoch weights dictionary with the function applied to every weights and bias entry.
+
+    :Parameters:
+        weights: (collections.OrderedDict) Weights of an epoch like it is returned by neural_network_module.get_weights.
+        function: (function) Function that is applied to every weights and bias value.
+        base: (collections.OrderedDict) Weights of another epoch, if given the function gets the matching value of it
+            as second argument (None if it has no such value). Default None.
+    """
+    result = collections.OrderedDict()
+    for container, layers in weights.items():
+        result[container] = collections.OrderedDict()
+        for layer, content in layers.items():
+            if base is None:
+                result[container][layer] = {
+                    key: (function(value) if key in ("weights", "bias") else value)
+                    for key, value in content.items()
+                }
+            else:
+                base_content = base.get(container, {}).get(layer, {})
+                result[container][layer] = {
+                    key: (function(value, base_content.get(key)) if key in ("weights", "bias") else value)
+                    for key, value in content.items()
+                }
+    return result
+
+def get_stored_bytes(weights):
+    """
+    Returns the number of bytes the encoded weights of an epoch use and the number of bytes they use as float32.
+
+    :Parameters:
+        weights: (collections.OrderedDict) Weights of an epoch with encoded tensors.
+    """
+    stored_bytes = 0
+    raw_bytes = 0
+    for layers in weights.values():
+        for content in layers.values():
+            for key in ("weights", "bias"):
+                if key in content:
+                    stored_bytes += len(content[key]["data"])
+                    raw_bytes += int(np.prod(content[key]["shape"])) * 4
+    return stored_bytes, raw_bytes
+
+def to_lists(weights):
+    """
+    Returns the weights of an epoch with nested lists for the json response.
+
+    :Parameters:
+        weights: (collections.OrderedDict) Weights of an epoch with tensors, lists or encoded tensors.
+    """
+    def convert(value):
+        if is_encoded(value):
+            value = decode_tensor(value)
+        if isinstance(value, torch.Tensor):
+            return value.tolist()
+        return value
+    return map_weights(weights, convert)
+
+def get_projection(container=None, layer=None):
+    """
+    Returns the attributes that have to be loaded for a whole epoch, a container or a single layer.
+
+    :Parameters:
+        container: (string) Name of the container. Default None for all containers.
+        layer: (string) Name of the layer in the container. Default None for all layers.
+    """
+    if container is None:
+        return None
+    key = "weights." + container
+    if layer is not None:
+        key += "." + layer
+    return ["network_id", "epoch", "keyframe", key]
+
+
+class WeightStore:
+    """
+    Stores the weights of every epoch as binary blobs in its own collection, one document per network and epoch.
+    With a keyframe interval K every K-th epoch is a keyframe with compressed values, the epochs in between only store
+    the compressed xor of their bits with the keyframe, which is lossless and reconstructed when the epoch is loaded.
+
+    :Parameters:
+        connection: (mongo_module.Mongo) Connection to the collection the epochs are stored in.
+        dtype: (string) Type the weights are stored with. "float32" or "float16", default is float32.
+        keyframe_interval: (Integer) Number of epochs from one keyframe to the next, 0 or 1 stores every epoch on its own. Default is 0.
+        compress: (boolean) Flag for compressing the stored weights. False by default.
+
+    :Attributes:
+        __connection: (mongo_module.Mongo) holds the connection to the weights collection.
+        __keyframes: (collections.OrderedDict) network id -> (epoch, weights) of the latest keyframe that was saved or loaded for saving,
+            least recently used first.
+        __lock: (threading.Lock) guards the keyframes.
+        dtype: (string) type the weights are stored with.
+        keyframe_interval: (Integer) number of epochs from one keyframe to the next.
+        compress: (boolean) flag for compressing the stored weights.
+    """
+    def __init__(self, connection, dtype="float32", keyframe_interval=0, compress=False):
+        self.__connection = connection
+        self.__keyframes = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.dtype = dtype
+        self.keyframe_interval = keyframe_interval
+        self.compress = compress
+        self.__connection.create_index([("network_id", 1), ("epoch", 1)], unique=True)
+
+    def save_epoch(self, network_id, epoch, weights):
+        """
+        Saves the weights of one epoch of a network. An existing epoch gets replaced.
+        Epochs between keyframes are stored as difference to their keyframe, so the keyframe has to be saved first.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            epoch: (Integer) Number of the epoch.
+            weights: (collections.OrderedDict) Weights of the epoch with tensors or lists.
+        """
+        return self.save_epochs(network_id, {epoch: weights})
+
+    def save_epochs(self, network_id, epochs):
+        """
+        Saves several epochs of a network in one bulk write. Existing epochs get replaced.
+        Stored epochs that are differences to a replaced keyframe are deleted, they cannot be reconstructed from the new one.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            epochs: (Dictionary) Epoch number -> weights of the epoch with tensors or lists.
+        """
+        pairs = [
+            ({"network_id": network_id, "epoch": epoch}, self.__encode_epoch(network_id, epoch, epochs[epoch]))
+            for epoch in sorted(epochs)
+        ]
+        try:
+            result = self.__connection.replace_items_by_conditions(pairs)
+        except Exception:
+            # a keyframe that was not written must not be the base of the next epochs
+            with self.__lock:
+                self.__keyframes.pop(network_id, None)
+            raise
+
+        keyframes = [item["epoch"] for _, item in pairs if item["keyframe"] == item["epoch"]]
+        if keyframes:
+            # the epochs of this write were encoded against the new keyframes, every other one of them is stale
+            self.__connection.delete_items_by_condition({
+                "network_id": network_id,
+                "keyframe": {"$in": keyframes},
+                "epoch": {"$nin": sorted(epochs)}
+            })
+        return result
+
+    def load_epoch(self, network_id, epoch, container=None, layer=None):
+        """
+        Returns the weights of one epoch of a network with tensors or None if the epoch is not stored.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            epoch: (Integer) Number of the epoch.
+            container: (string) Only loads the layers of this container. Default None loads all containers.
+            layer: (string) Only loads this layer of the container. Default None loads all layers.
+        """
+        item = self.__connection.get_item_by_condition(
+            {"network_id": network_id, "epoch": epoch},
+            get_projection(container, layer))
+        if item is None:
+            return None
+        return self.__decode_item(item, container, layer, {})
+
+    def load_epochs(self, network_id, start=0, limit=None, container=None, layer=None):
+        """
+        Returns an OrderedDict of the stored epochs of a network with the epoch number as key.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            start: (Integer) First epoch that is loaded. Default is 0.
+            limit: (Integer) Maximal number of epochs that are loaded. Default None loads all epochs.
+            container: (string) Only loads the layers of this container. Default None loads all containers.
+            layer: (string) Only loads this layer of the container. Default None loads all layers.
+        """
+        end = None if limit is None else start + limit
+        return collections.OrderedDict(self.iter_epochs(network_id, start, end, 1, container, layer))
+
+    def iter_epochs(self, network_id, start=0, end=None, step=1, container=None, layer=None):
+        """
+        Returns a generator of (epoch number, weights) tuples in epoch order. Only one epoch and its keyframe are held in memory at a time.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            start: (Integer) First epoch that is loaded. Default is 0.
+            end: (Integer) Epoch after the last one that is loaded. Default None loads to the last epoch.
+            step: (Integer) Only every step-th epoch from start on is loaded. Default is 1.
+            container: (string) Only loads the layers of this container. Default None loads all containers.
+            layer: (string) Only loads this layer of the container. Default None loads all layers.
+        """
+        condition = {"network_id": network_id, "epoch": {"$gte": start}}
+        if end is not None:
+            condition["epoch"]["$lt"] = end
+        if step > 1:
+            # the step is applied to the epoch numbers here, $mod is not supported by every backend (e.g. mongomock)
+            epochs = [item["epoch"] for item in self.__connection.iterate_items_by_condition(condition, ["epoch"])]
+            condition["epoch"] = {"$in": sorted(epoch for epoch in epochs if (epoch - start) % step == 0)}
+
+        keyframes = {}
+        items = self.__connection.iterate_items_by_condition(condition, get_projection(container, layer), sort=[("epoch", 1)])
+        for item in items:
+            yield item["epoch"], self.__decode_item(item, container, layer, keyframes)
+
+    def get_storage_stats(self, network_id):
+        """
+        Returns the number of stored epochs and keyframes, the stored bytes, the bytes the weights use as float32
+        and their ratio. Epochs that were saved before the sizes were recorded are not counted in the bytes.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+        """
+        stats = {"epochs": 0, "keyframes": 0, "storedBytes": 0, "rawBytes": 0}
+        items = self.__connection.iterate_items_by_condition(
+            {"network_id": network_id},
+            ["epoch", "keyframe", "stored_bytes", "raw_bytes"])
+        for item in items:
+            stats["epochs"] += 1
+            stats["keyframes"] += item.get("keyframe", item["epoch"]) == item["epoch"]
+            stats["storedBytes"] += item.get("stored_bytes", 0)
+            stats["rawBytes"] += item.get("raw_bytes", 0)
+        stats["compressionRatio"] = stats["rawBytes"] / stats["storedBytes"] if stats["storedBytes"] else None
+        return stats
+
+    def load_settings(self, network_id):
+        """
+        Returns the layer settings of a network as a dictionary of containers with lists of layer settings.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+        """
+        weights = self.load_epoch(network_id, 0)
+        if weights is None:
+            return None
+        return collections.OrderedDict(
+            (container, [layers[layer]["settings"] for layer in layers])
+            for container, layers in weights.items())
+
+    def __encode_epoch(self, network_id, epoch, weights):
+        """
+        Private Method: Returns the document of an epoch with its encoded weights. A keyframe is kept in memory for the following epochs.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            epoch: (Integer) Number of the epoch.
+            weights: (collections.OrderedDict) Weights of the epoch with tensors or lists.
+        """
+        keyframe = None
+        if self.keyframe_interval > 1 and epoch % self.keyframe_interval != 0:
+            keyframe = self.__get_keyframe(network_id, epoch - epoch % self.keyframe_interval)
+
+        if keyframe is None:
+            encoded = map_weights(weights, lambda value: encode_tensor(value, self.dtype, self.compress))
+            keyframe_epoch = epoch
+        else:
+            encoded = map_weights(weights, lambda value, base: encode_tensor(value, self.dtype, True, base), keyframe)
+            keyframe_epoch = epoch - epoch % self.keyframe_interval
+
+        if keyframe_epoch == epoch and self.keyframe_interval > 1:
+            self.__remember_keyframe(network_id, epoch, map_weights(encoded, decode_tensor))
+
+        stored_bytes, raw_bytes = get_stored_bytes(encoded)
+        return {
+            "network_id": network_id,
+            "epoch": epoch,
+            "keyframe": keyframe_epoch,
+            "stored_bytes": stored_bytes,
+            "raw_bytes": raw_bytes,
+            "weights": encoded
+        }
+
+    def __decode_item(self, item, container, layer, keyframes):
+        """
+        Private Method: Returns the weights of a stored epoch with tensors, epochs between keyframes are reconstructed from their keyframe.
+
+        :Parameters:
+            item: (Dictionary) Stored epoch document.
+            container: (string) Container the document was loaded with.
+            layer: (string) Layer the document was loaded with.
+            keyframes: (Dictionary) keyframe epoch -> loaded weights, reused by consecutive epochs of the same keyframe.
+        """
+        weights = item.get("weights", {})
+        keyframe = item.get("keyframe", item["epoch"])
+        if keyframe == item["epoch"]:
+            return map_weights(weights, decode_tensor)
+        if keyframe not in keyframes:
+            keyframes.clear()
+            keyframes[keyframe] = self.load_epoch(item["network_id"], keyframe, container, layer)
+            if keyframes[keyframe] is None:
+                raise ValueError("Keyframe {} of epoch {} is missing.".format(keyframe, item["epoch"]))
+        return map_weights(weights, decode_tensor, keyframes[keyframe])
+
+    def __get_keyframe(self, network_id, epoch):
+        """
+        Private Method: Returns the weights of a keyframe for saving the following epochs or None if it is not stored.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            epoch: (Integer) Number of the keyframe.
+        """
+        with self.__lock:
+            keyframe = self.__keyframes.get(network_id)
+        if keyframe is not None and keyframe[0] == epoch:
+            return keyframe[1]
+        weights = self.load_epoch(network_id, epoch)
+        if weights is not None:
+            self.__remember_keyframe(network_id, epoch, weights)
+        return weights
+
+    def __remember_keyframe(self, network_id, epoch, weights):
+        """
+        Private Method: Keeps the latest keyframe of a network in memory and forgets the least recently used networks.
+
+        :Parameters:
+            network_id: (string) uuid of the network.
+            epoch: (Integer) Number of the keyframe.
+            weights: (collections.OrderedDict) Weights of the keyframe with tensors.
+        """
+        with self.__lock:
+            self.__keyframes[network_id] = (epoch, weights)
+            self.__keyframes.move_to_end(network_id)
+            while len(self.__keyframes) > MAX_KEYFRAMES:
+                self.__keyframes.popitem(last=False)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,5 @@
+import main
+
+
+# entry point of the WSGI server: gunicorn wsgi:app
+app = main.create_app()